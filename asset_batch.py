@@ -0,0 +1,383 @@
+"""
+asset_batch.py
+
+Headless batch publishing across a pool of mayapy processes
+
+- takes a json job list, each job opens a scene, optionally runs a fix-up script on it and publishes it
+  through AssetStore.publish, so versions, masters and notes land exactly where a publish from the browser
+  puts them
+- leaving out "source" republishes the asset's current master, with a "script" that's how a rig wide fix
+  gets pushed through 200 assets without anyone clicking through them
+- jobs run on a pool of long-lived mayapy workers, maya starts once per worker instead of once per job, and
+  a worker that crashes or hangs past the timeout is killed and replaced
+- failed jobs are retried on the next free worker, every job gets its own log with everything maya and the
+  publish printed for each attempt
+
+    [{"source": "/jobs/heromodel.ma", "project": "PROJECT1", "creature": "sphereman", "base_name": "heromodel",
+      "notes": "Rig fix", "format": "mb"},
+     {"project": "PROJECT1", "creature": "sphereman", "base_name": "sphererig", "script": "/fixes/knee.py"}]
+
+    python asset_batch.py run JOBS.json [--workers 4] [--retries 2] [--timeout 1800] [--log-directory DIR]
+                                        [--mayapy PATH] [--report PATH] [--asset-directory PATH]
+
+"""
+
+import argparse
+import json
+import os
+import queue
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import namedtuple
+from contextlib import contextmanager
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 2
+DEFAULT_TIMEOUT = 30 * 60
+STARTUP_TIMEOUT = 5 * 60
+# Workers are replaced after this many jobs, maya doesn't give all of its memory back between scenes
+RECYCLE_AFTER = 50
+FORMATS = {'ma': 'ma', 'mb': 'mb', 'mayaAscii': 'ma', 'mayaBinary': 'mb'}
+DEFAULT_BATCH_NOTES = 'Batch publish'
+# Every line a worker sends back starts with this, anything else on its stdout is ignored
+PROTOCOL_PREFIX = '@@baal '
+
+BatchJob = namedtuple('BatchJob', ['index', 'source', 'project', 'creature', 'base_name', 'notes', 'file_format',
+                                   'script'])
+JobResult = namedtuple('JobResult', ['job', 'ok', 'attempts', 'version', 'version_path', 'master_path', 'log_path',
+                                     'error'])
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def default_mayapy(settings):
+    # mayapy from settings, then from MAYA_LOCATION, then whatever is on the PATH
+    if settings.get("mayapy"):
+        return settings["mayapy"]
+    if os.environ.get('MAYA_LOCATION'):
+        executable = 'mayapy.exe' if sys.platform.startswith('win') else 'mayapy'
+        return os.path.join(os.environ['MAYA_LOCATION'], 'bin', executable)
+    return 'mayapy'
+
+
+def load_jobs(path):
+    # BatchJobs from a json list of job objects (or {"jobs": [...]}), raises ValueError naming the bad job
+    with open(path, 'r') as jobs_file:
+        data = json.load(jobs_file)
+    if isinstance(data, dict):
+        data = data.get('jobs')
+    if not isinstance(data, list):
+        raise ValueError(f"{path} should hold a list of jobs.")
+    return [parse_job(index, job) for index, job in enumerate(data)]
+
+
+def parse_job(index, job):
+    if not isinstance(job, dict):
+        raise ValueError(f"Job {index} isn't a json object.")
+    for key in ('project', 'creature', 'base_name'):
+        if not str(job.get(key) or '').strip():
+            raise ValueError(f"Job {index} is missing '{key}'.")
+    base_name = job['base_name'].strip()
+    if base_name.endswith('_master') or os.sep in base_name or '/' in base_name:
+        raise ValueError(f"Job {index} has an invalid base_name '{base_name}'.")
+    source = job.get('source')
+    if source and not os.path.exists(source):
+        raise ValueError(f"Job {index}: {source} doesn't exist.")
+    script = job.get('script')
+    if script and not os.path.exists(script):
+        raise ValueError(f"Job {index}: script {script} doesn't exist.")
+    file_format = job.get('format')
+    if file_format is not None and file_format not in FORMATS:
+        raise ValueError(f"Job {index} has an unknown format '{file_format}', expected one of {', '.join(FORMATS)}.")
+    return BatchJob(index, source, job['project'].strip(), job['creature'].strip(), base_name,
+                    job.get('notes') or DEFAULT_BATCH_NOTES, FORMATS.get(file_format), script)
+
+
+def job_log_path(log_directory, job):
+    return os.path.join(log_directory, f"{job.index:04d}_{job.creature}_{job.base_name}.log")
+
+
+# Worker side, runs inside mayapy
+
+def master_path(store, job):
+    # The asset's current master, what a job without a source republishes
+    for extension in ('.mb', '.ma'):
+        path = os.path.join(store.creature_directory(job.project, job.creature), f"{job.base_name}_master{extension}")
+        if os.path.exists(path):
+            return path
+    raise ValueError(f"{job.base_name} has no master in {job.project}/{job.creature} to republish.")
+
+
+def publish_job(store, job):
+    # Open the job's scene, run its script and publish it, returns the PublishResult
+    from asset_store import maya_cmds
+    cmds = maya_cmds()
+    source = job.source or master_path(store, job)
+    cmds.file(new=True, force=True)
+    store.open_file(source)
+    print(f"Opened {source}")
+    if job.script:
+        print(f"Running {job.script}")
+        runpy.run_path(job.script, init_globals={'cmds': cmds, 'job': job._asdict()}, run_name='__main__')
+    namespaces = store.custom_namespaces()
+    if namespaces:
+        print(f"Warning: There are namespaces in the scene ({', '.join(namespaces)}).")
+    file_format = job.file_format or ('mb' if source.endswith(('.mb', '.mb.gz')) else 'ma')
+    result = store.publish(job.project, job.creature, job.base_name, job.notes, save_as_binary=file_format == 'mb')
+    cmds.file(new=True, force=True)
+    return result
+
+
+@contextmanager
+def redirected_output(log_path):
+    # Point this process's stdout and stderr at log_path at the file descriptor level, so maya's own
+    # output ends up in the job's log along with ours
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(log_path, 'a') as log_file:
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def worker_main(asset_directory=None):
+    # One mayapy worker, takes a job per line on stdin and answers on the stdout it started with
+    protocol = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    def send(message):
+        protocol.write(PROTOCOL_PREFIX + json.dumps(message) + '\n')
+        protocol.flush()
+
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if asset_directory:
+        settings["asset_directory"] = asset_directory
+    store = AssetStore(settings)
+    send({'ready': True, 'pid': os.getpid()})
+
+    for line in sys.stdin:
+        message = json.loads(line)
+        job = BatchJob(**message['job'])
+        with redirected_output(message['log']):
+            try:
+                result = publish_job(store, job)
+                reply = {'ok': True, 'result': result._asdict()}
+            except Exception as e:
+                traceback.print_exc()
+                reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        send(reply)
+    store.close()
+    try:
+        maya.standalone.uninitialize()
+    except (AttributeError, RuntimeError):
+        pass
+    return 0
+
+
+# Coordinator side
+
+class WorkerProcess(object):
+    def __init__(self, command, log_path):
+        self.command = command
+        self.log_path = log_path
+        self.process = None
+        self.jobs_run = 0
+        self._lines = None
+
+    def start(self):
+        # Start mayapy and wait for maya to be up, raises WorkerError if it doesn't get there
+        self._lines = queue.Queue()
+        try:
+            with open(self.log_path, 'a') as log_file:
+                self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                stderr=log_file, universal_newlines=True, bufsize=1)
+        except OSError as e:
+            raise WorkerError(f"could not start {self.command[0]} ({e})")
+        threading.Thread(target=self._read, args=(self.process, self._lines), daemon=True).start()
+        self.jobs_run = 0
+        self._receive(STARTUP_TIMEOUT)
+
+    def _read(self, process, lines):
+        for line in process.stdout:
+            if line.startswith(PROTOCOL_PREFIX):
+                lines.put(json.loads(line[len(PROTOCOL_PREFIX):]))
+        lines.put(None)
+
+    def _receive(self, timeout):
+        try:
+            message = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise WorkerError(f"no answer from mayapy after {timeout:.0f} s")
+        if message is None:
+            exit_code = self.process.wait()
+            self.process = None
+            raise WorkerError(f"mayapy exited with code {exit_code}")
+        return message
+
+    def run(self, job, log_path, timeout):
+        if self.process is None:
+            self.start()
+        self.jobs_run += 1
+        try:
+            self.process.stdin.write(json.dumps({'job': job._asdict(), 'log': log_path}) + '\n')
+            self.process.stdin.flush()
+        except OSError as e:
+            self.kill()
+            raise WorkerError(f"could not send the job to mayapy ({e})")
+        return self._receive(timeout)
+
+    def stop(self, timeout=30):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+def run_jobs(jobs, command, log_directory, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT,
+             recycle_after=RECYCLE_AFTER, on_result=None):
+    # Run jobs across workers mayapy processes started with command, returns a JobResult per job in job order.
+    # on_result is called with each JobResult as it finishes, from the worker threads
+    if not os.path.exists(log_directory):
+        os.makedirs(log_directory)
+    pending = queue.Queue()
+    for job in jobs:
+        pending.put((job, 1))
+    results = {}
+    lock = threading.Lock()
+
+    def finish(job, attempts, reply, log_path, error=None):
+        published = (reply or {}).get('result') or {}
+        result = JobResult(job, error is None, attempts, published.get('version'), published.get('version_path'),
+                           published.get('master_path'), log_path, error)
+        with lock:
+            results[job.index] = result
+        if on_result:
+            on_result(result)
+
+    def work(worker_number):
+        worker = WorkerProcess(command, os.path.join(log_directory, f"worker_{worker_number}.log"))
+        try:
+            while True:
+                with lock:
+                    if len(results) == len(jobs):
+                        return
+                try:
+                    job, attempt = pending.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                log_path = job_log_path(log_directory, job)
+                with open(log_path, 'a') as log_file:
+                    log_file.write(f"=== attempt {attempt} on worker {worker_number}, "
+                                   f"{time.strftime('%Y-%m-%d %H:%M:%S')} ===\n")
+                try:
+                    reply = worker.run(job, log_path, timeout)
+                    error = None if reply.get('ok') else reply.get('error') or 'failed'
+                except WorkerError as e:
+                    reply, error = None, str(e)
+                    with open(log_path, 'a') as log_file:
+                        log_file.write(f"Worker {worker_number}: {error}\n")
+                if error and attempt <= retries:
+                    pending.put((job, attempt + 1))
+                else:
+                    finish(job, attempt, reply, log_path, error)
+                if worker.process is not None and worker.jobs_run >= recycle_after:
+                    worker.stop()
+        finally:
+            worker.stop()
+
+    threads = [threading.Thread(target=work, args=(number,), daemon=True)
+               for number in range(1, min(workers, len(jobs)) + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [results[job.index] for job in jobs]
+
+
+def describe_result(result):
+    job = result.job
+    name = f"{job.project}/{job.creature}/{job.base_name}"
+    retried = f" after {result.attempts} attempts" if result.attempts > 1 else ''
+    if result.ok:
+        return f"Published {name} v{result.version:04d}{retried}"
+    return f"Failed {name}{retried}: {result.error} (see {result.log_path})"
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Publish a list of scenes into the asset store with a pool of mayapy workers.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="run a json job list")
+    run_parser.add_argument('jobs', help="json file with a list of jobs")
+    run_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="mayapy processes to run at once")
+    run_parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help="times a failed job is tried again")
+    run_parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="seconds before a job is given up on")
+    run_parser.add_argument('--log-directory', help="defaults to a new folder in the temp folder")
+    run_parser.add_argument('--mayapy', help="defaults to mayapy in settings.json, then MAYA_LOCATION, then the PATH")
+    run_parser.add_argument('--report', help="write the results to this json file")
+    subparsers.add_parser('worker', help="run as one of the mayapy workers, started by run")
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'worker':
+        return worker_main(arguments.asset_directory)
+
+    from asset_store import load_settings
+    settings = load_settings()
+    try:
+        jobs = load_jobs(arguments.jobs)
+    except (OSError, ValueError) as e:
+        print(f"Could not read the jobs: {e}")
+        return 2
+    if not jobs:
+        print("No jobs to run.")
+        return 0
+    log_directory = arguments.log_directory or os.path.join(tempfile.gettempdir(), 'baal_batch',
+                                                            time.strftime('%Y%m%d_%H%M%S'))
+    command = [arguments.mayapy or default_mayapy(settings), os.path.abspath(__file__)]
+    if arguments.asset_directory:
+        command += ['--asset-directory', arguments.asset_directory]
+    command.append('worker')
+
+    print(f"Running {len(jobs)} jobs on {min(arguments.workers, len(jobs))} workers, logs in {log_directory}")
+    results = run_jobs(jobs, command, log_directory, arguments.workers, arguments.retries, arguments.timeout,
+                       on_result=lambda result: print(describe_result(result), flush=True))
+    failed = [result for result in results if not result.ok]
+    print(f"{len(results) - len(failed)} published, {len(failed)} failed")
+    if arguments.report:
+        with open(arguments.report, 'w') as report_file:
+            json.dump([dict(result._asdict(), job=result.job._asdict()) for result in results], report_file, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,429 @@
+"""
+asset_bench.py
+
+Benchmarks for the asset store and browser on a synthetic store
+
+- generates a store of N projects x M creatures x K assets x V versions with notes, laid out exactly like
+  publishes leave it (masters, versions folders with manifests, notes logs) plus current and archive folders
+- maya.cmds is replaced by a stand-in that writes placeholder scenes of a set size, so publishing and
+  importing run anywhere, and the browser runs on an offscreen Qt platform
+- times the store calls behind the browser and the browser itself: project load, creature, asset and
+  version listings, notes, publishing and stone_importer resolution, cold (fresh catalog) and warm
+- results are printed or written as JSON with the commit, compare two runs to catch regressions
+
+    python asset_bench.py run [--projects 2 --creatures 10 --assets 4 --versions 25] [--output results.json]
+    python asset_bench.py generate PATH [same sizes]
+    python asset_bench.py compare before.json after.json [--threshold 1.25]
+
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from asset_manifest import AssetManifest, version_file_name
+from asset_notes import NOTES_LOG_FILE_NAME, NotesLog
+
+DEFAULT_SIZES = {'projects': 2, 'creatures': 10, 'assets': 4, 'versions': 25, 'notes_every': 3, 'scene_kb': 8}
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 1.25
+UI_TIMEOUT = 30.0
+
+NOTE_WORDS = ('knee', 'flip', 'fixed', 'weights', 'uv', 'blendshape', 'cleanup', 'retopo', 'shoulder', 'pivot',
+              'rename', 'joints', 'skin', 'texture', 'smooth', 'twist', 'spine', 'facial', 'eyelid', 'jaw')
+
+
+def ascii_scene(size, name='bench'):
+    # A .ma maya would open, padded out to size with comments
+    header = (f'//Maya ASCII 2022 scene\n//Name: {name}.ma\nrequires maya "2022";\n'
+              f'currentUnit -l centimeter -a degree -t film;\nfileInfo "application" "maya";\n'
+              f'fileInfo "product" "Maya 2022";\ncreateNode transform -n "{name}";\n').encode('ascii')
+    line = b'// ' + b'x' * 76 + b'\n'
+    return header + line * max(0, (size - len(header)) // len(line))
+
+
+def binary_scene(size):
+    # FOR8 file with a HEAD group like maya writes, then one padding chunk to make up the size
+    def chunk(tag, data):
+        data += b'\0' * (-len(data) % 8)
+        return tag + b'\0' * 4 + struct.pack('>Q', len(data)) + data
+
+    head = b'HEAD' + chunk(b'VERS', b'2022\0') + chunk(b'TUNI', b'film\0') + chunk(b'LUNI', b'cm\0')
+    body = chunk(b'FOR8', head) + chunk(b'XFRM', b'\0' * max(0, size - len(head) - 64))
+    return b'FOR8' + b'\0' * 4 + struct.pack('>Q', len(body) + 4) + b'Maya' + body
+
+
+class FakeMayaCmds(types.ModuleType):
+    # Just enough of maya.cmds for publishing, opening and importing
+    def __init__(self, scene_size=8 * 1024):
+        super(FakeMayaCmds, self).__init__('maya.cmds')
+        self.scene_size = scene_size
+        self.scene_name = None
+        self.time_unit = 'film'
+
+    def file(self, *args, **kwargs):
+        if 'rename' in kwargs:
+            self.scene_name = kwargs['rename']
+        elif kwargs.get('save'):
+            binary = kwargs.get('type') == 'mayaBinary'
+            with open(self.scene_name, 'wb') as scene_file:
+                scene_file.write(binary_scene(self.scene_size) if binary else ascii_scene(self.scene_size))
+        elif kwargs.get('new'):
+            self.scene_name = None
+        elif args and (kwargs.get('o') or kwargs.get('i')):
+            # Opening or importing reads the whole file like maya would
+            with open(args[0], 'rb') as scene_file:
+                while scene_file.read(1024 * 1024):
+                    pass
+            if kwargs.get('o'):
+                self.scene_name = args[0]
+        return self.scene_name
+
+    def namespaceInfo(self, **kwargs):
+        return ['UI', 'shared']
+
+    def about(self, batch=False, **kwargs):
+        return True
+
+    def currentUnit(self, time=None, **kwargs):
+        if time:
+            self.time_unit = time
+        return self.time_unit
+
+
+def install_fake_maya(scene_size):
+    cmds = FakeMayaCmds(scene_size)
+    maya = types.ModuleType('maya')
+    maya.cmds = cmds
+    sys.modules['maya'] = maya
+    sys.modules['maya.cmds'] = cmds
+    return cmds
+
+
+def generate_store(root, projects=2, creatures=10, assets=4, versions=25, notes_every=3, scene_kb=8, seed=1):
+    # Lay out a store under root/asset_store plus root/Current and root/Archives, returns the settings for it
+    rng = random.Random(seed)
+    scene_size = scene_kb * 1024
+    ascii_data = ascii_scene(scene_size)
+    binary_data = binary_scene(scene_size)
+    asset_directory = os.path.join(root, 'asset_store')
+    now = time.time()
+    for project_index in range(projects):
+        for creature_index in range(creatures):
+            creature_directory = os.path.join(asset_directory, f"PROJECT{project_index + 1}", f"creature{creature_index + 1:03d}")
+            for asset_index in range(assets):
+                base_name = f"asset{asset_index + 1:02d}"
+                extension = '.mb' if asset_index % 2 else '.ma'
+                data = binary_data if extension == '.mb' else ascii_data
+                versions_directory = os.path.join(creature_directory, f"{base_name}_versions")
+                os.makedirs(versions_directory)
+                notes_log = NotesLog(os.path.join(creature_directory, f"{base_name}_notes"), base_name)
+                records = []
+                for version in range(1, versions + 1):
+                    file_name = version_file_name(base_name, version, extension)
+                    with open(os.path.join(versions_directory, file_name), 'wb') as scene_file:
+                        scene_file.write(data)
+                    timestamp = now - (versions - version) * 3600
+                    has_note = notes_every and version % notes_every == 0
+                    if has_note:
+                        text = ' '.join(rng.choice(NOTE_WORDS) for _ in range(rng.randint(3, 12)))
+                        notes_log.append(version, text, author='bench', timestamp=timestamp)
+                    records.append({'version': version, 'file': file_name, 'format': 'mayaBinary' if extension == '.mb' else 'mayaAscii',
+                                    'checksum': None, 'size': len(data), 'author': 'bench', 'timestamp': timestamp,
+                                    'notes': NOTES_LOG_FILE_NAME if has_note else None})
+                with open(os.path.join(creature_directory, f"{base_name}_master{extension}"), 'wb') as scene_file:
+                    scene_file.write(data)
+                AssetManifest(versions_directory, base_name).write({
+                    'base_name': base_name, 'next_version': versions + 1,
+                    'latest': records[-1] if records else None, 'versions': records})
+
+    for folder_name in ('Current', 'Archives'):
+        for index in range(creatures):
+            folder = os.path.join(root, folder_name, f"folder{index + 1:03d}")
+            os.makedirs(folder)
+            for file_index in range(assets):
+                with open(os.path.join(folder, f"scene{file_index + 1:02d}.ma"), 'wb') as scene_file:
+                    scene_file.write(ascii_data)
+
+    return {
+        'asset_directory': asset_directory,
+        'current_directory': os.path.join(root, 'Current'),
+        'archive_directory': os.path.join(root, 'Archives'),
+        'window_icon': '',
+        'watch_poll_interval': 0,
+        'state_file': os.path.join(root, 'browser_state.json'),
+        'thumbnail_cache_directory': os.path.join(root, 'thumbnails'),
+    }
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+class Bench(object):
+    def __init__(self, repeat=DEFAULT_REPEAT):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, name, function, setup=None, repeat=None):
+        # Time function() repeat times, setup() runs untimed before each
+        timings = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.results[name] = summarize(timings)
+        return self.results[name]
+
+    def record(self, name, timings):
+        self.results[name] = summarize(timings)
+
+
+def store_benchmarks(bench, settings, sizes):
+    from asset_catalog import CATALOG_FILE_NAME
+    from asset_store import AssetStore, stone_importer
+
+    rng = random.Random(2)
+    asset_directory = settings['asset_directory']
+    catalog_path = os.path.join(asset_directory, CATALOG_FILE_NAME)
+    stores = []
+
+    def fresh_store():
+        # Cold runs start without a catalog, as on the first open against a share
+        for store in stores:
+            store.close()
+        del stores[:]
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(catalog_path + suffix):
+                os.remove(catalog_path + suffix)
+        stores.append(AssetStore(settings))
+
+    def pick():
+        project = f"PROJECT{rng.randint(1, sizes['projects'])}"
+        creature = f"creature{rng.randint(1, sizes['creatures']):03d}"
+        asset_index = rng.randint(0, sizes['assets'] - 1)
+        base_name = f"asset{asset_index + 1:02d}"
+        extension = '.mb' if asset_index % 2 else '.ma'
+        return project, creature, base_name, extension
+
+    bench.time('store.projects cold', lambda: stores[0].projects(), setup=fresh_store)
+    store = AssetStore(settings)
+    stores.append(store)
+    project, creature, base_name, extension = pick()
+    bench.time('store.projects warm', store.projects)
+    bench.time('store.creatures cold', lambda: stores[-1].creatures(project), setup=fresh_store)
+    store = stores[-1]
+    bench.time('store.creatures warm', lambda: store.creatures(project))
+    bench.time('store.assets cold', lambda: stores[-1].assets(project, creature), setup=fresh_store)
+    store = stores[-1]
+    bench.time('store.assets warm', lambda: store.assets(project, creature))
+    bench.time('store.versions', lambda: store.versions(project, creature, base_name))
+    bench.time('store.latest_note', lambda: store.latest_note(project, creature, base_name))
+    last_version = version_file_name(base_name, sizes['versions'], extension)
+    bench.time('store.note_for_version', lambda: store.note_for_version(project, creature, base_name, last_version))
+    bench.time('store.search_notes', lambda: store.search_notes(project, 'knee flip'))
+    bench.time('store.resolve master', lambda: store.resolve(project, creature, f"{base_name}_master{extension}"))
+    bench.time('store.resolve version', lambda: store.resolve(project, creature, last_version))
+    bench.time('stone_importer', lambda: stone_importer(project, creature, f"{base_name}_master{extension}", 24, store=store))
+    bench.time('store.publish', lambda: store.publish(project, creature, base_name, 'bench publish'))
+    # The same publish through the blob store, after the first one the scene is already there and nothing new is stored
+    blob_store = AssetStore(dict(settings, version_storage='blobs'))
+    stores.append(blob_store)
+    bench.time('store.publish blobs', lambda: blob_store.publish(project, creature, base_name, 'bench publish'))
+    bench.time('store.update_references', lambda: sum(store.update_references()), repeat=1)
+    bench.time('store.update_references warm', lambda: sum(store.update_references()))
+    for store in stores:
+        store.close()
+
+
+def ui_benchmarks(bench, settings, sizes):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide2 import QtWidgets
+    from asset_browser import FolderBrowserUI
+    from asset_store import AssetStore
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    def wait_for(condition, timeout=UI_TIMEOUT):
+        end = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > end:
+                raise RuntimeError("timed out waiting for the browser")
+            app.processEvents()
+            time.sleep(0.001)
+
+    def loaded(browser, view, channel):
+        return lambda: not browser.loader.is_loading(channel) and view.model().rowCount() > 0
+
+    project_load, creature_load, asset_load, notes_load, publish = [], [], [], [], []
+    for run in range(bench.repeat):
+        if os.path.exists(settings['state_file']):
+            os.remove(settings['state_file'])
+        store = AssetStore(settings)
+        start = time.perf_counter()
+        browser = FolderBrowserUI(store=store)
+        browser.show()
+        wait_for(loaded(browser, browser.folder_list, 'folders'))
+        project_load.append((time.perf_counter() - start) * 1000)
+
+        creature = browser.folder_list.model().entry(run % browser.folder_list.model().rowCount())
+        start = time.perf_counter()
+        browser.folder_list.select_name(creature.name)
+        browser.on_folder_selected(creature)
+        wait_for(loaded(browser, browser.file_list, 'files'))
+        creature_load.append((time.perf_counter() - start) * 1000)
+
+        asset = browser.file_list.model().entry(0)
+        start = time.perf_counter()
+        browser.file_list.select_name(asset.name)
+        browser.on_file_selected(asset)
+        wait_for(loaded(browser, browser.versions_list, 'versions'))
+        wait_for(lambda: not browser.loader.is_loading('notes'))
+        asset_load.append((time.perf_counter() - start) * 1000)
+
+        version = browser.versions_list.model().entry(0)
+        start = time.perf_counter()
+        browser.versions_list.select_name(version.name)
+        browser.on_version_selected(version)
+        wait_for(lambda: not browser.loader.is_loading('notes'))
+        notes_load.append((time.perf_counter() - start) * 1000)
+
+        base_name = asset.name.rsplit('_master', 1)[0]
+        start = time.perf_counter()
+        browser.save_version(creature.name, base_name, 'bench publish', asset.name.endswith('.mb'))
+        wait_for(lambda: not browser.loader.is_loading('versions'))
+        publish.append((time.perf_counter() - start) * 1000)
+
+        browser.close()
+        browser.deleteLater()
+        app.processEvents()
+        browser.loader.wait()
+        store.close()
+
+    bench.record('ui.project load', project_load)
+    bench.record('ui.creature select', creature_load)
+    bench.record('ui.asset select', asset_load)
+    bench.record('ui.version notes', notes_load)
+    bench.record('ui.save_version', publish)
+
+
+def git_commit():
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def run(sizes, repeat=DEFAULT_REPEAT, store_root=None, keep=False, ui=True):
+    root = store_root or tempfile.mkdtemp(prefix='baal_bench_')
+    try:
+        start = time.perf_counter()
+        settings = generate_store(root, **sizes)
+        generate_ms = (time.perf_counter() - start) * 1000
+        install_fake_maya(sizes['scene_kb'] * 1024)
+        bench = Bench(repeat)
+        # Whatever the store prints while publishing goes to stderr so stdout stays json
+        with contextlib.redirect_stdout(sys.stderr):
+            store_benchmarks(bench, settings, sizes)
+            if ui:
+                try:
+                    ui_benchmarks(bench, settings, sizes)
+                except ImportError as e:
+                    print(f"Warning: Skipping the browser benchmarks, PySide2 isn't available ({e}).")
+        return {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+            'repeat': repeat,
+            'generate_ms': round(generate_ms, 1),
+            'results': bench.results,
+        }
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(before, after, threshold=DEFAULT_THRESHOLD):
+    # Lines comparing median times, and whether anything got slower than threshold allows
+    lines = [f"{'benchmark':32} {'before':>10} {'after':>10} {'ratio':>7}"]
+    regressed = False
+    for name, result in after['results'].items():
+        old = before['results'].get(name)
+        if not old:
+            lines.append(f"{name:32} {'-':>10} {result['median_ms']:>10.2f} {'new':>7}")
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else 1.0
+        flag = ''
+        if ratio > threshold:
+            regressed = True
+            flag = '  slower'
+        lines.append(f"{name:32} {old['median_ms']:>10.2f} {result['median_ms']:>10.2f} {ratio:>6.2f}x{flag}")
+    return lines, regressed
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the asset store and browser on a synthetic store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="generate a store, time it and print the results as json")
+    generate_parser = subparsers.add_parser('generate', help="only generate a store")
+    generate_parser.add_argument('path')
+    for sub_parser in (run_parser, generate_parser):
+        for name, default in DEFAULT_SIZES.items():
+            sub_parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument('--store', help="generate the store here instead of a temp folder")
+    run_parser.add_argument('--keep', action='store_true', help="leave the generated store behind")
+    run_parser.add_argument('--no-ui', action='store_true', help="only time the store, not the browser")
+    run_parser.add_argument('--output', help="write the json here as well")
+    compare_parser = subparsers.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'compare':
+        with open(arguments.before) as before_file, open(arguments.after) as after_file:
+            lines, regressed = compare(json.load(before_file), json.load(after_file), arguments.threshold)
+        print('\n'.join(lines))
+        return 1 if regressed else 0
+
+    sizes = {name: getattr(arguments, name) for name in DEFAULT_SIZES}
+    if arguments.command == 'generate':
+        settings = generate_store(arguments.path, **sizes)
+        print(json.dumps(settings, indent=4))
+        return 0
+
+    results = run(sizes, arguments.repeat, arguments.store, arguments.keep, not arguments.no_ui)
+    text = json.dumps(results, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
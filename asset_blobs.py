@@ -0,0 +1,265 @@
+"""
+asset_blobs.py
+
+Content addressed storage for published versions
+
+- with "version_storage": "blobs" in settings.json each published version is stored once in
+  <asset_directory>/.blobs keyed by its sha256, republishing an unchanged scene costs no extra space
+- the _vNNNN file in <base>_versions is a hard link (or reflink) to the blob, where the share can't
+  do either the version only lives in the manifest and is read straight from the blob
+- blobs are made read-only so nothing can save over a published version through one of its links
+- verify rehashes every blob in parallel, repair quarantines bad blobs and restores them from any other
+  copy of the same content it can find in the store
+
+    python asset_blobs.py verify [--repair] [--workers 8] [--asset-directory PATH]
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import stat
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_files import CHECKSUM_CHUNK_SIZE, file_checksum, reflink, replace_file
+
+BLOB_DIRECTORY_NAME = '.blobs'
+INCOMING_DIRECTORY_NAME = 'incoming'
+QUARANTINE_DIRECTORY_NAME = 'quarantine'
+DEFAULT_ALGORITHM = 'sha256'
+DEFAULT_WORKERS = 8
+
+VerifyResult = namedtuple('VerifyResult', ['checked', 'corrupt', 'repaired', 'missing'])
+
+
+def blob_root(asset_directory):
+    return os.path.join(asset_directory, BLOB_DIRECTORY_NAME)
+
+
+def copy_and_hash(source_path, destination_path, algorithm=DEFAULT_ALGORITHM):
+    # Copy a file and hash it in the same pass, returns "<algorithm>:<hex>"
+    digest = hashlib.new(algorithm)
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            destination.write(chunk)
+    return f"{algorithm}:{digest.hexdigest()}"
+
+
+class BlobStore(object):
+    def __init__(self, root, algorithm=DEFAULT_ALGORITHM):
+        self.root = root
+        self.algorithm = algorithm
+
+    @property
+    def incoming_directory(self):
+        return os.path.join(self.root, INCOMING_DIRECTORY_NAME)
+
+    def blob_path(self, digest):
+        algorithm, hex_digest = digest.split(':', 1)
+        return os.path.join(self.root, algorithm, hex_digest[:2], hex_digest)
+
+    def staging_path(self, file_extension):
+        # Somewhere for maya to save to on the same device as the blobs, so ingesting is just a rename
+        if not os.path.exists(self.incoming_directory):
+            os.makedirs(self.incoming_directory)
+        return os.path.join(self.incoming_directory, f"{uuid.uuid4().hex}{file_extension}")
+
+    def ingest(self, source_path, remove_source=True):
+        # Move (or copy) a file into the store, returns (digest, blob path, whether it was new content)
+        same_device = self._same_device(source_path)
+        if same_device and remove_source:
+            digest = file_checksum(source_path, self.algorithm)
+            temp_path = None
+        else:
+            temp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.tmp")
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            digest = copy_and_hash(source_path, temp_path, self.algorithm)
+
+        blob_path = self.blob_path(digest)
+        if os.path.exists(blob_path):
+            # Same content published before, nothing new to store
+            if temp_path:
+                os.remove(temp_path)
+            if remove_source and os.path.exists(source_path):
+                os.remove(source_path)
+            return digest, blob_path, False
+
+        blob_directory = os.path.dirname(blob_path)
+        if not os.path.exists(blob_directory):
+            os.makedirs(blob_directory, exist_ok=True)
+        replace_file(temp_path or source_path, blob_path)
+        if temp_path and remove_source:
+            os.remove(source_path)
+        os.chmod(blob_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return digest, blob_path, True
+
+    def expose(self, digest, version_path):
+        # Make version_path point at a blob, returns how: 'hardlink', 'reflink' or 'manifest' when
+        # the file system can do neither and the version is only reachable through the manifest
+        blob_path = self.blob_path(digest)
+        try:
+            os.link(blob_path, version_path)
+            return 'hardlink'
+        except OSError:
+            pass
+        try:
+            reflink(blob_path, version_path)
+            os.chmod(version_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            return 'reflink'
+        except OSError:
+            pass
+        return 'manifest'
+
+    def _same_device(self, source_path):
+        try:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            return os.stat(source_path).st_dev == os.stat(self.root).st_dev
+        except OSError:
+            return False
+
+    def blobs(self):
+        # Every (digest, path) in the store
+        for algorithm in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            if algorithm in (INCOMING_DIRECTORY_NAME, QUARANTINE_DIRECTORY_NAME) or algorithm.startswith('.'):
+                continue
+            algorithm_directory = os.path.join(self.root, algorithm)
+            for prefix in os.listdir(algorithm_directory):
+                prefix_directory = os.path.join(algorithm_directory, prefix)
+                for hex_digest in os.listdir(prefix_directory):
+                    yield f"{algorithm}:{hex_digest}", os.path.join(prefix_directory, hex_digest)
+
+    def quarantine(self, digest):
+        blob_path = self.blob_path(digest)
+        quarantine_directory = os.path.join(self.root, QUARANTINE_DIRECTORY_NAME)
+        if not os.path.exists(quarantine_directory):
+            os.makedirs(quarantine_directory)
+        quarantine_path = os.path.join(quarantine_directory, f"{digest.replace(':', '_')}.{uuid.uuid4().hex[:8]}")
+        os.replace(blob_path, quarantine_path)
+        return quarantine_path
+
+    def verify(self, asset_directory=None, repair=False, workers=DEFAULT_WORKERS):
+        # Rehash every blob in parallel (hashlib lets go of the GIL so threads are enough).
+        # With repair, bad blobs are quarantined and restored from a good copy elsewhere in the store
+        # when there is one, and versions whose blob has gone missing are re-ingested from their file
+        blobs = list(self.blobs())
+
+        def check(blob):
+            digest, blob_path = blob
+            try:
+                return digest, file_checksum(blob_path, digest.split(':', 1)[0]) == digest
+            except OSError:
+                return digest, False
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(check, blobs))
+        corrupt = [digest for digest, ok in results if not ok]
+        for digest in corrupt:
+            print(f"Corrupt blob: {self.blob_path(digest)}")
+
+        repaired = []
+        missing = []
+        if repair and asset_directory:
+            for digest in corrupt:
+                self.quarantine(digest)
+            candidates = self._candidates(asset_directory)
+            referenced = set(candidates)
+            for digest in referenced:
+                if os.path.exists(self.blob_path(digest)):
+                    continue
+                if self._restore(digest, candidates[digest]):
+                    repaired.append(digest)
+                    print(f"Repaired blob: {self.blob_path(digest)}")
+                else:
+                    missing.append(digest)
+                    print(f"Missing blob, no good copy found: {digest}")
+        return VerifyResult(len(blobs), corrupt, repaired, missing)
+
+    def _candidates(self, asset_directory):
+        # Every file in the store that should hold a given digest, from the versions manifests.
+        # Masters count too when their asset's latest version has that digest
+        candidates = {}
+        for directory, folder_names, file_names in os.walk(asset_directory):
+            folder_names[:] = [name for name in folder_names if not name.startswith('.')]
+            if '.manifest.json' not in file_names:
+                continue
+            try:
+                with open(os.path.join(directory, '.manifest.json'), 'r') as manifest_file:
+                    manifest = json.load(manifest_file)
+            except (OSError, ValueError):
+                continue
+            for record in manifest.get('versions', []):
+                if record.get('blob'):
+                    candidates.setdefault(record['blob'], []).append(os.path.join(directory, record['file']))
+            latest = manifest.get('latest')
+            if latest and latest.get('blob'):
+                creature_directory = os.path.dirname(directory)
+                master_name = f"{manifest['base_name']}_master{os.path.splitext(latest['file'])[1]}"
+                candidates.setdefault(latest['blob'], []).append(os.path.join(creature_directory, master_name))
+        return candidates
+
+    def _restore(self, digest, paths):
+        algorithm = digest.split(':', 1)[0]
+        good_paths = []
+        for path in paths:
+            try:
+                if os.path.exists(path) and file_checksum(path, algorithm) == digest:
+                    good_paths.append(path)
+            except OSError:
+                continue
+        if not good_paths:
+            return False
+
+        blob_path = self.blob_path(digest)
+        if not os.path.exists(os.path.dirname(blob_path)):
+            os.makedirs(os.path.dirname(blob_path))
+        self._link_or_copy(good_paths[0], blob_path)
+        os.chmod(blob_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        # Anything still linked to the bad copy gets pointed at the restored blob
+        for path in paths:
+            if path in good_paths or not os.path.exists(path):
+                continue
+            if os.path.basename(os.path.dirname(path)).endswith('_versions'):
+                self._link_or_copy(blob_path, path)
+            else:
+                self._link_or_copy(blob_path, path, allow_link=False)
+        return True
+
+    def _link_or_copy(self, source_path, destination_path, allow_link=True):
+        temp_path = os.path.join(os.path.dirname(destination_path), f".{uuid.uuid4().hex}.tmp")
+        try:
+            if not allow_link:
+                raise OSError
+            os.link(source_path, temp_path)
+        except OSError:
+            shutil.copyfile(source_path, temp_path)
+        replace_file(temp_path, destination_path)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Verify and repair the asset store blob storage.")
+    parser.add_argument('command', choices=['verify'])
+    parser.add_argument('--repair', action='store_true', help="quarantine bad blobs and restore them where possible")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    asset_directory = arguments.asset_directory
+    if not asset_directory:
+        from asset_store import load_settings
+        asset_directory = load_settings()["asset_directory"]
+    result = BlobStore(blob_root(asset_directory)).verify(asset_directory, arguments.repair, arguments.workers)
+    print(f"Checked {result.checked} blobs, {len(result.corrupt)} corrupt, {len(result.repaired)} repaired, "
+          f"{len(result.missing)} missing")
+    return 1 if (result.corrupt and not arguments.repair) or result.missing else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,1072 @@
+"""
+asset_browser.py
+
+Maya UI for the asset store, a thin layer over the headless AssetStore in asset_store.py
+
+- assets tab for browsing projects, creatures, assets, versions and notes and publishing new versions
+- simple browser tabs for the current and archive folders, only built the first time they're shown
+- opens on the last project and selection (asset_state.py), startup is timed against a budget
+- lists are model/views (asset_models.py) that page their rows in, versions sort newest first
+- publish thumbnails next to the files and versions, loaded in the background as rows scroll into view
+- search box over every note in the project, results show in the notes pane
+- type-ahead search over every project, creature, asset and version, picking a result jumps to it
+- details pane with the maya version, units, frame rate and plugins of the selected file, read from its header,
+  along with what it references and what references it
+- right click a .ma version to compare it with the one before it, the nodes and connections that were added,
+  removed or changed show in the notes pane under its note (asset_diff.py)
+- versions moved to the archive by the retention policy stay in the versions list greyed out, they open and
+  import from the archive and can be restored from the list's right click menu
+- with tracing on (asset_trace.py) a performance panel shows p50/p95 latency per operation for the session
+  and exports everything as a Chrome trace
+
+"""
+
+import os
+from datetime import datetime
+
+from PySide2 import QtWidgets, QtGui, QtCore
+
+from asset_compress import logical_name
+from asset_diff import describe_diff, previous_version
+from asset_loader import BackgroundLoader
+from asset_metadata import describe
+from asset_models import EntryListView, ThumbnailCache, version_sort_key
+from asset_notes import DEFAULT_NOTE_TEXT
+from asset_publish_queue import describe_status
+from asset_references import describe_references
+from asset_search import NameIndex, SearchEntry, directory_key, display_name, refresh_listing
+from asset_state import DEFAULT_STARTUP_BUDGET_MS, StartupTimer, load_state, save_state, state_file_path
+from asset_store import AssetStore, list_files, master_base_name
+from asset_thumbnails import default_cache_directory
+from asset_trace import is_enabled as tracing_enabled, span, tracer
+from asset_watcher import DirectoryWatcher, DEFAULT_POLL_INTERVAL
+
+PERFORMANCE_REFRESH_MS = 1000
+PUBLISH_QUEUE_REFRESH_MS = 500
+
+
+class PerformancePanel(QtWidgets.QDialog):
+    # Latency per traced operation for this session, refreshed once a second while it's open
+    COLUMNS = ('Operation', 'Count', 'p50 ms', 'p95 ms', 'Max ms', 'MB')
+
+    def __init__(self, parent=None):
+        super(PerformancePanel, self).__init__(parent)
+        self.setWindowTitle("Baal Browser Performance")
+        self.setMinimumWidth(560)
+        layout = QtWidgets.QVBoxLayout(self)
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        button_layout = QtWidgets.QHBoxLayout()
+        export_button = QtWidgets.QPushButton("Export Trace...", self)
+        export_button.clicked.connect(self.export_trace)
+        clear_button = QtWidgets.QPushButton("Clear", self)
+        clear_button.clicked.connect(self.clear)
+        button_layout.addWidget(export_button)
+        button_layout.addWidget(clear_button)
+        layout.addLayout(button_layout)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(PERFORMANCE_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super(PerformancePanel, self).showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(PerformancePanel, self).hideEvent(event)
+
+    def refresh(self):
+        stats = tracer.stats()
+        self.table.setRowCount(len(stats))
+        for row, operation in enumerate(stats):
+            values = (operation.name, str(operation.count), f"{operation.p50_ms:.1f}", f"{operation.p95_ms:.1f}",
+                      f"{operation.max_ms:.1f}", f"{operation.total_bytes / 1024 ** 2:.1f}" if operation.total_bytes else '')
+            for column, value in enumerate(values):
+                item = QtWidgets.QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def clear(self):
+        tracer.clear()
+        self.refresh()
+
+    def export_trace(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export Trace', 'baal_trace.json', 'Chrome trace (*.json)')
+        if not path:
+            return
+        try:
+            count = tracer.export(path)
+        except OSError as e:
+            QtWidgets.QMessageBox.warning(self, 'Warning', f'Could not write {path} ({e}).')
+            return
+        QtWidgets.QMessageBox.information(self, 'Export Trace', f'{count} spans written to {path}, '
+                                                                f'open it in chrome://tracing or ui.perfetto.dev.')
+
+
+class FolderBrowserUI(QtWidgets.QDialog):
+    def __init__(self, parent=None, store=None, started=None):
+        super(FolderBrowserUI, self).__init__(parent)
+        self.startup = StartupTimer(started)
+
+        # All the asset store logic lives in the headless AssetStore, the browser just drives it
+        self.store = store or AssetStore()
+        settings = self.store.settings
+        self.startup.mark('store')
+        self.startup_budget_ms = settings.get("startup_budget_ms", DEFAULT_STARTUP_BUDGET_MS)
+        self.startup_report = settings.get("startup_report", False)
+        self.state_path = state_file_path(settings)
+        self.state = load_state(self.state_path, self.store.asset_directory)
+        self.window_shown = False
+        self.asset_directory = self.store.asset_directory
+        self.current_directory = self.store.current_directory
+        self.archive_directory = self.store.archive_directory
+        window_icon_path = settings["window_icon"]
+
+        # Worker pool for all the file system scanning, keeps the UI thread free
+        self.loader = BackgroundLoader(self)
+        self.thumbnails = ThumbnailCache(self, default_cache_directory(settings))
+
+        # Watcher for the folders currently on screen, picks up our own and other artists' publishes
+        self.project_name = ''
+        self.selected_base_name = ''
+        self.watcher = DirectoryWatcher(self.loader, self, poll_interval=settings.get("watch_poll_interval", DEFAULT_POLL_INTERVAL))
+        self.watcher.changed.connect(self.on_directories_changed)
+
+        # Name index behind the search box, filled in the background once and then kept up to date
+        self.search_index = NameIndex()
+        self.search_results = {}
+        self.pending_jump = None
+
+        self.setWindowFlags(self.windowFlags() | QtCore.Qt.WindowMinimizeButtonHint)
+        self.setWindowIcon(QtGui.QIcon(window_icon_path))
+        self.setWindowTitle("Baal Browser")
+        self.setMinimumWidth(800)
+        self.setMinimumHeight(400)
+
+        # Main layout
+        main_layout = QtWidgets.QVBoxLayout(self)
+        self.setLayout(main_layout)
+
+        # Add tabs
+        self.tabs = QtWidgets.QTabWidget(self)
+        main_layout.addWidget(self.tabs)
+
+        # Create tabs, the folder tabs start empty since their QFileSystemModels start watching the share
+        self.lazy_tabs = {}
+        self.create_assets_tab()
+        self.add_lazy_tab("Current", self.current_directory)
+        self.add_lazy_tab("Archives", self.archive_directory)
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+
+        # Importer line edit
+        self.importer_line_edit = QtWidgets.QLineEdit(self)
+        main_layout.addWidget(self.importer_line_edit)
+        self.startup.mark('widgets')
+
+        # Open on what was selected last time, the project list is checked against the share in the background
+        self.restore_state()
+        self.startup.mark('state')
+
+    def showEvent(self, event):
+        super(FolderBrowserUI, self).showEvent(event)
+        if not self.window_shown:
+            self.window_shown = True
+            # Runs once the window has been through the event loop and painted
+            QtCore.QTimer.singleShot(0, self.on_window_shown)
+
+    def on_window_shown(self):
+        self.startup.mark('shown')
+        if self.startup_report or self.startup.elapsed_ms() > self.startup_budget_ms:
+            over = f" (over the {self.startup_budget_ms} ms budget)" if self.startup.elapsed_ms() > self.startup_budget_ms else ''
+            print(self.startup.report() + over)
+
+        # Whole store scans wait until the window is up so they don't hold up the first listings
+        self.loader.load('search_index', lambda: self.search_index.add_from(self.store.search_entries()),
+                         lambda counts: None)
+        self.loader.load('references', self.store.update_references, lambda counts: None)
+
+        # Queued publishes a crash or a closed maya left in staging carry on uploading
+        if self.store.publish_mode == "queued" and self.store.publish_queue().resume():
+            self.publish_queue_timer.start()
+
+    def show_performance_panel(self):
+        if self.performance_panel is None:
+            self.performance_panel = PerformancePanel(self)
+        self.performance_panel.show()
+        self.performance_panel.raise_()
+
+    def closeEvent(self, event):
+        self.save_state()
+        self.watcher.clear()
+        self.loader.cancel_all()
+        self.thumbnails.loader.cancel_all()
+        super(FolderBrowserUI, self).closeEvent(event)
+
+    def create_assets_tab(self):
+        tab_widget = QtWidgets.QWidget(self)
+        tab_layout = QtWidgets.QVBoxLayout(tab_widget)
+
+        # Project selector and buttons layout
+        project_layout = QtWidgets.QHBoxLayout()
+        tab_layout.addLayout(project_layout)
+
+        # Project selector
+        self.project_selector = QtWidgets.QComboBox(self)
+        self.project_selector.setStyleSheet("background-color: rgb(42, 46, 50);")
+        self.project_selector.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Preferred)
+        project_layout.addWidget(self.project_selector)
+
+        # Search box, the drop down is filled from the name index as the artist types
+        self.search_edit = QtWidgets.QLineEdit(self)
+        self.search_edit.setPlaceholderText('Search all assets...')
+        self.search_model = QtCore.QStringListModel(self)
+        self.search_completer = QtWidgets.QCompleter(self.search_model, self)
+        self.search_completer.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        self.search_completer.setMaxVisibleItems(15)
+        self.search_edit.setCompleter(self.search_completer)
+        project_layout.addWidget(self.search_edit)
+
+        # Add a "+" button with a menu
+        self.plus_button = QtWidgets.QPushButton("+", self)
+        self.plus_button.setMaximumWidth(50)
+        project_layout.addWidget(self.plus_button)
+
+        self.plus_menu = QtWidgets.QMenu(self)
+        self.add_project_action = self.plus_menu.addAction("Add New Project")
+        self.add_creature_action = self.plus_menu.addAction("Add New Creature")
+        self.plus_button.setMenu(self.plus_menu)
+
+        # Performance panel, only there with tracing on
+        self.performance_panel = None
+        if tracing_enabled():
+            self.performance_button = QtWidgets.QPushButton("Perf", self)
+            self.performance_button.setMaximumWidth(50)
+            self.performance_button.setToolTip("Latency per operation for this session")
+            self.performance_button.clicked.connect(self.show_performance_panel)
+            project_layout.addWidget(self.performance_button)
+
+        # Splitter for the main sections
+        main_splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        tab_layout.addWidget(main_splitter)
+
+        # Splitter for the file and folder sections
+        top_splitter = QtWidgets.QSplitter(QtCore.Qt.Horizontal)
+        main_splitter.addWidget(top_splitter)
+
+        # Folder list
+        folder_list_widget = QtWidgets.QWidget(self)
+        folder_list_layout = QtWidgets.QVBoxLayout(folder_list_widget)
+        folder_label = QtWidgets.QLabel('Creature Name', self)
+        folder_list_layout.addWidget(folder_label)
+        self.folder_list = EntryListView(self)
+        self.folder_list.setStyleSheet("background-color: rgb(37, 37, 37);")
+        folder_list_layout.addWidget(self.folder_list)
+        top_splitter.addWidget(folder_list_widget)
+
+        # File list
+        file_list_widget = QtWidgets.QWidget(self)
+        file_list_layout = QtWidgets.QVBoxLayout(file_list_widget)
+        file_label = QtWidgets.QLabel('Creature Asset', self)
+        file_list_layout.addWidget(file_label)
+        self.file_list = EntryListView(self)
+        self.file_list.setStyleSheet("background-color: rgb(37, 37, 37);")
+        self.file_list.set_thumbnails(self.thumbnails)
+        file_list_layout.addWidget(self.file_list)
+        top_splitter.addWidget(file_list_widget)
+
+        # Versions list
+        versions_list_widget = QtWidgets.QWidget(self)
+        versions_list_layout = QtWidgets.QVBoxLayout(versions_list_widget)
+        versions_label = QtWidgets.QLabel('Versions', self)
+        versions_list_layout.addWidget(versions_label)
+        self.versions_filter_edit = QtWidgets.QLineEdit(self)
+        self.versions_filter_edit.setPlaceholderText('Filter versions...')
+        versions_list_layout.addWidget(self.versions_filter_edit)
+        self.versions_list = EntryListView(self, version_sort_key)
+        self.versions_list.setStyleSheet("background-color: rgb(37, 37, 37);")
+        self.versions_list.set_thumbnails(self.thumbnails)
+        self.versions_list.model().is_dimmed = lambda entry: self.store.is_archived(entry.path)
+        self.versions_list.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        versions_list_layout.addWidget(self.versions_list)
+        top_splitter.addWidget(versions_list_widget)
+
+        # Notes editor
+        notes_widget = QtWidgets.QWidget(self)
+        notes_layout = QtWidgets.QVBoxLayout(notes_widget)
+        notes_label = QtWidgets.QLabel('Notes', self)
+        notes_layout.addWidget(notes_label)
+        self.notes_search_edit = QtWidgets.QLineEdit(self)
+        self.notes_search_edit.setPlaceholderText('Search notes in this project...')
+        self.notes_search_edit.returnPressed.connect(self.search_notes)
+        notes_layout.addWidget(self.notes_search_edit)
+        self.notes_editor = QtWidgets.QTextEdit(self)
+        self.notes_editor.setStyleSheet("background-color: rgb(37, 37, 37);")
+        self.notes_editor.setReadOnly(True)
+        notes_layout.addWidget(self.notes_editor)
+        self.details_label = self.create_details_label()
+        notes_layout.addWidget(self.details_label)
+        main_splitter.addWidget(notes_widget)
+
+        # New elements section
+        new_elements_widget = QtWidgets.QWidget(self)
+        self.new_elements_layout = QtWidgets.QVBoxLayout(new_elements_widget)
+        self.setup_new_elements(self.new_elements_layout)
+        main_splitter.addWidget(new_elements_widget)
+
+        self.tabs.addTab(tab_widget, "Assets")
+
+        # Set connections
+        self.project_selector.currentIndexChanged.connect(self.update_directory)
+        self.search_edit.textEdited.connect(self.on_search_edited)
+        self.search_completer.activated[str].connect(self.on_search_activated)
+        self.add_project_action.triggered.connect(self.add_new_project)
+        self.add_creature_action.triggered.connect(self.add_new_creature)
+        self.folder_list.entry_clicked.connect(self.on_folder_selected)
+        self.file_list.entry_clicked.connect(self.on_file_selected)
+        self.versions_list.entry_clicked.connect(self.on_version_selected)
+        self.versions_filter_edit.textChanged.connect(self.versions_list.set_filter)
+        self.publish_button.clicked.connect(self.on_publish_clicked)
+        self.open_button.clicked.connect(self.on_open_clicked)
+        self.import_button.clicked.connect(self.on_import_clicked)
+        self.file_list.entry_double_clicked.connect(self.on_file_double_clicked)
+        self.versions_list.entry_double_clicked.connect(self.on_version_double_clicked)
+        self.versions_list.customContextMenuRequested.connect(self.on_version_context_menu)
+
+    def add_lazy_tab(self, tab_name, directory):
+        tab_widget = QtWidgets.QWidget(self)
+        index = self.tabs.addTab(tab_widget, tab_name)
+        self.lazy_tabs[index] = (tab_widget, directory)
+
+    def on_tab_changed(self, index):
+        lazy_tab = self.lazy_tabs.pop(index, None)
+        if lazy_tab:
+            self.create_simple_browser_tab(*lazy_tab)
+
+    def create_simple_browser_tab(self, tab_widget, directory):
+        tab_layout = QtWidgets.QVBoxLayout(tab_widget)
+
+        # Directory browser
+        dir_model = QtWidgets.QFileSystemModel()
+        dir_model.setRootPath(directory)
+        dir_model.setFilter(QtCore.QDir.AllDirs | QtCore.QDir.NoDotAndDotDot)
+
+        dir_view = QtWidgets.QTreeView()
+        dir_view.setModel(dir_model)
+        dir_view.setRootIndex(dir_model.index(directory))
+        dir_view.setColumnWidth(0, 250)
+        dir_view.clicked.connect(lambda index, d=directory: self.on_directory_clicked(index, d, file_list))
+        tab_layout.addWidget(dir_view)
+
+        # File list
+        file_list = EntryListView(self)
+        file_list.setStyleSheet("background-color: rgb(37, 37, 37);")
+        file_list.set_thumbnails(self.thumbnails)
+        file_list.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        file_list.customContextMenuRequested.connect(self.on_file_context_menu)
+        file_list.entry_double_clicked.connect(self.on_file_double_clicked)
+        tab_layout.addWidget(file_list)
+        details_label = self.create_details_label()
+        file_list.entry_clicked.connect(lambda entry: self.show_details(entry, details_label))
+        tab_layout.addWidget(details_label)
+
+        # Open and Import buttons
+        button_layout = QtWidgets.QHBoxLayout()
+        open_button = QtWidgets.QPushButton("Open")
+        open_button.clicked.connect(lambda: self.open_file(file_list.current_entry()))
+        import_button = QtWidgets.QPushButton("Import")
+        import_button.clicked.connect(lambda: self.import_file(file_list.current_entry()))
+        button_layout.addWidget(open_button)
+        button_layout.addWidget(import_button)
+        tab_layout.addLayout(button_layout)
+
+    def on_directory_clicked(self, index, base_path, file_list):
+        dir_model = index.model()
+        folder_path = dir_model.filePath(index)
+
+        file_list.clear()
+        self.loader.load(f"browser_{id(file_list)}", lambda: list_files(folder_path, ('.ma', '.mb', '.obj'), self.store.storage),
+                         file_list.add_entries)
+
+    def create_details_label(self):
+        details_label = QtWidgets.QLabel(self)
+        details_label.setWordWrap(True)
+        details_label.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse)
+        return details_label
+
+    def show_details(self, entry, details_label):
+        # Header metadata for the clicked file, cached by the store so going back to a file is instant
+        details_label.clear()
+        if not entry or not entry.path.endswith(('.ma', '.mb', '.gz')):
+            return
+
+        def read_details():
+            info = self.store.scene_info(entry.path)
+            references = describe_references(self.store.uses(entry.path), self.store.used_by(entry.path),
+                                             self.store.affected_by(entry.path))
+            text = '\n'.join(part for part in (describe(info) if info else '', references) if part)
+            if text:
+                yield text
+
+        self.loader.load(f"details_{id(details_label)}", read_details, lambda texts: details_label.setText(texts[-1]))
+
+    def refresh_list(self, channel, list_view, query):
+        # Apply only what changed to a list so the current selection and scroll position survive
+        entries = []
+        self.loader.load(channel, query, entries.extend, lambda: list_view.sync_entries(entries))
+
+    def on_file_context_menu(self, position):
+        file_list = self.sender()
+        menu = QtWidgets.QMenu()
+
+        open_action = menu.addAction("Open")
+        import_action = menu.addAction("Import")
+
+        open_action.triggered.connect(lambda: self.open_file(file_list.current_entry()))
+        import_action.triggered.connect(lambda: self.import_file(file_list.current_entry()))
+
+        menu.exec_(file_list.mapToGlobal(position))
+
+    def on_file_double_clicked(self, entry):
+        self.open_file(entry)
+
+    def open_file(self, entry):
+        if entry:
+            file_path = entry.path
+            if file_path.endswith(('.ma', '.mb')):
+                self.store.open_file(file_path)
+                QtWidgets.QMessageBox.information(self, 'Open', f'{file_path} opened successfully.')
+
+    def import_file(self, entry):
+        if entry:
+            file_path = entry.path
+            if file_path.endswith(('.ma', '.mb', '.obj')):
+                self.store.import_file(file_path)
+                QtWidgets.QMessageBox.information(self, 'Import', f'{file_path} imported successfully.')
+
+    def restore_state(self):
+        projects = self.state.get('projects') or []
+        selection = self.state.get('selection')
+        if not projects:
+            # First run, the first project to arrive triggers update_directory
+            self.populate_projects()
+            return
+
+        self.project_selector.blockSignals(True)
+        self.project_selector.addItems(projects)
+        if selection and selection.get('project') in projects:
+            self.project_selector.setCurrentText(selection['project'])
+        self.project_selector.blockSignals(False)
+        self.update_directory()
+        if selection:
+            try:
+                self.jump_to(SearchEntry(**selection))
+            except TypeError:
+                pass
+        self.tabs.setCurrentIndex(min(self.state.get('tab', 0), self.tabs.count() - 1))
+        self.refresh_projects()
+
+    def save_state(self):
+        projects = [self.project_selector.itemText(index) for index in range(self.project_selector.count())]
+        selection = None
+        if self.project_name:
+            folder_entry = self.folder_list.current_entry()
+            file_entry = self.file_list.current_entry()
+            version_entry = self.versions_list.current_entry()
+            creature_name = folder_entry.name if folder_entry else None
+            base_name = master_base_name(file_entry.name) if folder_entry and file_entry else None
+            if base_name and version_entry:
+                selection = SearchEntry('version', self.project_name, creature_name, base_name, version_entry.name, version_entry.path)
+            elif base_name:
+                selection = SearchEntry('asset', self.project_name, creature_name, base_name, file_entry.name, file_entry.path)
+            elif creature_name:
+                selection = SearchEntry('creature', self.project_name, creature_name, None, creature_name, folder_entry.path)
+            else:
+                selection = SearchEntry('project', self.project_name, None, None, self.project_name, self.folder_path)
+        save_state(self.state_path, self.asset_directory,
+                   {'projects': projects, 'selection': selection._asdict() if selection else None,
+                    'tab': self.tabs.currentIndex()})
+
+    def refresh_projects(self):
+        # Bring the project list up to date without touching the selected project, unless it's gone
+        projects = []
+
+        def on_finished():
+            current = [self.project_selector.itemText(index) for index in range(self.project_selector.count())]
+            for index in reversed(range(len(current))):
+                if current[index] not in projects:
+                    self.project_selector.removeItem(index)
+            for index, project_name in enumerate(projects):
+                if self.project_selector.findText(project_name) < 0:
+                    self.project_selector.insertItem(index, project_name)
+
+        self.loader.load('projects', self.store.projects, projects.extend, on_finished)
+
+    def populate_projects(self, select_project=None):
+        self.project_selector.clear()
+
+        def on_finished():
+            if select_project:
+                self.project_selector.setCurrentText(select_project)
+
+        self.loader.load('projects', self.store.projects, self.project_selector.addItems, on_finished)
+
+    def on_search_edited(self, text):
+        # Runs before the completer shows its popup, so the popup always has this keystroke's matches
+        results = self.search_index.search(text)
+        self.search_results = {display_name(entry): entry for entry in results}
+        self.search_model.setStringList(list(self.search_results))
+
+    def on_search_activated(self, text):
+        entry = self.search_results.get(text)
+        if entry:
+            self.jump_to(entry)
+
+    def jump_to(self, entry):
+        # Select the project, creature, asset and version of a search result. Each list loads in the
+        # background so continue_jump picks the next step up as each one finishes
+        self.tabs.setCurrentIndex(0)
+        self.pending_jump = entry
+        if self.project_selector.currentText() != entry.project:
+            self.project_selector.setCurrentText(entry.project)
+        elif not self.loader.is_loading('folders'):
+            self.continue_jump()
+
+    def continue_jump(self):
+        entry = self.pending_jump
+        if not entry or entry.project != self.project_name:
+            return
+        if entry.kind == 'project':
+            self.pending_jump = None
+            return
+
+        folder_entry = self.folder_list.current_entry()
+        if not folder_entry or folder_entry.name != entry.creature:
+            folder_entry = self.folder_list.select_name(entry.creature)
+            if not folder_entry:
+                self.pending_jump = None
+                return
+            self.on_folder_selected(folder_entry)
+            if entry.kind == 'creature':
+                self.pending_jump = None
+            return
+        if entry.kind == 'creature':
+            self.pending_jump = None
+            return
+
+        file_entry = self.file_list.current_entry()
+        if not file_entry or master_base_name(file_entry.name) != entry.base_name:
+            file_entry = self.file_list.find(lambda candidate: candidate.name == entry.name) if entry.kind == 'asset' else None
+            file_entry = file_entry or self.file_list.find(lambda candidate: master_base_name(candidate.name) == entry.base_name)
+            if not file_entry:
+                if not self.loader.is_loading('files'):
+                    self.pending_jump = None
+                return
+            self.file_list.select_name(file_entry.name)
+            self.on_file_selected(file_entry)
+            if entry.kind == 'asset':
+                self.pending_jump = None
+            return
+
+        version_entry = self.versions_list.select_name(entry.name)
+        if version_entry:
+            self.on_version_selected(version_entry)
+            self.pending_jump = None
+        elif not self.loader.is_loading('versions'):
+            self.pending_jump = None
+
+    def update_search_index(self, directories):
+        # Re-read the listings of changed folders into the name index, one channel each so they don't cancel
+        for directory in directories:
+            key = directory_key(self.asset_directory, directory)
+            if key is not None:
+                self.loader.load(f"search_{'/'.join(key)}", lambda key=key: refresh_listing(self.search_index, self.store, key),
+                                 lambda results: None)
+
+    def update_references(self, directories):
+        # Re-read the scenes that changed in these folders into the reference graph, one channel each like the search index
+        for directory in directories:
+            self.loader.load(f"references_{directory}", lambda directory=directory: self.store.update_references([directory]),
+                             lambda counts: None)
+
+    def setup_new_elements(self, layout):
+        self.text_box = QtWidgets.QLineEdit(self)
+        layout.addWidget(self.text_box)
+        self.file_type_checkbox = QtWidgets.QCheckBox('.mb', self)
+        self.file_type_checkbox.setChecked(True)
+        layout.addWidget(self.file_type_checkbox)
+
+        buttons_layout = QtWidgets.QHBoxLayout()
+
+        self.publish_button = QtWidgets.QPushButton('Publish', self)
+        self.publish_button.setStyleSheet("background-color: rgb(33, 157, 208);")
+        buttons_layout.addWidget(self.publish_button)
+
+        self.open_button = QtWidgets.QPushButton('Open', self)
+        buttons_layout.addWidget(self.open_button)
+
+        self.import_button = QtWidgets.QPushButton('Import', self)
+        buttons_layout.addWidget(self.import_button)
+
+        layout.addLayout(buttons_layout)
+
+        # Progress of queued publishes uploading to the share, only there while something is
+        self.publish_progress = QtWidgets.QProgressBar(self)
+        self.publish_progress.setRange(0, 1000)
+        self.publish_progress.hide()
+        layout.addWidget(self.publish_progress)
+        # Uploads that failed this session, one line in the panel however many there are
+        self.failed_publishes = []
+        self.publish_failures_label = QtWidgets.QLabel(self)
+        self.publish_failures_label.setStyleSheet("color: rgb(230, 160, 60);")
+        self.publish_failures_label.setWordWrap(True)
+        self.publish_failures_label.hide()
+        layout.addWidget(self.publish_failures_label)
+        self.publish_queue_timer = QtCore.QTimer(self)
+        self.publish_queue_timer.setInterval(PUBLISH_QUEUE_REFRESH_MS)
+        self.publish_queue_timer.timeout.connect(self.refresh_publish_queue)
+
+        self.new_notes_label = QtWidgets.QLabel('New Notes', self)
+        layout.addWidget(self.new_notes_label)
+        self.new_notes_editor = QtWidgets.QTextEdit(self)
+        self.new_notes_editor.setText(DEFAULT_NOTE_TEXT)
+        layout.addWidget(self.new_notes_editor)
+
+    def save_version(self, creature_name, base_name, notes, save_as_binary=False):
+        project_name = self.project_name
+        with span('ui.save_version', asset=f"{project_name}/{creature_name}/{base_name}"):
+            if self.store.publish_mode == "queued":
+                # Only the local save happens here, the version shows up once the queue has committed it
+                self.store.queue_publish(project_name, creature_name, base_name, notes, save_as_binary)
+                self.refresh_publish_queue()
+                self.publish_queue_timer.start()
+                return
+            self.store.publish(project_name, creature_name, base_name, notes, save_as_binary)
+        self.on_published(project_name, creature_name, base_name)
+
+    def on_published(self, project_name, creature_name, base_name, select=True):
+        # Older versions get compressed and archived in the background if settings has policies for them,
+        # the watcher sees the manifest change and updates the versions list
+        if self.store.compression_policy or self.store.retention_policy:
+            def tidy_versions():
+                yield from self.store.compress_versions(project_name, creature_name, base_name)
+                yield from self.store.apply_retention(project_name, creature_name, base_name)
+
+            self.loader.load(f"compress_{creature_name}_{base_name}", tidy_versions, lambda results: None)
+
+        # Update UI after saving, only the new entries are added so the selection is kept
+        if select and base_name != self.selected_base_name:
+            self.selected_base_name = base_name
+            self.versions_list.clear()
+            self.update_watched_directories()
+        self.refresh_visible()
+        creature_directory = self.store.creature_directory(project_name, creature_name)
+        self.update_search_index([creature_directory, os.path.join(creature_directory, f"{base_name}_versions")])
+        self.update_references([creature_directory, os.path.join(creature_directory, f"{base_name}_versions")])
+
+    def refresh_publish_queue(self):
+        # Polled while queued publishes upload, committed ones go into the lists and the bar shows the rest
+        publish_queue = self.store.publish_queue()
+        failed = []
+        for status in publish_queue.take_finished():
+            if status.state == 'committed':
+                self.on_published(status.project, status.creature, status.base_name, select=False)
+            else:
+                failed.append(status)
+        if failed:
+            self.show_failed_publishes(failed)
+        statuses = publish_queue.status()
+        if not statuses:
+            self.publish_progress.hide()
+            self.publish_queue_timer.stop()
+            return
+        done_bytes = sum(status.done_bytes for status in statuses)
+        total_bytes = sum(status.total_bytes for status in statuses)
+        self.publish_progress.setValue(int(1000 * done_bytes / total_bytes) if total_bytes else 0)
+        self.publish_progress.setFormat(f"Uploading {len(statuses)} publish{'es' if len(statuses) > 1 else ''} %p%")
+        self.publish_progress.setToolTip('\n'.join(describe_status(status) for status in statuses))
+        self.publish_progress.show()
+
+    def show_failed_publishes(self, statuses):
+        # Not a message box, a failure holds back the asset's later publishes too and they'd each pop one up
+        self.failed_publishes.extend(statuses)
+        count = len(self.failed_publishes)
+        self.publish_failures_label.setText(f"{count} publish{'es' if count > 1 else ''} couldn't upload, "
+                                            "they stay staged and are tried again next time the browser opens.")
+        self.publish_failures_label.setToolTip('\n'.join(describe_status(status) for status in self.failed_publishes))
+        self.publish_failures_label.show()
+
+    def update_directory(self):
+        selected_project = self.project_selector.currentText()
+        self.directory = os.path.join(self.asset_directory, selected_project)
+        self.folder_path = os.path.join(self.asset_directory, selected_project)
+
+        self.project_name = os.path.basename(self.directory)
+        self.loader.cancel('files', 'versions', 'notes')
+        self.file_list.clear()
+        self.versions_list.clear()
+        self.notes_editor.clear()
+        self.text_box.clear()
+        self.importer_line_edit.clear()
+        self.selected_base_name = ''
+        self.populate_folders()
+        self.update_watched_directories()
+
+    def update_watched_directories(self):
+        directories = [self.folder_path]
+        selected_folder = self.folder_list.current_entry()
+        if selected_folder:
+            creature_directory = os.path.join(self.folder_path, selected_folder.name)
+            directories.append(creature_directory)
+            if self.selected_base_name:
+                directories.append(os.path.join(creature_directory, f"{self.selected_base_name}_versions"))
+                directories.append(os.path.join(creature_directory, f"{self.selected_base_name}_notes"))
+        self.watcher.watch(directories)
+
+    def on_directories_changed(self, directories):
+        self.refresh_visible(directories)
+        self.update_search_index(directories)
+        self.update_references(directories)
+
+    def refresh_visible(self, directories=None):
+        # Bring the lists on screen up to date without clearing them, either everything or only the
+        # ones showing the given directories
+        def changed(directory):
+            return directories is None or os.path.normpath(directory) in directories
+
+        project_name = self.project_name
+        if changed(self.folder_path):
+            self.refresh_list('folders', self.folder_list, lambda: self.store.creatures(project_name))
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        creature_name = selected_folder.name
+        creature_directory = os.path.join(self.folder_path, creature_name)
+        if changed(creature_directory):
+            self.refresh_list('files', self.file_list, lambda: self.store.assets(project_name, creature_name))
+        base_name = self.selected_base_name
+        if not base_name:
+            return
+        versions_changed = changed(os.path.join(creature_directory, f"{base_name}_versions"))
+        if versions_changed:
+            self.refresh_list('versions', self.versions_list,
+                              lambda: self.store.versions(project_name, creature_name, base_name))
+        # Appending to the notes log doesn't touch the notes folder, but every publish rewrites the manifest
+        notes_changed = versions_changed or changed(os.path.join(creature_directory, f"{base_name}_notes"))
+        if notes_changed and not self.versions_list.current_entry():
+            self.populate_notes(base_name)
+
+    def add_new_project(self):
+        project_name, ok = QtWidgets.QInputDialog.getText(self, 'Add New Project', 'Enter new project name:')
+        if ok and project_name:
+            if self.store.create_project(project_name):
+                self.populate_projects(select_project=project_name)
+                self.update_search_index([self.asset_directory])
+                QtWidgets.QMessageBox.information(self, 'Success', f'New project "{project_name}" added successfully.')
+            else:
+                QtWidgets.QMessageBox.warning(self, 'Warning', f'Project "{project_name}" already exists.')
+
+    def add_new_creature(self):
+        creature_name, ok = QtWidgets.QInputDialog.getText(self, 'Add New Creature', 'Enter new creature name:')
+        if ok and creature_name:
+            if self.store.create_creature(self.project_name, creature_name):
+                self.populate_folders()
+                self.update_search_index([self.folder_path])
+                QtWidgets.QMessageBox.information(self, 'Success', f'New creature "{creature_name}" added successfully.')
+            else:
+                QtWidgets.QMessageBox.warning(self, 'Warning', f'Creature "{creature_name}" already exists.')
+
+    def on_version_double_clicked(self, entry):
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        # Versions carry their real path, in blob storage it isn't always inside the versions folder
+        file_path = entry.path
+        if not file_path or not self.store.storage.exists(file_path):
+            return
+        reply = QtWidgets.QMessageBox.question(self, 'Open', f'Are you sure you wish to open {entry.name}?',
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                               QtWidgets.QMessageBox.No)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.store.open_file(file_path)
+
+    def on_version_context_menu(self, position):
+        entry = self.versions_list.current_entry()
+        if not entry:
+            return
+        menu = QtWidgets.QMenu()
+        open_action = menu.addAction("Open")
+        import_action = menu.addAction("Import")
+        open_action.triggered.connect(lambda: self.on_version_double_clicked(entry))
+        import_action.triggered.connect(self.on_import_clicked)
+        if logical_name(entry.name).endswith('.ma'):
+            compare_action = menu.addAction("Compare with Previous Version")
+            compare_action.triggered.connect(lambda: self.compare_with_previous(entry))
+        if self.store.is_archived(entry.path):
+            restore_action = menu.addAction("Restore from Archive")
+            restore_action.triggered.connect(lambda: self.restore_version(entry))
+        menu.exec_(self.versions_list.mapToGlobal(position))
+
+    def restore_version(self, entry):
+        project_name = self.project_name
+        creature_entry = self.folder_list.current_entry()
+        base_name = self.selected_base_name
+        if not creature_entry or not base_name:
+            return
+
+        def restore():
+            yield self.store.restore_version(project_name, creature_entry.name, base_name, entry.name)
+
+        def on_finished():
+            self.refresh_visible()
+            QtWidgets.QMessageBox.information(self, 'Restore', f'{entry.name} restored from the archive.')
+
+        self.loader.load(f"restore_{entry.path}", restore, lambda paths: None, on_finished)
+
+    def compare_with_previous(self, entry):
+        creature_entry = self.folder_list.current_entry()
+        base_name = self.selected_base_name
+        if not creature_entry or not base_name:
+            return
+        project_name = self.project_name
+        creature_name = creature_entry.name
+
+        def compare():
+            note = self.store.note_for_version(project_name, creature_name, base_name, entry.name)
+            previous = previous_version(self.store.versions(project_name, creature_name, base_name), entry.name)
+            if previous is None:
+                yield note, f"{entry.name} is the first .ma version, there is nothing before it to compare with."
+                return
+            try:
+                yield note, describe_diff(self.store.diff_versions(previous.path, entry.path))
+            except (OSError, ValueError) as e:
+                yield note, f"Could not compare {entry.name} with {previous.name} ({e})."
+
+        # On the notes channel so picking another version drops a comparison still running
+        self.notes_editor.setText(f"Comparing {entry.name} with the previous version...")
+        self.loader.load('notes', compare, self.show_version_diff)
+
+    def show_version_diff(self, results):
+        note, text = results[-1]
+        if note:
+            creation_date = QtCore.QDateTime.fromSecsSinceEpoch(int(note.timestamp)).toString("dd MMM yyyy hh:mm:ss")
+            text = f"Created on: {creation_date}\n\n{note.text}\n\n{text}"
+        self.notes_editor.setText(text)
+
+    def on_file_double_clicked(self, entry):
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        file_path = os.path.join(self.folder_path, selected_folder.name, entry.name)
+        if not self.store.storage.exists(file_path):
+            return
+        reply = QtWidgets.QMessageBox.question(self, 'Open', f'Are you sure you wish to open {entry.name}?',
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                               QtWidgets.QMessageBox.No)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.store.open_file(file_path)
+
+    def populate_folders(self):
+        self.folder_list.clear()
+        project_name = self.project_name
+        self.loader.load('folders', lambda: self.store.creatures(project_name),
+                         self.folder_list.add_entries, self.continue_jump)
+
+    def populate_files(self):
+        self.file_list.clear()
+        # Anything still loading for the previously selected creature is stale now
+        self.loader.cancel('files', 'versions', 'notes')
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        project_name = self.project_name
+        creature_name = selected_folder.name
+        self.loader.load('files', lambda: self.store.assets(project_name, creature_name),
+                         self.file_list.add_entries, self.continue_jump)
+
+    def populate_versions(self, base_name):
+        self.versions_list.clear()
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            self.loader.cancel('versions')
+            return
+        project_name = self.project_name
+        creature_name = selected_folder.name
+        self.loader.load('versions', lambda: self.store.versions(project_name, creature_name, base_name),
+                         self.versions_list.add_entries, self.continue_jump)
+
+    def populate_notes(self, base_name):
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            self.loader.cancel('notes')
+            return
+        project_name = self.project_name
+        creature_name = selected_folder.name
+
+        def read_latest_note():
+            note = self.store.latest_note(project_name, creature_name, base_name)
+            if note:
+                yield note
+
+        self.loader.load('notes', read_latest_note, self.show_latest_note)
+
+    def show_latest_note(self, notes):
+        note = notes[-1]
+        creation_date = datetime.fromtimestamp(note.timestamp).strftime("%d-%m-%Y %H:%M:%S")
+        self.notes_editor.setText(f"Created on: {creation_date}\n\n{note.text}")
+
+    def search_notes(self):
+        query = self.notes_search_edit.text().strip()
+        if not query:
+            return
+        project_name = self.project_name
+        self.notes_editor.clear()
+        self.loader.load('notes', lambda: self.store.search_notes(project_name, query), self.show_note_search_results,
+                         lambda: self.finish_note_search(query))
+
+    def show_note_search_results(self, hits):
+        for hit in hits:
+            creation_date = datetime.fromtimestamp(hit.timestamp).strftime("%d-%m-%Y")
+            self.notes_editor.append(f"{hit.creature} / {hit.base_name} v{hit.version:04d} ({creation_date})\n"
+                                     f"    {hit.snippet}\n")
+
+    def finish_note_search(self, query):
+        if not self.notes_editor.toPlainText():
+            self.notes_editor.setText(f'No notes match "{query}"')
+
+    def on_folder_selected(self, entry):
+        self.file_list.clear()
+        self.versions_list.clear()
+        self.notes_editor.clear()
+        self.details_label.clear()
+        self.text_box.clear()
+        self.selected_base_name = ''
+        self.populate_files()
+        self.update_importer_line()
+        self.update_watched_directories()
+
+    def on_file_selected(self, entry):
+        self.versions_list.clear()
+        self.notes_editor.clear()
+        self.show_details(entry, self.details_label)
+        base_name = entry.name.replace('_master.ma', '').replace('_master.mb', '')
+        self.text_box.setText(base_name)
+        self.selected_base_name = base_name
+        self.populate_versions(base_name)
+        self.populate_notes(base_name)
+        self.update_importer_line()
+        self.update_watched_directories()
+
+    def on_version_selected(self, entry):
+        self.notes_editor.clear()
+        self.show_details(entry, self.details_label)
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        base_name = self.text_box.text()
+        project_name = self.project_name
+        creature_name = selected_folder.name
+        version_name = entry.name
+
+        def read_version_note():
+            note = self.store.note_for_version(project_name, creature_name, base_name, version_name)
+            if note:
+                yield note
+
+        self.loader.load('notes', read_version_note, self.show_version_note)
+        self.update_importer_line()
+
+    def show_version_note(self, notes):
+        note = notes[-1]
+        creation_date = QtCore.QDateTime.fromSecsSinceEpoch(int(note.timestamp)).toString("dd MMM yyyy hh:mm:ss")
+        self.notes_editor.setText(f"Created on: {creation_date}\n\n{note.text}")
+
+    def update_importer_line(self):
+        selected_folder = self.folder_list.current_entry()
+        selected_file = self.file_list.current_entry() or self.versions_list.current_entry()
+        if not selected_folder or not selected_file:
+            self.importer_line_edit.clear()
+            return
+        project_name = self.project_name
+        creature_name = selected_folder.name
+        file_name = selected_file.name
+        frame_rate = '24'
+        importer_line = f"stone_importer('{project_name}', '{creature_name}', '{file_name}', '{frame_rate}')"
+        self.importer_line_edit.setText(importer_line)
+
+    def on_publish_clicked(self):
+        creature_entry = self.folder_list.current_entry()
+        if not creature_entry:
+            QtWidgets.QMessageBox.warning(self, 'Warning', 'Please select a creature.')
+            return
+        custom_namespaces = self.store.custom_namespaces()
+        if custom_namespaces:
+            reply = QtWidgets.QMessageBox.warning(self, 'Warning',
+                                                  'There are namespaces in the scene, messy!\nContinue?',
+                                                  QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                                  QtWidgets.QMessageBox.No)
+            if reply == QtWidgets.QMessageBox.No:
+                return
+        creature_name = creature_entry.name
+        base_name = self.text_box.text().strip()
+        if not base_name or base_name == "_master":
+            QtWidgets.QMessageBox.warning(self, 'Warning', 'Please add a file name.')
+            return
+        notes = self.new_notes_editor.toPlainText()
+        save_as_binary = self.file_type_checkbox.isChecked()
+        reply = QtWidgets.QMessageBox.question(self, 'Publish', 'Are you sure you wish to save?',
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                               QtWidgets.QMessageBox.No)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.save_version(creature_name, base_name, notes, save_as_binary)
+
+    def on_open_clicked(self):
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        selected_version = self.versions_list.current_entry()
+        if selected_version:
+            file_path = selected_version.path
+        else:
+            selected_file = self.file_list.current_entry()
+            if not selected_file:
+                return
+            directory = os.path.join(self.folder_path, selected_folder.name)
+            file_path = os.path.join(directory, selected_file.name)
+        if not self.store.storage.exists(file_path):
+            return
+        reply = QtWidgets.QMessageBox.question(self, 'Open', f'Are you sure you wish to open {os.path.basename(file_path)}?',
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                               QtWidgets.QMessageBox.No)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.store.open_file(file_path)
+
+    def on_import_clicked(self):
+        selected_folder = self.folder_list.current_entry()
+        if not selected_folder:
+            return
+        selected_version = self.versions_list.current_entry()
+        if selected_version:
+            file_path = selected_version.path
+        else:
+            selected_file = self.file_list.current_entry()
+            if not selected_file:
+                return
+            directory = os.path.join(self.folder_path, selected_folder.name)
+            file_path = os.path.join(directory, selected_file.name)
+        if not self.store.storage.exists(file_path):
+            return
+        reply = QtWidgets.QMessageBox.question(self, 'Import', f'Are you sure you wish to Import {os.path.basename(file_path)}?',
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                               QtWidgets.QMessageBox.No)
+        if reply == QtWidgets.QMessageBox.Yes:
+            self.store.import_file(file_path)
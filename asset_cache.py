@@ -0,0 +1,186 @@
+"""
+asset_cache.py
+
+Local read-through cache for opening and importing asset files
+
+- each file is copied from the share to a local cache folder the first time it is opened or imported,
+  later opens and imports read the local copy instead of pulling the whole scene over the network again
+- published versions never change so a cached version is served without touching the share at all,
+  masters and anything else get a size/mtime check against the share before their copy is reused
+- compressed versions are decompressed on their way into the cache
+- the cache is bounded by total size, the least recently used files are evicted first
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from asset_blobs import BLOB_DIRECTORY_NAME
+from asset_compress import decompress_file, is_compressed, logical_name
+from asset_files import fast_copy, file_checksum, replace_file, temp_path_for
+
+CACHE_INDEX_FILE_NAME = '.cache_index.sqlite'
+DEFAULT_MAX_GB = 50.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cached (
+    source TEXT PRIMARY KEY,
+    local TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+
+class CacheError(RuntimeError):
+    pass
+
+
+def is_immutable(source_path):
+    # Anything inside a <base>_versions folder is a published version and never changes, same for blobs
+    if os.path.basename(os.path.dirname(source_path)).endswith('_versions'):
+        return True
+    return f"{os.sep}{BLOB_DIRECTORY_NAME}{os.sep}" in os.path.normpath(source_path)
+
+
+class LocalCache(object):
+    def __init__(self, cache_directory, max_bytes=int(DEFAULT_MAX_GB * 1024 ** 3), roots=()):
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        # Files under one of these roots keep their layout in the cache, anything else goes under "other"
+        self.roots = [root for root in roots if root]
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            if not os.path.exists(self.cache_directory):
+                os.makedirs(self.cache_directory)
+            self._connection = sqlite3.connect(os.path.join(self.cache_directory, CACHE_INDEX_FILE_NAME),
+                                               timeout=30, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def local_path_for(self, source_path):
+        source_path = os.path.abspath(source_path)
+        for index, root in enumerate(self.roots):
+            root = os.path.abspath(root)
+            if os.path.commonpath([root, source_path]) == root:
+                return os.path.join(self.cache_directory, f"root{index}", logical_name(os.path.relpath(source_path, root)))
+        drive, tail = os.path.splitdrive(source_path)
+        return os.path.join(self.cache_directory, 'other', drive.replace(':', '').strip('\\/'), logical_name(tail.lstrip('\\/')))
+
+    def fetch(self, source_path, checksum=None):
+        # Return a local path for source_path, copying it down first if the cache doesn't have a good copy.
+        # checksum ("sha256:<hex>" from the manifest) is verified on the fresh copy when given.
+        # Compressed (.gz) files are cached decompressed
+        source_path = os.path.abspath(source_path)
+        local_path = self.local_path_for(source_path)
+        with self._lock:
+            row = self._connect().execute('SELECT size, mtime FROM cached WHERE source = ?', (source_path,)).fetchone()
+
+        if row and os.path.exists(local_path):
+            if is_immutable(source_path):
+                self._touch(source_path)
+                return local_path
+            try:
+                stat = os.stat(source_path)
+            except OSError:
+                # Share went away, the copy we have is better than nothing
+                print(f"Warning: {source_path} is unreachable, using the cached copy.")
+                self._touch(source_path)
+                return local_path
+            if stat.st_size == row[0] and stat.st_mtime == row[1]:
+                self._touch(source_path)
+                return local_path
+
+        return self._download(source_path, local_path, checksum)
+
+    def _download(self, source_path, local_path, checksum):
+        stat = os.stat(source_path)
+        if stat.st_size > self.max_bytes:
+            raise CacheError(f"{source_path} is bigger than the whole cache, open it from the share instead.")
+        local_directory = os.path.dirname(local_path)
+        if not os.path.exists(local_directory):
+            os.makedirs(local_directory)
+        self.evict(self.max_bytes - stat.st_size)
+
+        if is_compressed(source_path):
+            # decompress_file hashes as it writes so the checksum check costs no extra read
+            written_checksum = decompress_file(source_path, local_path)
+            if checksum and written_checksum != checksum:
+                os.remove(local_path)
+                raise CacheError(f"Decompressed {source_path} doesn't match its published checksum.")
+        else:
+            temp_path = temp_path_for(local_path)
+            try:
+                fast_copy(source_path, temp_path, 'copy')
+                if os.path.getsize(temp_path) != stat.st_size:
+                    raise CacheError(f"Copy of {source_path} came out the wrong size, the file may still be being written.")
+                if checksum and file_checksum(temp_path, checksum.split(':', 1)[0]) != checksum:
+                    raise CacheError(f"Copy of {source_path} doesn't match its published checksum.")
+                replace_file(temp_path, local_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        # Sizes in the index are what the file takes up locally, for plain copies that's the source size
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO cached (source, local, size, mtime, last_used) '
+                                   'VALUES (?, ?, ?, ?, ?)', (source_path, local_path, os.path.getsize(local_path),
+                                                              stat.st_mtime, time.time()))
+        self.evict(keep=source_path)
+        return local_path
+
+    def _touch(self, source_path):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('UPDATE cached SET last_used = ? WHERE source = ?', (time.time(), source_path))
+
+    def total_size(self):
+        with self._lock:
+            return self._connect().execute('SELECT COALESCE(SUM(size), 0) FROM cached').fetchone()[0]
+
+    def evict(self, target_bytes=None, keep=None):
+        # Remove least recently used files until the cache holds at most target_bytes, never keep
+        target_bytes = self.max_bytes if target_bytes is None else max(0, target_bytes)
+        with self._lock:
+            connection = self._connect()
+            total = self.total_size()
+            if total <= target_bytes:
+                return 0
+            freed = 0
+            rows = connection.execute('SELECT source, local, size FROM cached ORDER BY last_used').fetchall()
+            with connection:
+                for source_path, local_path, size in rows:
+                    if total - freed <= target_bytes:
+                        break
+                    if source_path == keep:
+                        continue
+                    try:
+                        os.remove(local_path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        # Probably open in another maya session, leave it for next time
+                        print(f"Warning: Could not evict {local_path} ({e}).")
+                        continue
+                    connection.execute('DELETE FROM cached WHERE source = ?', (source_path,))
+                    freed += size
+            return freed
+
+    def clear(self):
+        return self.evict(0)
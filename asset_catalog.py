@@ -0,0 +1,258 @@
+"""
+asset_catalog.py
+
+Persistent catalog index for the asset store
+
+- keeps a small SQLite database under the asset directory with every project, creature, asset,
+  version and note entry along with its size and mtime
+- each directory listing is only re-read from the share when that directory's mtime changes,
+  so clicking around the browser costs a single stat instead of a listdir plus a stat per entry
+- paths are stored relative to the asset directory with forward slashes so the same catalog works
+  from windows and linux mounts of the share
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from asset_blobs import BlobStore, blob_root
+from asset_manifest import AssetManifest
+from asset_notes import NOTES_LOG_FILE_NAME
+from asset_storage import Storage
+
+CATALOG_FILE_NAME = '.baal_catalog.sqlite'
+MAYA_EXTENSIONS = ('.ma', '.mb')
+NOTES_EXTENSION = '.txt'
+
+# Directory mtimes this close to the time of the scan can't be trusted, some shares only keep
+# whole seconds so a file added in the same second as the scan would otherwise be missed
+MTIME_GRACE_SECONDS = 2.0
+
+CatalogEntry = namedtuple('CatalogEntry', ['name', 'path', 'is_dir', 'size', 'mtime'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    scanned REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (parent, name)
+);
+"""
+
+
+def version_number(file_name):
+    # Pull the number out of "<base>_v0001.ma" style names, None if it isn't a version
+    stem = os.path.splitext(file_name)[0]
+    if '_v' not in stem:
+        return None
+    try:
+        return int(stem.rsplit('_v', 1)[-1])
+    except ValueError:
+        return None
+
+
+class AssetCatalog(object):
+    def __init__(self, asset_directory, db_path=None, archive_directory=None, storage=None):
+        self.asset_directory = asset_directory
+        self.archive_directory = archive_directory
+        self.storage = storage or Storage()
+        self.db_path = db_path or os.path.join(asset_directory, CATALOG_FILE_NAME)
+        self._lock = threading.RLock()
+        self._connection = None
+        self.blobs = BlobStore(blob_root(asset_directory))
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        try:
+            connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            connection.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            # Read-only or locked share, keep working with a catalog that only lives for this session
+            print(f"Warning: Could not open catalog {self.db_path} ({e}). Using an in-memory catalog.")
+            connection = sqlite3.connect(':memory:', check_same_thread=False)
+            connection.executescript(SCHEMA)
+        self._connection = connection
+        return connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def relative_path(self, *parts):
+        return '/'.join(part.strip('/\\').replace('\\', '/') for part in parts if part)
+
+    def absolute_path(self, relative_path):
+        if not relative_path:
+            return self.asset_directory
+        return os.path.join(self.asset_directory, *relative_path.split('/'))
+
+    def list_directory(self, relative_path=''):
+        # Return the entries of a directory, only touching the share again if its mtime moved on
+        directory = self.absolute_path(relative_path)
+        directory_entry = self.storage.stat(directory)
+        if directory_entry is None:
+            self.forget(relative_path)
+            return []
+        directory_mtime = directory_entry.mtime
+
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT mtime, scanned FROM directories WHERE path = ?',
+                                     (relative_path,)).fetchone()
+            if row and row[0] == directory_mtime and row[1] - directory_mtime > MTIME_GRACE_SECONDS:
+                return self._cached_entries(relative_path)
+
+        entries = self._scan(directory)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM entries WHERE parent = ?', (relative_path,))
+                connection.executemany(
+                    'INSERT INTO entries (parent, name, is_dir, size, mtime) VALUES (?, ?, ?, ?, ?)',
+                    [(relative_path, entry.name, int(entry.is_dir), entry.size, entry.mtime) for entry in entries])
+                connection.execute('INSERT OR REPLACE INTO directories (path, mtime, scanned) VALUES (?, ?, ?)',
+                                   (relative_path, directory_mtime, time.time()))
+        return entries
+
+    def _scan(self, directory):
+        entries = [CatalogEntry._make(entry)
+                   for entry in self.storage.list(directory, lambda name, is_dir: not name.startswith('.'))]
+        entries.sort(key=lambda entry: entry.name.lower())
+        return entries
+
+    def _cached_entries(self, relative_path):
+        rows = self._connect().execute(
+            'SELECT name, is_dir, size, mtime FROM entries WHERE parent = ? ORDER BY name COLLATE NOCASE',
+            (relative_path,)).fetchall()
+        directory = self.absolute_path(relative_path)
+        return [CatalogEntry(name, os.path.join(directory, name), bool(is_dir), size, mtime)
+                for name, is_dir, size, mtime in rows]
+
+    def invalidate(self, *parts):
+        # Force the next lookup of a directory to go back to the share, used after we write into it
+        relative_path = self.relative_path(*parts)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM directories WHERE path = ?', (relative_path,))
+
+    def forget(self, relative_path):
+        # Drop a directory that no longer exists, along with everything under it
+        with self._lock:
+            connection = self._connect()
+            like = relative_path + '/%' if relative_path else '%'
+            with connection:
+                connection.execute('DELETE FROM directories WHERE path = ? OR path LIKE ?', (relative_path, like))
+                connection.execute('DELETE FROM entries WHERE parent = ? OR parent LIKE ?', (relative_path, like))
+
+    def refresh(self, project_name=None):
+        # Walk the store (or a single project) bringing every directory up to date, unchanged
+        # directories only cost a stat
+        relative_path = self.relative_path(project_name) if project_name else ''
+        pending = [relative_path]
+        while pending:
+            current = pending.pop()
+            for entry in self.list_directory(current):
+                if entry.is_dir:
+                    pending.append(self.relative_path(current, entry.name))
+
+    # Asset store layout queries, projects -> creatures -> assets -> versions -> notes
+
+    def projects(self):
+        return [entry.name for entry in self.list_directory('') if entry.is_dir]
+
+    def creatures(self, project_name):
+        return [entry for entry in self.list_directory(self.relative_path(project_name)) if entry.is_dir]
+
+    def assets(self, project_name, creature_name):
+        return [entry for entry in self.list_directory(self.relative_path(project_name, creature_name))
+                if not entry.is_dir and entry.name.endswith(MAYA_EXTENSIONS)]
+
+    def manifest(self, project_name, creature_name, base_name):
+        versions_directory = self.absolute_path(self.relative_path(project_name, creature_name, f"{base_name}_versions"))
+        return AssetManifest(versions_directory, base_name)
+
+    def versions(self, project_name, creature_name, base_name):
+        # Published assets have a manifest listing their versions, only older ones need the folder scanned
+        manifest = self.manifest(project_name, creature_name, base_name)
+        records = manifest.versions()
+        if records is not None:
+            return [CatalogEntry(record['file'], self.version_path(manifest, record), False,
+                                 record['size'], record['timestamp']) for record in records]
+        relative_path = self.relative_path(project_name, creature_name, f"{base_name}_versions")
+        return [entry for entry in self.list_directory(relative_path)
+                if not entry.is_dir and entry.name.endswith(MAYA_EXTENSIONS)]
+
+    def version_path(self, manifest, record):
+        # Blob stored versions the share couldn't link into the versions folder are read from the blob,
+        # compressed versions from their .gz, archived versions from the archive and object stored versions
+        # from the object store
+        if record.get('object'):
+            return record['object']
+        if record.get('archived') and self.archive_directory:
+            return os.path.join(self.archive_directory, *record['archived'].split('/'))
+        if record.get('link') == 'manifest':
+            return self.blobs.blob_path(record['blob'])
+        return os.path.join(manifest.versions_directory, record.get('stored') or record['file'])
+
+    def _note_entry(self, manifest, record):
+        if not record or not record.get('notes') or record['notes'] == NOTES_LOG_FILE_NAME:
+            return None
+        note_path = os.path.join(manifest.notes_directory, record['notes'])
+        return CatalogEntry(record['notes'], note_path, False, 0, record['timestamp'])
+
+    def notes(self, project_name, creature_name, base_name):
+        relative_path = self.relative_path(project_name, creature_name, f"{base_name}_notes")
+        return [entry for entry in self.list_directory(relative_path)
+                if not entry.is_dir and entry.name.endswith(NOTES_EXTENSION)]
+
+    def latest_note(self, project_name, creature_name, base_name):
+        manifest = self.manifest(project_name, creature_name, base_name)
+        data = manifest.read()
+        if data is not None:
+            return self._note_entry(manifest, data['latest'])
+        numbered = [(version_number(entry.name), entry) for entry in self.notes(project_name, creature_name, base_name)]
+        numbered = [(number, entry) for number, entry in numbered if number is not None]
+        if not numbered:
+            return None
+        return max(numbered, key=lambda pair: pair[0])[1]
+
+    def note_for_version(self, project_name, creature_name, base_name, version_file_name):
+        manifest = self.manifest(project_name, creature_name, base_name)
+        records = manifest.versions()
+        if records is not None:
+            for record in records:
+                if record['file'] == version_file_name:
+                    return self._note_entry(manifest, record)
+            return None
+        note_name = os.path.splitext(version_file_name)[0] + NOTES_EXTENSION
+        for entry in self.notes(project_name, creature_name, base_name):
+            if entry.name == note_name:
+                return entry
+        return None
+
+    def resolve(self, project_name, creature_name, file_name):
+        # Find an asset file by name, version names like "<base>_v0003.mb" are looked up in their
+        # versions folder so the importer line works for versions as well as masters
+        for entry in self.assets(project_name, creature_name):
+            if entry.name == file_name:
+                return entry
+        if version_number(file_name) is not None:
+            base_name = os.path.splitext(file_name)[0].rsplit('_v', 1)[0]
+            for entry in self.versions(project_name, creature_name, base_name):
+                if entry.name == file_name:
+                    return entry
+        return None
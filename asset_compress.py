@@ -0,0 +1,191 @@
+"""
+asset_compress.py
+
+Compressed tier for old published versions
+
+- maya ascii compresses 5-10x, versions picked by the "compression" policy in settings.json are stream
+  compressed to <name>.gz in chunks so even huge scenes never have to fit in memory
+- the manifest keeps listing them under their normal _vNNNN name, opening or importing one decompresses
+  it to the local cache (or a temp folder) first
+- a compressed copy is only kept once it has been read back and matches the original's hash
+
+    "compression": {"keep_latest": 5, "older_than_days": 30, "extensions": [".ma"], "level": 6}
+
+    python asset_compress.py apply [--dry-run] [--asset-directory PATH]
+
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import time
+from collections import namedtuple
+
+from asset_files import CHECKSUM_CHUNK_SIZE, replace_file, temp_path_for
+from asset_manifest import MANIFEST_FILE_NAME, AssetManifest
+
+COMPRESSED_EXTENSION = '.gz'
+DEFAULT_POLICY = {
+    'keep_latest': 5,
+    'older_than_days': 30,
+    'extensions': ['.ma'],
+    'level': 6,
+}
+
+CompressResult = namedtuple('CompressResult', ['file', 'original_size', 'compressed_size'])
+
+
+def compression_policy(settings):
+    # The compression policy from settings, None when compression is off
+    policy = settings.get("compression")
+    if not policy:
+        return None
+    merged = dict(DEFAULT_POLICY)
+    merged.update(policy if isinstance(policy, dict) else {})
+    return merged
+
+
+def is_compressed(file_path):
+    return file_path.endswith(COMPRESSED_EXTENSION)
+
+
+def logical_name(file_name):
+    return file_name[:-len(COMPRESSED_EXTENSION)] if is_compressed(file_name) else file_name
+
+
+def compress_file(source_path, destination_path, level=6):
+    # Stream source_path into a gzip file, returns the sha256 of the uncompressed data
+    digest = hashlib.sha256()
+    temp_path = temp_path_for(destination_path)
+    try:
+        with open(source_path, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=level) as destination:
+            for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                destination.write(chunk)
+        replace_file(temp_path, destination_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return f"sha256:{digest.hexdigest()}"
+
+
+def decompress_file(source_path, destination_path):
+    # Stream a gzip file back out, returns the sha256 of what was written
+    digest = hashlib.sha256()
+    temp_path = temp_path_for(destination_path)
+    try:
+        with gzip.open(source_path, 'rb') as source, open(temp_path, 'wb') as destination:
+            for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                destination.write(chunk)
+        replace_file(temp_path, destination_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return f"sha256:{digest.hexdigest()}"
+
+
+def compressed_checksum(file_path):
+    # Hash of the uncompressed data in a gzip file without writing it anywhere
+    digest = hashlib.sha256()
+    with gzip.open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def select_versions(records, policy, now=None):
+    # Records the policy wants compressed, never the newest keep_latest versions, anything blob or object
+    # stored or anything already moved to the archive
+    now = now or time.time()
+    keep_latest = max(0, int(policy['keep_latest']))
+    cutoff = now - float(policy['older_than_days']) * 86400
+    extensions = tuple(policy['extensions'])
+    candidates = records[:-keep_latest] if keep_latest else records
+    return [record for record in candidates
+            if not record.get('compressed') and not record.get('blob') and not record.get('archived')
+            and not record.get('object') and record['file'].endswith(extensions) and record['timestamp'] <= cutoff]
+
+
+def compress_versions(manifest, policy, dry_run=False):
+    # Apply the policy to one asset, returns a CompressResult per version compressed (or that would be)
+    data = manifest.read()
+    if data is None:
+        return []
+    results = []
+    for record in select_versions(data['versions'], policy):
+        source_path = os.path.join(manifest.versions_directory, record['file'])
+        if not os.path.exists(source_path):
+            continue
+        stored_name = record['file'] + COMPRESSED_EXTENSION
+        stored_path = os.path.join(manifest.versions_directory, stored_name)
+        if dry_run:
+            results.append(CompressResult(record['file'], record['size'], None))
+            continue
+
+        checksum = compress_file(source_path, stored_path, int(policy['level']))
+        expected = record.get('checksum') or checksum
+        if checksum != expected or compressed_checksum(stored_path) != expected:
+            os.remove(stored_path)
+            print(f"Warning: {source_path} doesn't match its published checksum, left uncompressed.")
+            continue
+
+        # Point the manifest at the compressed copy before the original goes, so readers always find one
+        compressed_size = os.path.getsize(stored_path)
+        with manifest.lock():
+            current = manifest.load()
+            for current_record in current['versions']:
+                if current_record['file'] == record['file']:
+                    current_record.update({'compressed': 'gzip', 'stored': stored_name, 'stored_size': compressed_size,
+                                           'checksum': expected})
+            if current['latest'] and current['latest']['file'] == record['file']:
+                current['latest'].update({'compressed': 'gzip', 'stored': stored_name, 'stored_size': compressed_size})
+            manifest.write(current)
+        os.remove(source_path)
+        results.append(CompressResult(record['file'], record['size'], compressed_size))
+    return results
+
+
+def asset_manifests(asset_directory):
+    # Every asset manifest in the store
+    for directory, folder_names, file_names in os.walk(asset_directory):
+        folder_names[:] = [name for name in folder_names if not name.startswith('.')]
+        if MANIFEST_FILE_NAME in file_names and os.path.basename(directory).endswith('_versions'):
+            yield AssetManifest(directory, os.path.basename(directory)[:-len('_versions')])
+
+
+def apply_policy(asset_directory, policy, dry_run=False):
+    results = []
+    for manifest in asset_manifests(asset_directory):
+        results.extend(compress_versions(manifest, policy, dry_run))
+    return results
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Compress old asset store versions using the settings.json policy.")
+    parser.add_argument('command', choices=['apply'])
+    parser.add_argument('--dry-run', action='store_true', help="only list what would be compressed")
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    from asset_store import load_settings
+    settings = load_settings()
+    policy = compression_policy(settings)
+    if not policy:
+        print("No compression policy in settings.json, nothing to do.")
+        return 0
+    results = apply_policy(arguments.asset_directory or settings["asset_directory"], policy, arguments.dry_run)
+    original = sum(result.original_size for result in results)
+    if arguments.dry_run:
+        print(f"Would compress {len(results)} versions, {original / 1024 ** 2:.1f} MB")
+    else:
+        compressed = sum(result.compressed_size for result in results)
+        print(f"Compressed {len(results)} versions, {original / 1024 ** 2:.1f} MB down to {compressed / 1024 ** 2:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,427 @@
+"""
+asset_diff.py
+
+Structural diff between two published .ma versions without opening them in maya
+
+- a .ma file is streamed a line at a time and every statement is hashed as it goes past, a createNode and
+  the setAttr/addAttr lines under it make up a node's block, top level connectAttr lines are connections.
+  Nothing bigger than one line is ever held, even mesh data thousands of lines long
+- each version boils down to a summary: a hash per node and per attribute and the list of connections.
+  Comparing two summaries gives the added, removed and modified nodes (with the attributes that changed)
+  and the added and removed connections
+- summaries are cached in a small SQLite database keyed by the version's published checksum, so stepping
+  through a long history reads every version once however many comparisons it's in, and compressing,
+  archiving or moving a version to the object store doesn't throw its summary away
+- compressed (.gz) versions are streamed through gzip, object stored ones are downloaded first
+
+    python asset_diff.py files E:/assets/heromodel_v0012.ma E:/assets/heromodel_v0013.ma
+    python asset_diff.py versions PROJECT1 sphereman heromodel_v0013.ma [--against heromodel_v0010.ma]
+
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from asset_catalog import version_number
+from asset_compress import logical_name
+from asset_metadata import STATEMENT_TOKENS, statement_tokens
+from asset_trace import span
+
+DIFF_FILE_NAME = '.baal_diff.sqlite'
+SUMMARY_FORMAT = 1
+MAX_CACHED_SUMMARIES = 2000
+# Only the start of a statement's first line is tokenized, that's where its node or attribute name is
+KEY_BYTES = 1024
+SCENE_NODE = '(scene)'
+SCENE_KEY_TOKENS = {'fileInfo': 2, 'requires': 2, 'currentUnit': 1}
+DEFAULT_DESCRIBE_LIMIT = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    used REAL NOT NULL,
+    summary BLOB NOT NULL
+);
+"""
+
+ModifiedNode = namedtuple('ModifiedNode', ['name', 'type', 'changed', 'added', 'removed'])
+DiffResult = namedtuple('DiffResult', ['old_path', 'new_path', 'added_nodes', 'removed_nodes', 'modified_nodes',
+                                       'added_connections', 'removed_connections'])
+
+
+def _digest():
+    return hashlib.blake2b(digest_size=8)
+
+
+def ma_blocks(lines):
+    # (indented, first line, hash) of every statement of a .ma file given its lines as bytes. Continuation
+    # lines are hashed as they stream past and never joined, // comments are skipped
+    first = None
+    for raw_line in lines:
+        line = raw_line.strip()
+        if not line:
+            continue
+        if first is None:
+            if line.startswith(b'//'):
+                continue
+            first = line
+            indented = raw_line[:1] in (b'\t', b' ')
+            digest = _digest()
+        digest.update(line)
+        digest.update(b'\n')
+        if line.endswith(b';'):
+            yield indented, first, digest.hexdigest()
+            first = None
+    if first is not None:
+        yield indented, first, digest.hexdigest()
+
+
+def _tokens(first_line):
+    return statement_tokens(first_line[:KEY_BYTES].decode('utf-8', 'replace'))
+
+
+def _flag_value(tokens, *flags):
+    for index, token in enumerate(tokens[:-1]):
+        if token in flags:
+            return tokens[index + 1]
+    return None
+
+
+def _attribute_key(tokens, first_line):
+    # What a statement under a node is about: the attribute it sets or adds, else its command
+    command = tokens[0] if tokens else ''
+    if command == 'setAttr':
+        attribute = next((token for token in tokens[1:] if token.startswith('.')), None)
+        if attribute:
+            return attribute
+    elif command == 'addAttr':
+        name = _flag_value(tokens, '-ln', '-longName', '-sn', '-shortName')
+        if name:
+            return f"addAttr {name}"
+    elif command == 'rename' and '-uid' in tokens:
+        return 'uid'
+    return command or first_line[:80].decode('utf-8', 'replace')
+
+
+def _scene_key(tokens, first_line):
+    # Top level statements other than nodes and connections. fileInfo, requires and currentUnit are keyed
+    # by what they set so a new value shows as a change, anything else (relationships, references) by its text
+    count = SCENE_KEY_TOKENS.get(tokens[0] if tokens else None)
+    if count:
+        return ' '.join(tokens[:count + 1])
+    return first_line[:200].decode('utf-8', 'replace').rstrip(';').strip()
+
+
+def _connection(first_line, tokens):
+    # "source -> destination" of a connectAttr, plugs are always quoted in .ma files
+    text = first_line[:KEY_BYTES].decode('utf-8', 'replace')
+    plugs = [quoted for quoted, bare in STATEMENT_TOKENS.findall(text) if quoted]
+    if len(plugs) < 2:
+        plugs = [token for token in tokens[1:] if not token.startswith('-')]
+    return f"{plugs[0]} -> {plugs[1]}" if len(plugs) >= 2 else text.rstrip(';')
+
+
+def _node_key(tokens):
+    name = _flag_value(tokens, '-n', '-name')
+    parent = _flag_value(tokens, '-p', '-parent')
+    if name is None:
+        name = tokens[1] if len(tokens) > 1 else 'unnamed'
+    return f"{parent}|{name}" if parent else name
+
+
+class _Node(object):
+    def __init__(self, node_type, header_hash):
+        self.type = node_type
+        self.digest = _digest()
+        self.digest.update(header_hash.encode('ascii'))
+        self.attributes = []
+        self.counts = {}
+
+    def add(self, key, block_hash):
+        # The same attribute set twice in one block (array sizes, then elements) is numbered
+        key = key.replace('\t', ' ')
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count > 1:
+            key = f"{key}#{count}"
+        self.attributes.append(f"{key}\t{block_hash}")
+        self.digest.update(block_hash.encode('ascii'))
+
+    def summary(self):
+        return [self.type, self.digest.hexdigest(), '\n'.join(self.attributes)]
+
+
+def summarize(lines):
+    # Summary of a .ma file given its lines as bytes: {"nodes": {name: [type, hash, attributes]},
+    # "connections": [...]}. A node's attributes are "key<tab>hash" lines, only split up when it changed
+    nodes = {}
+    connections = []
+    scene = _Node('scene', '')
+    current = None
+
+    def finish(node_key, node):
+        if node_key in nodes:
+            index = 2
+            while f"{node_key}#{index}" in nodes:
+                index += 1
+            node_key = f"{node_key}#{index}"
+        nodes[node_key] = node.summary()
+
+    for indented, first_line, block_hash in ma_blocks(lines):
+        tokens = _tokens(first_line)
+        if indented:
+            if current is None:
+                scene.add(_scene_key(tokens, first_line), block_hash)
+            else:
+                current[1].add(_attribute_key(tokens, first_line), block_hash)
+            continue
+        if current is not None:
+            finish(*current)
+            current = None
+        command = tokens[0] if tokens else ''
+        if command == 'createNode':
+            current = (_node_key(tokens), _Node(tokens[1] if len(tokens) > 1 else '', block_hash))
+        elif command == 'select' and len(tokens) > 1:
+            # "select -ne :time1" opens a block of setAttrs on a node maya makes itself
+            current = (tokens[-1], _Node('select', ''))
+        elif command == 'connectAttr':
+            connections.append(_connection(first_line, tokens))
+        else:
+            scene.add(_scene_key(tokens, first_line), block_hash)
+    if current is not None:
+        finish(*current)
+    if scene.attributes:
+        nodes[SCENE_NODE] = scene.summary()
+    return {'format': SUMMARY_FORMAT, 'nodes': nodes, 'connections': connections}
+
+
+def scene_lines(path):
+    # Open a .ma (or .ma.gz) file for summarize, maya binary files can't be compared
+    if path.endswith('.gz'):
+        scene_file = gzip.open(path, 'rb')
+    else:
+        scene_file = open(path, 'rb')
+    if scene_file.read(4) in (b'FOR4', b'FOR8'):
+        scene_file.close()
+        raise ValueError(f"{os.path.basename(path)} is a maya binary file, only .ma versions can be compared.")
+    scene_file.seek(0)
+    return scene_file
+
+
+def summarize_file(path):
+    with span('fs.summarize', path=path) as current, scene_lines(path) as scene_file:
+        summary = summarize(scene_file)
+        current.set(nodes=len(summary['nodes']))
+    return summary
+
+
+def _split_attributes(text):
+    return dict(line.split('\t', 1) for line in text.split('\n')) if text else {}
+
+
+def diff_summaries(old_summary, new_summary, old_path=None, new_path=None):
+    old_nodes = old_summary['nodes']
+    new_nodes = new_summary['nodes']
+    added = [(name, node[0]) for name, node in new_nodes.items() if name not in old_nodes]
+    removed = [(name, node[0]) for name, node in old_nodes.items() if name not in new_nodes]
+    modified = []
+    for name, node in new_nodes.items():
+        old_node = old_nodes.get(name)
+        if old_node is None or old_node[1] == node[1]:
+            continue
+        old_attributes = _split_attributes(old_node[2])
+        new_attributes = _split_attributes(node[2])
+        changed = [key for key, value in new_attributes.items() if key in old_attributes and old_attributes[key] != value]
+        if old_node[0] != node[0]:
+            changed.insert(0, 'type')
+        elif not changed and old_attributes == new_attributes:
+            changed.append('createNode')
+        modified.append(ModifiedNode(name, node[0], changed,
+                                     [key for key in new_attributes if key not in old_attributes],
+                                     [key for key in old_attributes if key not in new_attributes]))
+    old_connections = set(old_summary['connections'])
+    new_connections = set(new_summary['connections'])
+    return DiffResult(old_path, new_path, added, removed, modified,
+                      [connection for connection in new_summary['connections'] if connection not in old_connections],
+                      [connection for connection in old_summary['connections'] if connection not in new_connections])
+
+
+def diff_files(old_path, new_path, cache=None):
+    # DiffResult between two .ma files, through cache (a DiffCache) when there is one
+    if cache is None:
+        return diff_summaries(summarize_file(old_path), summarize_file(new_path), old_path, new_path)
+    return diff_summaries(cache.summary(old_path), cache.summary(new_path), old_path, new_path)
+
+
+def previous_version(version_entries, file_name):
+    # The newest version older than file_name saved as the same file type, None if it's the first
+    extension = os.path.splitext(logical_name(file_name))[1]
+    number = version_number(logical_name(file_name))
+    if number is None:
+        return None
+    older = [(version_number(logical_name(entry.name)), entry) for entry in version_entries
+             if os.path.splitext(logical_name(entry.name))[1] == extension]
+    older = [(entry_number, entry) for entry_number, entry in older if entry_number is not None and entry_number < number]
+    return max(older, key=lambda pair: pair[0])[1] if older else None
+
+
+def _limited(lines, items, limit, format_item):
+    for item in items[:limit]:
+        lines.append(f"    {format_item(item)}")
+    if len(items) > limit:
+        lines.append(f"    ... and {len(items) - limit} more")
+
+
+def _describe_modified(node):
+    parts = [', '.join(node.changed)] if node.changed else []
+    if node.added:
+        parts.append('added ' + ', '.join(node.added))
+    if node.removed:
+        parts.append('removed ' + ', '.join(node.removed))
+    return f"{node.name} ({node.type}): {'; '.join(parts)}"
+
+
+def describe_diff(result, limit=DEFAULT_DESCRIBE_LIMIT):
+    # A few lines per kind of change for the notes pane, each list cut off after limit entries
+    old_name = os.path.basename(result.old_path or 'old')
+    new_name = os.path.basename(result.new_path or 'new')
+    lines = [f"Changes from {old_name} to {new_name}"]
+    if not any(result[2:]):
+        lines.append("No structural differences, the two versions have the same nodes, attributes and connections.")
+        return '\n'.join(lines)
+    lines.append(f"Nodes: {len(result.added_nodes)} added, {len(result.removed_nodes)} removed, "
+                 f"{len(result.modified_nodes)} modified")
+    lines.append(f"Connections: {len(result.added_connections)} added, {len(result.removed_connections)} removed")
+    sections = [
+        ("Added nodes", result.added_nodes, lambda node: f"{node[0]} ({node[1]})"),
+        ("Removed nodes", result.removed_nodes, lambda node: f"{node[0]} ({node[1]})"),
+        ("Modified nodes", result.modified_nodes, _describe_modified),
+        ("Added connections", result.added_connections, str),
+        ("Removed connections", result.removed_connections, str),
+    ]
+    for title, items, format_item in sections:
+        if items:
+            lines.append('')
+            lines.append(f"{title}:")
+            _limited(lines, items, limit, format_item)
+    return '\n'.join(lines)
+
+
+class DiffCache(object):
+    # Summaries by published checksum, or by path checked against size and mtime for anything unpublished.
+    # The least recently used are dropped past MAX_CACHED_SUMMARIES
+    def __init__(self, db_path, max_summaries=MAX_CACHED_SUMMARIES):
+        self.db_path = db_path
+        self.max_summaries = max_summaries
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            try:
+                self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open diff cache {self.db_path} ({e}). Using an in-memory cache.")
+                self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def lookup(self, checksum):
+        # Cached summary of a published version, None if it hasn't been summarized yet
+        return self._get(f"{checksum}:{SUMMARY_FORMAT}")
+
+    def _get(self, key, size=0, mtime=0.0):
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT size, mtime, summary FROM summaries WHERE key = ?', (key,)).fetchone()
+            if not row or row[0] != size or row[1] != mtime:
+                return None
+            with connection:
+                connection.execute('UPDATE summaries SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row[2]).decode('utf-8'))
+
+    def _put(self, key, size, mtime, summary):
+        data = zlib.compress(json.dumps(summary, separators=(',', ':')).encode('utf-8'))
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO summaries (key, size, mtime, used, summary) VALUES (?, ?, ?, ?, ?)',
+                                   (key, size, mtime, time.time(), data))
+                connection.execute('DELETE FROM summaries WHERE key NOT IN '
+                                   '(SELECT key FROM summaries ORDER BY used DESC LIMIT ?)', (self.max_summaries,))
+
+    def summary(self, path, checksum=None):
+        # Summary of the local file at path, read from it only when it isn't cached. Published versions
+        # pass their checksum and are found again wherever the file moves
+        if checksum:
+            key, size, mtime = f"{checksum}:{SUMMARY_FORMAT}", 0, 0.0
+        else:
+            stat = os.stat(path)
+            key = f"{os.path.normcase(os.path.abspath(path))}:{SUMMARY_FORMAT}"
+            size, mtime = stat.st_size, stat.st_mtime
+        summary = self._get(key, size, mtime)
+        if summary is None:
+            summary = summarize_file(path)
+            self._put(key, size, mtime, summary)
+        return summary
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Compare the nodes and connections of two .ma versions.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    files_parser = subparsers.add_parser('files', help="compare two .ma files")
+    files_parser.add_argument('old')
+    files_parser.add_argument('new')
+    versions_parser = subparsers.add_parser('versions', help="compare a published version with an earlier one")
+    versions_parser.add_argument('project')
+    versions_parser.add_argument('creature')
+    versions_parser.add_argument('version', help="version file name, e.g. heromodel_v0013.ma")
+    versions_parser.add_argument('--against', help="older version to compare with, defaults to the previous one")
+    parser.add_argument('--limit', type=int, default=DEFAULT_DESCRIBE_LIMIT, help="entries shown per section")
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'files':
+        print(describe_diff(diff_files(arguments.old, arguments.new), arguments.limit))
+        return 0
+
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if arguments.asset_directory:
+        settings["asset_directory"] = arguments.asset_directory
+    store = AssetStore(settings)
+    try:
+        base_name = logical_name(arguments.version).rsplit('_v', 1)[0]
+        entries = list(store.versions(arguments.project, arguments.creature, base_name))
+        new_entry = next((entry for entry in entries if logical_name(entry.name) == logical_name(arguments.version)), None)
+        if arguments.against:
+            old_entry = next((entry for entry in entries if logical_name(entry.name) == logical_name(arguments.against)), None)
+        else:
+            old_entry = previous_version(entries, arguments.version)
+        if new_entry is None or old_entry is None:
+            print(f"Nothing to compare {arguments.version} with in {arguments.project}/{arguments.creature}.")
+            return 1
+        print(describe_diff(store.diff_versions(old_entry.path, new_entry.path), arguments.limit))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
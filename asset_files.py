@@ -0,0 +1,121 @@
+"""
+asset_files.py
+
+File helpers for publishing into the asset store
+
+- fast copies that clone the file (reflink) where the file system supports it, optionally hard link,
+  and fall back to a plain buffered copy everywhere else
+- atomic replace, the new file is built next to the destination under a temp name and renamed over
+  it, so anyone reading the destination sees either the old file or the new one, never a gap
+
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import time
+import uuid
+
+from asset_trace import span
+
+COPY_METHODS = ('auto', 'reflink', 'hardlink', 'copy')
+
+# Linux FICLONE ioctl, shares the data blocks between both files on btrfs, xfs, zfs etc
+FICLONE = 0x40049409
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Windows refuses to rename over a file someone has open, give readers a moment to let go
+REPLACE_RETRIES = 10
+REPLACE_RETRY_DELAY = 0.2
+
+
+def file_checksum(file_path, algorithm='sha256'):
+    # Hash a file in chunks so multi GB scenes never have to fit in memory, returned as "sha256:<hex>"
+    digest = hashlib.new(algorithm)
+    size = 0
+    with span('fs.checksum', path=file_path) as current, open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        current.set(bytes=size)
+    return f"{algorithm}:{digest.hexdigest()}"
+
+
+def reflink(source_path, destination_path):
+    # Clone source_path into a new file, raises OSError when the file system can't do it
+    if not sys.platform.startswith('linux'):
+        raise OSError(f"Reflink is not supported on {sys.platform}")
+    import fcntl
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except OSError:
+            destination.close()
+            os.remove(destination_path)
+            raise
+
+
+def fast_copy(source_path, destination_path, method='auto'):
+    # Copy a file the cheapest way available, returns the method that was actually used.
+    # 'auto' tries a reflink then copies, 'hardlink' is opt-in because both names then share one file,
+    # so anything that writes into one of them in place changes the other too
+    if method not in COPY_METHODS:
+        raise ValueError(f"Unknown copy method '{method}', expected one of {', '.join(COPY_METHODS)}")
+    with span('fs.copy', path=destination_path) as current:
+        used = _copy(source_path, destination_path, method)
+        if current.recording:
+            current.set(method=used, bytes=os.path.getsize(destination_path))
+    return used
+
+
+def _copy(source_path, destination_path, method):
+    if method == 'hardlink':
+        try:
+            os.link(source_path, destination_path)
+            return 'hardlink'
+        except OSError:
+            pass
+    if method in ('auto', 'reflink', 'hardlink'):
+        try:
+            reflink(source_path, destination_path)
+            return 'reflink'
+        except OSError:
+            if method == 'reflink':
+                raise
+    shutil.copyfile(source_path, destination_path)
+    return 'copy'
+
+
+def temp_path_for(destination_path):
+    # Hidden temp name in the same folder so the final rename never crosses devices, the extension is
+    # kept so anything that cares (maya) still recognises the file type
+    directory, file_name = os.path.split(destination_path)
+    extension = os.path.splitext(file_name)[1]
+    return os.path.join(directory, f".{file_name}.{uuid.uuid4().hex[:8]}.tmp{extension}")
+
+
+def replace_file(temp_path, destination_path):
+    # Rename temp_path over destination_path, retrying while windows has the destination locked
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(temp_path, destination_path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY)
+
+
+def atomic_copy(source_path, destination_path, method='auto'):
+    # Copy source_path over destination_path without ever leaving it missing or half written
+    temp_path = temp_path_for(destination_path)
+    try:
+        used = fast_copy(source_path, temp_path, method)
+        replace_file(temp_path, destination_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return used
@@ -0,0 +1,148 @@
+"""
+asset_loader.py
+
+Background loader for the asset store browser
+
+- runs directory scans and note reads on a small worker pool so Maya's main window never waits on the share
+- results are streamed back to the UI thread in batches so long lists start filling straight away
+- every load goes on a named channel, starting a new load on a channel cancels the one still running,
+  so clicking through creatures quickly doesn't leave old scans piling results into the lists
+
+"""
+
+import itertools
+import threading
+
+from PySide2 import QtCore
+
+from asset_trace import span
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_MAX_THREADS = 4
+
+
+class CancelToken(object):
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class _LoaderSignals(QtCore.QObject):
+    batch = QtCore.Signal(int, object)
+    finished = QtCore.Signal(int)
+    failed = QtCore.Signal(int, str)
+
+
+class _LoaderTask(QtCore.QRunnable):
+    def __init__(self, request_id, channel, function, token, signals, batch_size):
+        super(_LoaderTask, self).__init__()
+        self.request_id = request_id
+        self.channel = channel
+        self.function = function
+        self.token = token
+        self.signals = signals
+        self.batch_size = batch_size
+
+    def run(self):
+        if self.token.cancelled:
+            return
+        # Traced as "load.<first part of the channel>" so every "details_..." load counts as one operation
+        with span(f"load.{str(self.channel).split('_', 1)[0]}", channel=self.channel):
+            self._run()
+
+    def _run(self):
+        try:
+            results = self.function() or []
+            batch = []
+            for result in results:
+                if self.token.cancelled:
+                    return
+                batch.append(result)
+                if len(batch) >= self.batch_size:
+                    self.signals.batch.emit(self.request_id, batch)
+                    batch = []
+            if self.token.cancelled:
+                return
+            if batch:
+                self.signals.batch.emit(self.request_id, batch)
+            self.signals.finished.emit(self.request_id)
+        except Exception as e:
+            if not self.token.cancelled:
+                self.signals.failed.emit(self.request_id, str(e))
+
+
+class BackgroundLoader(QtCore.QObject):
+    def __init__(self, parent=None, max_threads=DEFAULT_MAX_THREADS, batch_size=DEFAULT_BATCH_SIZE):
+        super(BackgroundLoader, self).__init__(parent)
+        # Our own pool so we don't starve anything else in Maya using the global one
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.batch_size = batch_size
+        self._ids = itertools.count(1)
+        self._requests = {}
+        self._channels = {}
+
+        self.signals = _LoaderSignals(self)
+        self.signals.batch.connect(self._on_batch)
+        self.signals.finished.connect(self._on_finished)
+        self.signals.failed.connect(self._on_failed)
+
+    def load(self, channel, function, on_batch, on_finished=None, on_failed=None):
+        # Run function() on the pool, it should return (or yield) an iterable of results.
+        # on_batch gets lists of results on the UI thread, on_finished is called once it is done
+        # and on_failed with the error message instead if function raised
+        self.cancel(channel)
+        request_id = next(self._ids)
+        token = CancelToken()
+        self._requests[request_id] = (channel, token, on_batch, on_finished, on_failed)
+        self._channels[channel] = request_id
+        self.pool.start(_LoaderTask(request_id, channel, function, token, self.signals, self.batch_size))
+        return token
+
+    def cancel(self, *channels):
+        for channel in channels:
+            request_id = self._channels.pop(channel, None)
+            request = self._requests.pop(request_id, None)
+            if request:
+                request[1].cancel()
+
+    def cancel_all(self):
+        self.cancel(*list(self._channels))
+
+    def is_loading(self, channel):
+        return channel in self._channels
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+    def _on_batch(self, request_id, batch):
+        # Anything from a cancelled or replaced request is stale by now, drop it
+        request = self._requests.get(request_id)
+        if request and not request[1].cancelled:
+            request[2](batch)
+
+    def _on_finished(self, request_id):
+        request = self._requests.pop(request_id, None)
+        if not request:
+            return
+        channel, token, on_batch, on_finished, on_failed = request
+        if self._channels.get(channel) == request_id:
+            del self._channels[channel]
+        if on_finished and not token.cancelled:
+            on_finished()
+
+    def _on_failed(self, request_id, message):
+        request = self._requests.pop(request_id, None)
+        if not request:
+            return
+        if self._channels.get(request[0]) == request_id:
+            del self._channels[request[0]]
+        print(f"Warning: Background load on '{request[0]}' failed: {message}")
+        if request[4]:
+            request[4](message)
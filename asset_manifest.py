@@ -0,0 +1,275 @@
+"""
+asset_manifest.py
+
+Per-asset publish manifest
+
+- every asset keeps a small .manifest.json in its <base>_versions folder with the next version number,
+  the latest version and a record per version (file, format, checksum, size, author, time, notes file)
+- version numbers are handed out from a small counter file next to the manifest under a lock file, so
+  allocating one is a single read and write no matter how long the history is, and two artists publishing
+  the same asset at once can never end up with the same _vNNNN
+- assets published before the manifest existed get one built from their versions and notes folders
+  the first time they are published to again. Those numbered .ma and .mb separately, so a record is
+  identified by its file name rather than just its version number
+
+"""
+
+import getpass
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+
+from asset_files import replace_file, temp_path_for
+
+MANIFEST_FILE_NAME = '.manifest.json'
+LOCK_FILE_NAME = '.publish.lock'
+COUNTER_FILE_NAME = '.next_version'
+MAYA_EXTENSIONS = ('.ma', '.mb')
+FILE_TYPES = {'.ma': 'mayaAscii', '.mb': 'mayaBinary'}
+
+# The lock is only held for the few file operations around allocating and committing a version,
+# so anything older than this was left behind by a crashed publish
+LOCK_TIMEOUT = 60.0
+LOCK_STALE_AFTER = 120.0
+LOCK_RETRY_DELAY = 0.1
+
+
+class PublishLockError(RuntimeError):
+    pass
+
+
+class PublishLock(object):
+    def __init__(self, lock_path, timeout=LOCK_TIMEOUT, stale_after=LOCK_STALE_AFTER):
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        # Unique per acquisition so a lock can tell it's still ours, not just that it's this process's
+        self.owner = None
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        owner = f"{getpass.getuser()}@{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        while True:
+            try:
+                # O_EXCL creation is atomic on local disks and on SMB/NFS shares
+                file_descriptor = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                self._break_if_stale()
+                if time.time() > deadline:
+                    raise PublishLockError(f"Timed out waiting for {self.lock_path}, held by {self._owner(self.lock_path)}")
+                time.sleep(LOCK_RETRY_DELAY)
+                continue
+            with os.fdopen(file_descriptor, 'w') as lock_file:
+                lock_file.write(owner)
+            self.owner = owner
+            return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only our own lock, if ours was broken as stale the file there now belongs to someone else
+        if self._owner(self.lock_path) != self.owner:
+            print(f"Warning: Publish lock {self.lock_path} was taken over while it was held.")
+            return
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _owner(path):
+        try:
+            with open(path, 'r') as lock_file:
+                return lock_file.read().strip() or 'unknown'
+        except OSError:
+            return 'unknown'
+
+    def _break_if_stale(self):
+        try:
+            age = time.time() - os.path.getmtime(self.lock_path)
+        except OSError:
+            return
+        if age <= self.stale_after:
+            return
+        stale_owner = self._owner(self.lock_path)
+        # Moved aside under a name of our own, a rename is atomic so two waiters can't both break it.
+        # If what got moved isn't the lock found stale someone took the lock in between, it goes back
+        broken_path = f"{self.lock_path}.{uuid.uuid4().hex[:8]}.broken"
+        try:
+            os.rename(self.lock_path, broken_path)
+        except OSError:
+            return
+        if self._owner(broken_path) == stale_owner and time.time() - os.path.getmtime(broken_path) > self.stale_after:
+            print(f"Warning: Removing stale publish lock {self.lock_path} held by {stale_owner}")
+        else:
+            try:
+                os.link(broken_path, self.lock_path)
+            except OSError:
+                print(f"Warning: Could not put back publish lock {self.lock_path} held by {self._owner(broken_path)}.")
+        try:
+            os.remove(broken_path)
+        except OSError:
+            pass
+
+
+def record_order(record):
+    return record['version'], record['file']
+
+
+def version_file_name(base_name, version, file_extension):
+    return f"{base_name}_v{version:04d}{file_extension}"
+
+
+def note_file_name(base_name, version):
+    return f"{base_name}_v{version:04d}.txt"
+
+
+class AssetManifest(object):
+    def __init__(self, versions_directory, base_name):
+        self.versions_directory = versions_directory
+        self.base_name = base_name
+        self.path = os.path.join(versions_directory, MANIFEST_FILE_NAME)
+        self.lock_path = os.path.join(versions_directory, LOCK_FILE_NAME)
+        self.counter_path = os.path.join(versions_directory, COUNTER_FILE_NAME)
+
+    @property
+    def notes_directory(self):
+        return os.path.join(os.path.dirname(self.versions_directory), f"{self.base_name}_notes")
+
+    @contextmanager
+    def lock(self):
+        with PublishLock(self.lock_path):
+            yield
+
+    def read(self):
+        # The manifest as a dict, or None if this asset doesn't have one yet
+        try:
+            with open(self.path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read manifest {self.path} ({e}).")
+            return None
+
+    def write(self, manifest):
+        temp_path = temp_path_for(self.path)
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        replace_file(temp_path, self.path)
+
+    def load(self):
+        # Read the manifest, building one from the versions folder for assets that predate it.
+        # Only call this while holding the lock
+        manifest = self.read()
+        if manifest is None:
+            manifest = self.bootstrap()
+        return manifest
+
+    def bootstrap(self):
+        records = {}
+        notes = set()
+        if os.path.isdir(self.notes_directory):
+            notes = set(os.listdir(self.notes_directory))
+        if os.path.isdir(self.versions_directory):
+            for dir_entry in os.scandir(self.versions_directory):
+                # Compressed versions are listed under the name they were published with
+                file_name = dir_entry.name[:-len('.gz')] if dir_entry.name.endswith('.gz') else dir_entry.name
+                stem, file_extension = os.path.splitext(file_name)
+                if file_extension not in MAYA_EXTENSIONS or not stem.startswith(f"{self.base_name}_v"):
+                    continue
+                try:
+                    version = int(stem.rsplit('_v', 1)[-1])
+                    stat = dir_entry.stat()
+                except (ValueError, OSError):
+                    continue
+                note_name = note_file_name(self.base_name, version)
+                # Keyed by file name, before manifests .ma and .mb versions were numbered separately
+                if file_name in records and file_name != dir_entry.name:
+                    continue
+                records[file_name] = {
+                    'version': version,
+                    'file': file_name,
+                    'format': FILE_TYPES[file_extension],
+                    'checksum': None,
+                    'size': stat.st_size,
+                    'author': None,
+                    'timestamp': stat.st_mtime,
+                    'notes': note_name if note_name in notes else None,
+                }
+                if file_name != dir_entry.name:
+                    records[file_name].update({'compressed': 'gzip', 'stored': dir_entry.name, 'stored_size': stat.st_size})
+        versions = sorted(records.values(), key=record_order)
+        return {
+            'base_name': self.base_name,
+            'next_version': versions[-1]['version'] + 1 if versions else 1,
+            'latest': versions[-1] if versions else None,
+            'versions': versions,
+        }
+
+    def _read_counter(self):
+        try:
+            with open(self.counter_path, 'r') as counter_file:
+                return int(counter_file.read().strip())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read {self.counter_path} ({e}), taking the next version from the manifest.")
+            return None
+
+    def _write_counter(self, next_version):
+        temp_path = temp_path_for(self.counter_path)
+        with open(temp_path, 'w') as counter_file:
+            counter_file.write(str(next_version))
+        replace_file(temp_path, self.counter_path)
+
+    def allocate_version(self):
+        # Reserve the next version number, a publish that fails afterwards just leaves a gap.
+        # Only the counter file is read and written, the manifest only the first time
+        if not os.path.exists(self.versions_directory):
+            os.makedirs(self.versions_directory)
+        with self.lock():
+            version = self._read_counter()
+            if version is None:
+                version = self.load()['next_version']
+            self._write_counter(version + 1)
+        return version
+
+    def commit_version(self, version, file_name, file_format, checksum, size, notes=None, promote=None, extra=None):
+        # Record a saved version. promote() is called under the lock if this version is now the
+        # latest, so the master only ever moves forward even with artists publishing side by side.
+        # extra holds any additional fields for the record, like where a blob stored version lives
+        record = {
+            'version': version,
+            'file': file_name,
+            'format': file_format,
+            'checksum': checksum,
+            'size': size,
+            'author': getpass.getuser(),
+            'timestamp': time.time(),
+            'notes': notes,
+        }
+        record.update(extra or {})
+        with self.lock():
+            manifest = self.load()
+            versions = [entry for entry in manifest['versions'] if entry['file'] != file_name]
+            versions.append(record)
+            versions.sort(key=record_order)
+            manifest['versions'] = versions
+            manifest['next_version'] = max(manifest['next_version'], version + 1)
+            is_latest = manifest['latest'] is None or version >= manifest['latest']['version']
+            if is_latest:
+                if promote:
+                    promote()
+                manifest['latest'] = record
+            self.write(manifest)
+        return is_latest
+
+    def versions(self):
+        manifest = self.read()
+        return None if manifest is None else manifest['versions']
+
+    def latest(self):
+        manifest = self.read()
+        return None if manifest is None else manifest['latest']
@@ -0,0 +1,261 @@
+"""
+asset_metadata.py
+
+Scene header metadata for .ma and .mb files without opening them in maya
+
+- .ma files are streamed a line at a time up to the first createNode, everything maya records about the
+  scene (version, units, required plugins, fileInfo) comes before that
+- .mb files are IFF, only the chunk headers of the HEAD group at the start are walked through mmap so
+  nothing else of the file is read
+- results are cached in a small SQLite database keyed by path and checked against the file's size and
+  mtime, browsing back to a file costs one stat
+
+"""
+
+import gzip
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import threading
+from collections import namedtuple
+
+from asset_trace import span
+
+METADATA_FILE_NAME = '.baal_metadata.sqlite'
+GZIP_HEADER_BYTES = 1024 * 1024
+
+TIME_UNIT_FPS = {
+    'game': 15.0, 'film': 24.0, 'pal': 25.0, 'ntsc': 30.0, 'show': 48.0, 'palf': 50.0, 'ntscf': 60.0,
+    'millisec': 1000.0, 'sec': 1.0,
+}
+
+SceneInfo = namedtuple('SceneInfo', ['path', 'size', 'mtime', 'file_format', 'maya_version', 'product', 'last_modified',
+                                     'linear_unit', 'angle_unit', 'time_unit', 'frame_rate', 'plugins', 'file_info'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    info TEXT NOT NULL
+);
+"""
+
+STATEMENT_TOKENS = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+
+def frame_rate(time_unit):
+    # Frames per second for one of maya's time units, "film" or "23.976fps" and so on
+    if not time_unit:
+        return None
+    if time_unit in TIME_UNIT_FPS:
+        return TIME_UNIT_FPS[time_unit]
+    match = re.match(r'^([\d.]+)fps$', time_unit)
+    return float(match.group(1)) if match else None
+
+
+def statement_tokens(statement):
+    return [quoted if quoted else bare for quoted, bare in STATEMENT_TOKENS.findall(statement.rstrip(';'))]
+
+
+def _flag_value(tokens, *flags):
+    for index, token in enumerate(tokens[:-1]):
+        if token in flags:
+            return tokens[index + 1]
+    return None
+
+
+def ma_statements(lines):
+    # Yield the MEL statements of a .ma file (joined across lines) and its // header comments,
+    # stops at the first createNode
+    statement = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not statement and line.startswith('//'):
+            yield line
+            continue
+        if not statement and line.startswith('createNode'):
+            return
+        statement.append(line)
+        if line.endswith(';'):
+            yield ' '.join(statement)
+            statement = []
+
+
+def read_ma_header(lines):
+    info = {'file_format': 'mayaAscii', 'plugins': [], 'file_info': {}}
+    for statement in ma_statements(lines):
+        if statement.startswith('//'):
+            if statement.startswith('//Maya ASCII'):
+                info.setdefault('maya_version', statement.split()[2] if len(statement.split()) > 2 else None)
+            elif statement.startswith('//Last modified:'):
+                info['last_modified'] = statement[len('//Last modified:'):].strip()
+            continue
+        tokens = statement_tokens(statement)
+        if not tokens:
+            continue
+        if tokens[0] == 'requires':
+            # requires [-nodeType "x" ...] "plugin" "version"
+            names = [token for index, token in enumerate(tokens[1:], 1)
+                     if not token.startswith('-') and not tokens[index - 1].startswith('-')]
+            if len(names) >= 2:
+                if names[0] == 'maya':
+                    info['maya_version'] = names[1]
+                else:
+                    info['plugins'].append([names[0], names[1]])
+        elif tokens[0] == 'currentUnit':
+            info['linear_unit'] = _flag_value(tokens, '-l', '-linear') or info.get('linear_unit')
+            info['angle_unit'] = _flag_value(tokens, '-a', '-angle') or info.get('angle_unit')
+            info['time_unit'] = _flag_value(tokens, '-t', '-time') or info.get('time_unit')
+        elif tokens[0] == 'fileInfo' and len(tokens) >= 3:
+            info['file_info'][tokens[1]] = tokens[2]
+    return info
+
+
+def iff_chunks(buffer, start, end, wide):
+    # (tag, data offset, data size) of each chunk between start and end of an IFF group.
+    # FOR8 files (maya 2014 and later) have 16 byte chunk headers aligned to 8, FOR4 8 byte ones aligned to 4
+    header_size, alignment = (16, 8) if wide else (8, 4)
+    offset = start
+    while offset + header_size <= end:
+        tag = bytes(buffer[offset:offset + 4])
+        if wide:
+            size = struct.unpack('>Q', buffer[offset + 8:offset + 16])[0]
+        else:
+            size = struct.unpack('>I', buffer[offset + 4:offset + 8])[0]
+        yield tag, offset + header_size, size
+        offset += header_size + size
+        offset += -offset % alignment
+
+
+def _c_strings(data):
+    return [part.decode('utf-8', 'replace') for part in bytes(data).split(b'\0')]
+
+
+def head_chunks(buffer):
+    # (tag, strings) of each chunk in the HEAD group of a maya binary file
+    wide = bytes(buffer[:4]) == b'FOR8'
+    if bytes(buffer[:4]) not in (b'FOR4', b'FOR8'):
+        raise ValueError("not a maya binary file")
+    header_size = 16 if wide else 8
+
+    # The top level form holds a HEAD group first, everything about the scene as a whole is in there
+    top_end = min(len(buffer), header_size + next(iff_chunks(buffer, 0, header_size + 4, wide))[2])
+    for tag, offset, size in iff_chunks(buffer, header_size + 4, top_end, wide):
+        if tag not in (b'FOR4', b'FOR8') or bytes(buffer[offset:offset + 4]) != b'HEAD':
+            return
+        for chunk_tag, chunk_offset, chunk_size in iff_chunks(buffer, offset + 4, min(offset + size, len(buffer)), wide):
+            yield chunk_tag, _c_strings(buffer[chunk_offset:chunk_offset + chunk_size])
+        return
+
+
+def read_mb_header(buffer):
+    info = {'file_format': 'mayaBinary', 'plugins': [], 'file_info': {}}
+    for chunk_tag, values in head_chunks(buffer):
+        if chunk_tag == b'VERS':
+            info['maya_version'] = values[0]
+        elif chunk_tag == b'CHNG':
+            info['last_modified'] = values[0]
+        elif chunk_tag == b'LUNI':
+            info['linear_unit'] = values[0]
+        elif chunk_tag == b'AUNI':
+            info['angle_unit'] = values[0]
+        elif chunk_tag == b'TUNI':
+            info['time_unit'] = values[0]
+        elif chunk_tag == b'PLUG' and len(values) >= 2:
+            info['plugins'].append([values[0], values[1]])
+        elif chunk_tag == b'FINF' and len(values) >= 2:
+            info['file_info'][values[0]] = values[1]
+    return info
+
+
+def read_header(path, read_ma=read_ma_header, read_mb=read_mb_header):
+    # Header metadata of a scene file as a dict, compressed (.gz) versions are read through gzip.
+    # read_ma gets the lines of an ascii file, read_mb the mapped buffer of a binary one
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as scene_file:
+            start = scene_file.read(GZIP_HEADER_BYTES)
+        if start[:4] in (b'FOR4', b'FOR8'):
+            return read_mb(start)
+        return read_ma(line.decode('utf-8', 'replace') for line in start.splitlines())
+
+    with open(path, 'rb') as scene_file:
+        magic = scene_file.read(4)
+        if magic in (b'FOR4', b'FOR8'):
+            with mmap.mmap(scene_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return read_mb(buffer)
+        scene_file.seek(0)
+        return read_ma(line.decode('utf-8', 'replace') for line in scene_file)
+
+
+def scene_info(path, stat=None):
+    stat = stat or os.stat(path)
+    header = read_header(path)
+    file_info = header.get('file_info', {})
+    return SceneInfo(path, stat.st_size, stat.st_mtime, header['file_format'],
+                     header.get('maya_version') or file_info.get('version'), file_info.get('product'),
+                     header.get('last_modified'), header.get('linear_unit'), header.get('angle_unit'),
+                     header.get('time_unit'), frame_rate(header.get('time_unit')), header.get('plugins', []), file_info)
+
+
+def describe(info):
+    # A few lines for the details pane
+    size = f"{info.size / 1024 ** 2:.1f} MB" if info.size >= 1024 ** 2 else f"{info.size / 1024:.0f} KB"
+    lines = [f"{os.path.basename(info.path)}  ({size}, {info.file_format})"]
+    if info.product or info.maya_version:
+        lines.append(f"Saved with: {info.product or 'Maya ' + info.maya_version}")
+    if info.last_modified:
+        lines.append(f"Last modified: {info.last_modified}")
+    if info.time_unit:
+        rate = f" ({info.frame_rate:g} fps)" if info.frame_rate else ''
+        lines.append(f"Time: {info.time_unit}{rate}, linear: {info.linear_unit}, angle: {info.angle_unit}")
+    if info.plugins:
+        lines.append("Plugins: " + ', '.join(f"{name} {version}" for name, version in info.plugins))
+    return '\n'.join(lines)
+
+
+class MetadataCache(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            try:
+                self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open metadata cache {self.db_path} ({e}). Using an in-memory cache.")
+                self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get(self, path):
+        # SceneInfo for path, read from the file only when it changed since it was last looked at
+        path = os.path.abspath(path)
+        with span('fs.stat', path=path):
+            stat = os.stat(path)
+        with self._lock:
+            row = self._connect().execute('SELECT size, mtime, info FROM scenes WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return SceneInfo(**json.loads(row[2]))
+
+        with span('fs.read_header', path=path, size=stat.st_size):
+            info = scene_info(path, stat)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO scenes (path, size, mtime, info) VALUES (?, ?, ?, ?)',
+                                   (path, stat.st_size, stat.st_mtime, json.dumps(info._asdict())))
+        return info
@@ -0,0 +1,425 @@
+"""
+asset_models.py
+
+List models and views for the asset store browser
+
+- the creature, asset, version and file lists are QListViews over an EntryListModel instead of
+  QListWidgets, rows are the CatalogEntry tuples the store already returns so there's no widget item per entry
+- rows are handed to the view a page at a time through canFetchMore/fetchMore, an asset with thousands
+  of versions only lays out what is scrolled into view
+- versions sort by their number newest first, sorting and filtering only reorder the rows, nothing is rebuilt
+- thumbnails are only asked for by rows the view actually paints, they load on their own small pool into
+  a size-bounded LRU of icons, rows show a placeholder until theirs arrives
+
+"""
+
+import bisect
+import os
+from collections import OrderedDict
+
+from PySide2 import QtCore, QtGui, QtWidgets
+
+from asset_catalog import version_number
+from asset_compress import logical_name
+from asset_files import replace_file, temp_path_for
+from asset_loader import BackgroundLoader
+from asset_thumbnails import THUMBNAIL_QUALITY, cache_file_name, thumbnail_path
+from asset_trace import span
+
+DEFAULT_FETCH_BATCH = 500
+THUMBNAIL_SIZE = 48
+THUMBNAIL_MEMORY_BYTES = 32 * 1024 * 1024
+THUMBNAIL_THREADS = 2
+# Rows scrolled past before their thumbnail was read are dropped from the queue, oldest first
+MAX_PENDING_THUMBNAILS = 64
+
+
+def name_sort_key(entry):
+    return entry.name.lower()
+
+
+def version_sort_key(entry):
+    # Newest version first, anything that isn't a numbered version goes after them by name
+    number = version_number(entry.name)
+    if number is None:
+        return (1, 0, entry.name.lower())
+    return (0, -number, entry.name.lower())
+
+
+class EntryListModel(QtCore.QAbstractListModel):
+    def __init__(self, parent=None, sort_key=name_sort_key, fetch_batch=DEFAULT_FETCH_BATCH):
+        super(EntryListModel, self).__init__(parent)
+        self.sort_key = sort_key
+        self.fetch_batch = fetch_batch
+        # Every loaded entry by name, then the ones passing the filter in sort order with their keys.
+        # The view sees the first _fetched rows, which is kept at the number of rows it has asked for
+        self._entries = {}
+        self._rows = []
+        self._keys = []
+        self._fetched = 0
+        self._requested = fetch_batch
+        self._filter = ''
+        self._names_by_path = {}
+        # Called with an entry for the icon to show next to it, None for no icons
+        self.icon_provider = None
+        # Called with an entry, True to grey it out (archived versions)
+        self.is_dimmed = None
+
+    # Qt model interface
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self._fetched
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self._fetched:
+            return None
+        entry = self._rows[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return entry.name
+        if role in (QtCore.Qt.UserRole, QtCore.Qt.ToolTipRole):
+            return entry.path
+        if role == QtCore.Qt.DecorationRole and self.icon_provider:
+            return self.icon_provider(entry)
+        if role == QtCore.Qt.ForegroundRole and self.is_dimmed and self.is_dimmed(entry):
+            return QtGui.QBrush(QtGui.QColor(120, 120, 120))
+        return None
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self._fetched < len(self._rows)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+        self._requested = self._fetched + self.fetch_batch
+        self._settle()
+
+    # Entries
+
+    def entry(self, row):
+        return self._rows[row] if 0 <= row < len(self._rows) else None
+
+    def row_of(self, name):
+        # Row of an entry by name, -1 if it isn't loaded or is filtered out
+        entry = self._entries.get(name)
+        return -1 if entry is None else self._row_of_entry(entry)
+
+    def find(self, predicate):
+        # First row in sort order whose entry matches, including rows the view hasn't fetched yet
+        for entry in self._rows:
+            if predicate(entry):
+                return entry
+        return None
+
+    def path_changed(self, path):
+        # Repaint the row showing path if it's on show, used when its thumbnail turns up
+        name = self._names_by_path.get(path)
+        row = self.row_of(name) if name is not None else -1
+        if 0 <= row < self._fetched:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def fetch_to(self, row):
+        while self._fetched <= row and self.canFetchMore():
+            self.fetchMore()
+
+    def clear(self):
+        self.beginResetModel()
+        self._entries = {}
+        self._rows = []
+        self._keys = []
+        self._fetched = 0
+        self._requested = self.fetch_batch
+        self._names_by_path = {}
+        self.endResetModel()
+
+    def add_entries(self, entries):
+        for entry in entries:
+            if entry.name in self._entries:
+                self._replace(entry)
+            else:
+                self._entries[entry.name] = entry
+                self._insert(entry)
+            self._names_by_path[entry.path] = entry.name
+        self._settle()
+
+    def sync_entries(self, entries):
+        # Make the model hold exactly entries, only the rows that changed are touched so the
+        # selection and scroll position survive
+        wanted = {entry.name: entry for entry in entries}
+        for name in [name for name in self._entries if name not in wanted]:
+            removed = self._entries.pop(name)
+            self._names_by_path.pop(removed.path, None)
+            self._remove(removed)
+        self.add_entries(wanted.values())
+        self._settle()
+
+    def set_filter(self, text):
+        # Only entries whose name contains text are shown, the loaded entries are kept as they are
+        text = text.strip().lower()
+        if text == self._filter:
+            return
+        self._filter = text
+        self._resort()
+
+    def set_sort_key(self, sort_key):
+        self.sort_key = sort_key
+        self._resort()
+
+    def _matches(self, entry):
+        return not self._filter or self._filter in entry.name.lower()
+
+    def _resort(self):
+        self.beginResetModel()
+        self._rows = sorted((entry for entry in self._entries.values() if self._matches(entry)), key=self.sort_key)
+        self._keys = [self.sort_key(entry) for entry in self._rows]
+        self._fetched = min(len(self._rows), self._requested)
+        self.endResetModel()
+
+    def _insert(self, entry):
+        if not self._matches(entry):
+            return
+        key = self.sort_key(entry)
+        row = bisect.bisect_right(self._keys, key)
+        if row < self._fetched:
+            # Goes in among the rows on show, _settle() trims the view back to what it asked for after
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self._rows.insert(row, entry)
+            self._keys.insert(row, key)
+            self._fetched += 1
+            self.endInsertRows()
+        else:
+            # Past what the view has fetched, it turns up when the view scrolls down to it
+            self._rows.insert(row, entry)
+            self._keys.insert(row, key)
+
+    def _remove(self, entry):
+        row = self._row_of_entry(entry)
+        if row < 0:
+            return
+        if row < self._fetched:
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            del self._rows[row]
+            del self._keys[row]
+            self._fetched -= 1
+            self.endRemoveRows()
+        else:
+            del self._rows[row]
+            del self._keys[row]
+
+    def _row_of_entry(self, entry):
+        key = self.sort_key(entry)
+        row = bisect.bisect_left(self._keys, key)
+        while row < len(self._rows) and self._keys[row] == key:
+            if self._rows[row] is entry:
+                return row
+            row += 1
+        return -1
+
+    def _replace(self, entry):
+        old_entry = self._entries[entry.name]
+        if old_entry == entry:
+            return
+        self._entries[entry.name] = entry
+        row = self._row_of_entry(old_entry)
+        if row < 0:
+            self._insert(entry)
+            return
+        self._rows[row] = entry
+        if row < self._fetched:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def _settle(self):
+        # Show exactly as many rows as the view has asked for (the first page before it asks for any),
+        # so a long history streaming in newest first doesn't end up laid out in full
+        target = min(self._requested, len(self._rows))
+        if self._fetched > target:
+            self.beginRemoveRows(QtCore.QModelIndex(), target, self._fetched - 1)
+            self._fetched = target
+            self.endRemoveRows()
+        elif self._fetched < target:
+            self.beginInsertRows(QtCore.QModelIndex(), self._fetched, target - 1)
+            self._fetched = target
+            self.endInsertRows()
+
+
+class EntryListView(QtWidgets.QListView):
+    entry_clicked = QtCore.Signal(object)
+    entry_double_clicked = QtCore.Signal(object)
+
+    def __init__(self, parent=None, sort_key=name_sort_key):
+        super(EntryListView, self).__init__(parent)
+        self.setModel(EntryListModel(self, sort_key))
+        # Every row is one line of text, letting the view assume that saves measuring each of them
+        self.setUniformItemSizes(True)
+        self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.thumbnails = None
+        self.clicked.connect(lambda index: self.entry_clicked.emit(self.model().entry(index.row())))
+        self.doubleClicked.connect(lambda index: self.entry_double_clicked.emit(self.model().entry(index.row())))
+
+    def set_thumbnails(self, thumbnails):
+        # Show thumbnails from a ThumbnailCache next to each row
+        self.thumbnails = thumbnails
+        self.setIconSize(QtCore.QSize(thumbnails.size, thumbnails.size))
+        self.model().icon_provider = lambda entry: thumbnails.icon(entry.path, entry.mtime)
+        thumbnails.ready.connect(self.model().path_changed)
+
+    def current_entry(self):
+        index = self.currentIndex()
+        return self.model().entry(index.row()) if index.isValid() else None
+
+    def select_name(self, name):
+        # Make the named entry current and scroll to it, returns the entry or None if it isn't there
+        model = self.model()
+        row = model.row_of(name)
+        if row < 0:
+            return None
+        model.fetch_to(row)
+        index = model.index(row)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
+        return model.entry(row)
+
+    def find(self, predicate):
+        return self.model().find(predicate)
+
+    def clear(self):
+        self.model().clear()
+
+    def add_entries(self, entries):
+        self.model().add_entries(entries)
+
+    def sync_entries(self, entries):
+        current = self.current_entry()
+        self.model().sync_entries(entries)
+        if current and not self.current_entry():
+            self.select_name(current.name)
+
+    def set_filter(self, text):
+        current = self.current_entry()
+        self.model().set_filter(text)
+        if current:
+            self.select_name(current.name)
+
+
+def read_thumbnail(scene_path, cache_directory, size):
+    # Downscaled thumbnail of a scene as a QImage, None if it hasn't got one. Runs on a worker thread,
+    # which QImage is fine with, the share is only read when the disk cache hasn't got it yet
+    try:
+        source_path = thumbnail_path(scene_path)
+        stat = os.stat(source_path)
+    except OSError:
+        return None
+    cache_path = os.path.join(cache_directory, cache_file_name(source_path, stat, size)) if cache_directory else None
+    if cache_path and os.path.exists(cache_path):
+        image = QtGui.QImage(cache_path)
+        if not image.isNull():
+            return image
+    with span('fs.read_thumbnail', path=source_path, bytes=stat.st_size):
+        image = QtGui.QImage(source_path)
+    if image.isNull():
+        return None
+    image = image.scaled(size, size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    if cache_path:
+        try:
+            if not os.path.exists(cache_directory):
+                os.makedirs(cache_directory)
+            temp_path = temp_path_for(cache_path)
+            if image.save(temp_path, 'JPG', THUMBNAIL_QUALITY):
+                replace_file(temp_path, cache_path)
+        except OSError as e:
+            print(f"Warning: Could not cache the thumbnail of {scene_path} ({e}).")
+    return image
+
+
+class ThumbnailCache(QtCore.QObject):
+    ready = QtCore.Signal(str)
+
+    def __init__(self, parent=None, cache_directory=None, size=THUMBNAIL_SIZE, max_bytes=THUMBNAIL_MEMORY_BYTES):
+        super(ThumbnailCache, self).__init__(parent)
+        self.cache_directory = cache_directory
+        self.size = size
+        self.max_bytes = max_bytes
+        # Its own pool, scrolling through hundreds of versions shouldn't hold up listings on the browser's
+        self.loader = BackgroundLoader(self, max_threads=THUMBNAIL_THREADS)
+        # path -> (QIcon or None for no thumbnail, bytes), least recently shown first
+        self._icons = OrderedDict()
+        self._bytes = 0
+        self._pending = OrderedDict()
+        self._running = set()
+        self._placeholders = {}
+
+    def icon(self, path, mtime=None):
+        # The thumbnail if it's loaded, otherwise a placeholder and the thumbnail is asked for.
+        # Thumbnails are kept per file mtime so a republished master gets its new one
+        key = (path, mtime)
+        cached = self._icons.get(key)
+        if cached is not None:
+            self._icons.move_to_end(key)
+            return cached[0] or self.placeholder(path)
+        self._request(key)
+        return self.placeholder(path)
+
+    def placeholder(self, path):
+        # One flat tile per file type, drawn once
+        extension = os.path.splitext(logical_name(path))[1].lstrip('.').lower()
+        icon = self._placeholders.get(extension)
+        if icon is None:
+            pixmap = QtGui.QPixmap(self.size, self.size)
+            pixmap.fill(QtGui.QColor(55, 55, 55))
+            painter = QtGui.QPainter(pixmap)
+            painter.setPen(QtGui.QColor(130, 130, 130))
+            painter.drawText(pixmap.rect(), QtCore.Qt.AlignCenter, extension)
+            painter.end()
+            icon = self._placeholders[extension] = QtGui.QIcon(pixmap)
+        return icon
+
+    def clear(self):
+        self._pending.clear()
+        self._icons.clear()
+        self._bytes = 0
+
+    def _request(self, key):
+        if key in self._running:
+            return
+        # Newest requests are read first so what's on screen now wins over what was scrolled past
+        self._pending.pop(key, None)
+        self._pending[key] = None
+        while len(self._pending) > MAX_PENDING_THUMBNAILS:
+            self._pending.popitem(last=False)
+        self._pump()
+
+    def _pump(self):
+        while self._pending and len(self._running) < THUMBNAIL_THREADS:
+            key, _ = self._pending.popitem(last=True)
+            self._running.add(key)
+            self.loader.load(f"thumbnail_{key}", lambda key=key: [read_thumbnail(key[0], self.cache_directory, self.size)],
+                             lambda images, key=key: self._store(key, images[-1]),
+                             lambda key=key: self._done(key),
+                             lambda message, key=key: self._failed(key))
+
+    def _store(self, key, image):
+        if image is None:
+            self._add(key, None, 64)
+        else:
+            self._add(key, QtGui.QIcon(QtGui.QPixmap.fromImage(image)), image.width() * image.height() * 4)
+        self.ready.emit(key[0])
+
+    def _add(self, key, icon, size):
+        old = self._icons.pop(key, None)
+        if old:
+            self._bytes -= old[1]
+        self._icons[key] = (icon, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._icons) > 1:
+            _, (_, evicted_size) = self._icons.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def _failed(self, key):
+        # Shown as having no thumbnail so it isn't asked for again on every repaint, and its slot is freed
+        self._add(key, None, 64)
+        self._done(key)
+
+    def _done(self, key):
+        self._running.discard(key)
+        self._pump()
@@ -0,0 +1,345 @@
+"""
+asset_notes.py
+
+Append-only notes log and notes search
+
+- every asset keeps its notes in one append-only notes.log in <base>_notes, with a small notes.idx of
+  fixed size (version, offset, length, time) records, so reading any version's note is one seek
+- assets that still have the old one .txt per version notes are migrated into the log the first time
+  they are published to, or all at once with the migrate command
+- a full text index (SQLite FTS5 where available) over every note in a project answers searches like
+  "knee flip" straight away, the logs only ever grow so keeping it up to date is just reading new records.
+  Assets not migrated yet are indexed from their .txt notes, read again only when their notes folder changes
+
+    python asset_notes.py migrate [--remove-text-files] [--asset-directory PATH]
+    python asset_notes.py search PROJECT "knee flip"
+
+"""
+
+import argparse
+import getpass
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from asset_manifest import PublishLock
+from asset_trace import span
+
+NOTES_LOG_FILE_NAME = 'notes.log'
+NOTES_INDEX_FILE_NAME = 'notes.idx'
+NOTES_LOCK_FILE_NAME = '.notes.lock'
+NOTES_SEARCH_FILE_NAME = '.baal_notes_index.sqlite'
+RECORD_MARKER = b'@@note '
+# What the browser's publish box starts with, a publish that kept it didn't really get a note
+DEFAULT_NOTE_TEXT = 'No new notes set by user, how lazy...'
+
+# version, offset of the record in the log, length of the whole record, publish time
+INDEX_RECORD = struct.Struct('<IQId')
+
+Note = namedtuple('Note', ['version', 'timestamp', 'author', 'text'])
+SearchHit = namedtuple('SearchHit', ['creature', 'base_name', 'version', 'timestamp', 'snippet'])
+
+
+def text_note_version(file_name, base_name):
+    # Version number of an old style "<base>_v0003.txt" notes file, None for anything else
+    if not file_name.startswith(f"{base_name}_v") or not file_name.endswith('.txt'):
+        return None
+    try:
+        return int(file_name[len(base_name) + 2:-len('.txt')])
+    except ValueError:
+        return None
+
+
+def text_notes_key(notes_log):
+    # Where an asset's .txt notes are tracked in the search index, they have no log size to go by
+    return os.path.join(notes_log.notes_directory, '*.txt')
+
+
+class NotesLog(object):
+    def __init__(self, notes_directory, base_name):
+        self.notes_directory = notes_directory
+        self.base_name = base_name
+        self.log_path = os.path.join(notes_directory, NOTES_LOG_FILE_NAME)
+        self.index_path = os.path.join(notes_directory, NOTES_INDEX_FILE_NAME)
+        self.lock_path = os.path.join(notes_directory, NOTES_LOCK_FILE_NAME)
+
+    def exists(self):
+        return os.path.exists(self.log_path)
+
+    def size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except OSError:
+            return 0
+
+    def append(self, version, text, author=None, timestamp=None):
+        if not os.path.exists(self.notes_directory):
+            os.makedirs(self.notes_directory)
+        with PublishLock(self.lock_path):
+            if not self.exists():
+                self._migrate_text_files()
+            return self._append(version, text, author or getpass.getuser(), timestamp)
+
+    def _append(self, version, text, author=None, timestamp=None):
+        # Caller holds the lock. The record goes into the log first, a crash before the index entry
+        # is written only leaves a record rebuild_index() can pick up again
+        note = Note(version, timestamp or time.time(), author, text)
+        header = json.dumps({'version': note.version, 'timestamp': note.timestamp, 'author': note.author})
+        body = note.text.encode('utf-8')
+        record = RECORD_MARKER + header.encode('utf-8') + b' ' + str(len(body)).encode('ascii') + b'\n' + body + b'\n'
+        with span('notes.append', path=self.log_path, bytes=len(record)), open(self.log_path, 'ab') as log_file:
+            log_file.seek(0, os.SEEK_END)
+            offset = log_file.tell()
+            log_file.write(record)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        with open(self.index_path, 'ab') as index_file:
+            index_file.write(INDEX_RECORD.pack(note.version, offset, len(record), note.timestamp))
+        return note
+
+    def index(self):
+        # version -> (offset, length, timestamp), a version written twice keeps its newest record
+        try:
+            with span('notes.index', path=self.index_path) as current, open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+                current.set(bytes=len(data))
+        except OSError:
+            return {}
+        entries = {}
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        for version, offset, length, timestamp in INDEX_RECORD.iter_unpack(data[:usable]):
+            entries[version] = (offset, length, timestamp)
+        return entries
+
+    def read(self, version, index=None):
+        entry = (index or self.index()).get(version)
+        if entry is None:
+            return None
+        offset, length = entry[0], entry[1]
+        with span('notes.read', path=self.log_path, bytes=length), open(self.log_path, 'rb') as log_file:
+            log_file.seek(offset)
+            return self._parse(log_file.read(length))
+
+    def latest(self):
+        index = self.index()
+        if not index:
+            return None
+        return self.read(max(index), index)
+
+    def _parse(self, record):
+        header_line, _, rest = record.partition(b'\n')
+        header_json, _, body_length = header_line[len(RECORD_MARKER):].rpartition(b' ')
+        header = json.loads(header_json.decode('utf-8'))
+        body = rest[:int(body_length)]
+        return Note(header['version'], header['timestamp'], header.get('author'), body.decode('utf-8', 'replace'))
+
+    def records(self, start_offset=0):
+        # Walk the log from start_offset, yields (offset after the record, Note)
+        try:
+            log_file = open(self.log_path, 'rb')
+        except OSError:
+            return
+        with log_file:
+            log_file.seek(start_offset)
+            while True:
+                offset = log_file.tell()
+                header_line = log_file.readline()
+                if not header_line.startswith(RECORD_MARKER) or not header_line.endswith(b'\n'):
+                    return
+                try:
+                    body_length = int(header_line.rstrip(b'\n').rpartition(b' ')[2])
+                except ValueError:
+                    return
+                body = log_file.read(body_length + 1)
+                if len(body) < body_length + 1:
+                    # Half written record at the end of the log
+                    return
+                yield offset + len(header_line) + len(body), self._parse(header_line + body)
+
+    def rebuild_index(self):
+        with PublishLock(self.lock_path):
+            entries = []
+            start = 0
+            for end, note in self.records():
+                entries.append(INDEX_RECORD.pack(note.version, start, end - start, note.timestamp))
+                start = end
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'wb') as index_file:
+                index_file.write(b''.join(entries))
+            os.replace(temp_path, self.index_path)
+        return len(entries)
+
+    def text_files(self):
+        # Old style notes files still in the notes folder, as (version, path) in version order
+        if not os.path.isdir(self.notes_directory):
+            return []
+        found = []
+        for file_name in os.listdir(self.notes_directory):
+            version = text_note_version(file_name, self.base_name)
+            if version is not None:
+                found.append((version, os.path.join(self.notes_directory, file_name)))
+        return sorted(found)
+
+    def text_notes(self):
+        # Old style notes files as Notes in version order, timestamped with the file's mtime
+        for version, path in self.text_files():
+            with open(path, 'r', encoding='utf-8', errors='replace') as text_file:
+                text = text_file.read()
+            yield Note(version, os.path.getmtime(path), None, text)
+
+    def migrate(self, remove_text_files=False):
+        # Move old .txt notes into the log, returns how many were added
+        with PublishLock(self.lock_path):
+            return self._migrate_text_files(remove_text_files)
+
+    def _migrate_text_files(self, remove_text_files=False):
+        already = self.index()
+        count = 0
+        for version, path in self.text_files():
+            if version not in already:
+                with open(path, 'r', encoding='utf-8', errors='replace') as text_file:
+                    text = text_file.read()
+                self._append(version, text, author=None, timestamp=os.path.getmtime(path))
+                count += 1
+            if remove_text_files:
+                os.remove(path)
+        return count
+
+
+class NotesSearch(object):
+    def __init__(self, asset_directory, db_path=None):
+        self.asset_directory = asset_directory
+        self.db_path = db_path or os.path.join(asset_directory, NOTES_SEARCH_FILE_NAME)
+        self._lock = threading.RLock()
+        self._connection = None
+        self.full_text = True
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        try:
+            connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not open notes index {self.db_path} ({e}). Using an in-memory index.")
+            connection = sqlite3.connect(':memory:', check_same_thread=False)
+        connection.execute('CREATE TABLE IF NOT EXISTS indexed_logs (path TEXT PRIMARY KEY, size INTEGER NOT NULL)')
+        try:
+            connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS notes USING fts5('
+                               'project, creature, base_name, version UNINDEXED, timestamp UNINDEXED, text)')
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5, fall back to a plain table and LIKE matching
+            self.full_text = False
+            connection.execute('CREATE TABLE IF NOT EXISTS notes '
+                               '(project TEXT, creature TEXT, base_name TEXT, version INTEGER, timestamp REAL, text TEXT)')
+        connection.commit()
+        self._connection = connection
+        return connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def refresh(self, project_name, logs):
+        # Index whatever has been appended to each (creature, base name, NotesLog) since last time
+        with self._lock:
+            connection = self._connect()
+            for creature_name, base_name, notes_log in logs:
+                if not notes_log.exists():
+                    self._refresh_text_notes(connection, project_name, creature_name, base_name, notes_log)
+                    continue
+                size = notes_log.size()
+                row = connection.execute('SELECT size FROM indexed_logs WHERE path = ?', (notes_log.log_path,)).fetchone()
+                indexed_size = row[0] if row else 0
+                if size == indexed_size:
+                    continue
+                with connection:
+                    if size < indexed_size or row is None:
+                        # Log was replaced rather than appended to, or is new and took over the .txt notes
+                        # indexed before it, index it from scratch
+                        connection.execute('DELETE FROM notes WHERE project = ? AND creature = ? AND base_name = ?',
+                                           (project_name, creature_name, base_name))
+                        connection.execute('DELETE FROM indexed_logs WHERE path = ?', (text_notes_key(notes_log),))
+                        indexed_size = 0
+                    end = indexed_size
+                    for end, note in notes_log.records(indexed_size):
+                        connection.execute('INSERT INTO notes (project, creature, base_name, version, timestamp, text) '
+                                           'VALUES (?, ?, ?, ?, ?, ?)',
+                                           (project_name, creature_name, base_name, note.version, note.timestamp, note.text))
+                    connection.execute('INSERT OR REPLACE INTO indexed_logs (path, size) VALUES (?, ?)',
+                                       (notes_log.log_path, end))
+
+    def _refresh_text_notes(self, connection, project_name, creature_name, base_name, notes_log):
+        # An asset still on .txt notes, read them all again whenever the notes folder changes
+        key = text_notes_key(notes_log)
+        try:
+            signature = int(os.stat(notes_log.notes_directory).st_mtime * 1000)
+        except OSError:
+            return
+        row = connection.execute('SELECT size FROM indexed_logs WHERE path = ?', (key,)).fetchone()
+        if row and row[0] == signature:
+            return
+        with connection:
+            connection.execute('DELETE FROM notes WHERE project = ? AND creature = ? AND base_name = ?',
+                               (project_name, creature_name, base_name))
+            for note in notes_log.text_notes():
+                connection.execute('INSERT INTO notes (project, creature, base_name, version, timestamp, text) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   (project_name, creature_name, base_name, note.version, note.timestamp, note.text))
+            connection.execute('INSERT OR REPLACE INTO indexed_logs (path, size) VALUES (?, ?)', (key, signature))
+
+    def search(self, project_name, query, limit=50):
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        with self._lock:
+            connection = self._connect()
+            if self.full_text:
+                match = ' '.join(f'"{word}"*' for word in words)
+                rows = connection.execute(
+                    "SELECT creature, base_name, version, timestamp, snippet(notes, 5, '[', ']', '...', 12) "
+                    "FROM notes WHERE notes MATCH ? AND project = ? ORDER BY rank LIMIT ?",
+                    (match, project_name, limit)).fetchall()
+            else:
+                where = ' AND '.join('text LIKE ?' for _ in words)
+                rows = connection.execute(
+                    f"SELECT creature, base_name, version, timestamp, substr(text, 1, 120) FROM notes "
+                    f"WHERE project = ? AND {where} ORDER BY timestamp DESC LIMIT ?",
+                    [project_name] + [f'%{word}%' for word in words] + [limit]).fetchall()
+        return [SearchHit(creature, base_name, int(version), timestamp, snippet)
+                for creature, base_name, version, timestamp, snippet in rows]
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Migrate and search asset store notes.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="move old .txt notes into the notes logs")
+    migrate_parser.add_argument('--remove-text-files', action='store_true')
+    search_parser = subparsers.add_parser('search', help="search every note in a project")
+    search_parser.add_argument('project')
+    search_parser.add_argument('query')
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if arguments.asset_directory:
+        settings["asset_directory"] = arguments.asset_directory
+    store = AssetStore(settings)
+    if arguments.command == 'migrate':
+        count = store.migrate_notes(arguments.remove_text_files)
+        print(f"Migrated {count} notes")
+    else:
+        for hit in store.search_notes(arguments.project, arguments.query):
+            print(f"{hit.creature}/{hit.base_name} v{hit.version:04d}: {hit.snippet}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
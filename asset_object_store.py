@@ -0,0 +1,640 @@
+"""
+asset_object_store.py
+
+S3 style object store backend, and a local stand-in for it
+
+- ObjectStoreBackend talks to any S3 compatible endpoint (S3, MinIO, Ceph) over plain HTTP(S) with
+  path style addressing, requests are signed with AWS signature v4 when keys are set
+- connections are pooled and kept alive, a listing is one ListObjectsV2 call per 1000 entries with the
+  "/" delimiter so sub folders come back as prefixes instead of walking them
+- files bigger than a part go up as a multipart upload and come down as ranged GETs, the parts in
+  parallel over the pool, every PUT carries its MD5 so a part damaged on the way is refused
+- LocalObjectServer is a small threaded server speaking the same subset of the API with the objects kept as
+  files under a folder, for trying the store out without a bucket
+
+    python asset_object_store.py serve --root D:/objects --port 9000
+
+"""
+
+import argparse
+import base64
+import datetime
+import email.utils
+import hashlib
+import hmac
+import http.client
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+from asset_files import replace_file, temp_path_for
+from asset_storage import OBJECT_SCHEME, StorageBackend, StorageEntry, StorageError
+from asset_trace import span
+
+DEFAULT_PART_MB = 16
+DEFAULT_MAX_CONNECTIONS = 8
+DEFAULT_TIMEOUT = 60
+# A dropped keep-alive connection or a busy endpoint gets this many more tries
+REQUEST_RETRIES = 3
+RETRY_DELAY = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+LIST_PAGE_SIZE = 1000
+
+
+def _local_name(tag):
+    # S3 answers in its own XML namespace, MinIO and friends sometimes without one
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _text(element, name, default=None):
+    children = _children(element, name)
+    return children[0].text if children and children[0].text is not None else default
+
+
+def _timestamp(text):
+    # ListObjectsV2 has ISO 8601 times, HEAD has HTTP dates
+    if not text:
+        return 0
+    try:
+        return datetime.datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return email.utils.parsedate_to_datetime(text).timestamp()
+
+
+def _quote(text, safe='-_.~'):
+    return urllib.parse.quote(text, safe=safe)
+
+
+def sign_request(method, host, path, query, headers, access_key, secret_key, region, now=None,
+                 payload_hash='UNSIGNED-PAYLOAD'):
+    # AWS signature v4, unsigned payload unless its sha256 is given. Adds the date and Authorization headers
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = amz_date[:8]
+    headers['Host'] = host
+    headers['x-amz-date'] = amz_date
+    headers['x-amz-content-sha256'] = payload_hash
+    canonical_query = '&'.join(f"{_quote(key)}={_quote(value)}" for key, value in sorted(query.items()))
+    signed = {key.lower(): ' '.join(str(value).split()) for key, value in headers.items()}
+    signed_headers = ';'.join(sorted(signed))
+    canonical_headers = ''.join(f"{key}:{signed[key]}\n" for key in sorted(signed))
+    canonical_request = '\n'.join([method, _quote(path, '/-_.~'), canonical_query, canonical_headers, signed_headers,
+                                   payload_hash])
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+    key = ('AWS4' + secret_key).encode('utf-8')
+    for part in (date, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    return headers
+
+
+class ConnectionPool(object):
+    # Keep-alive connections to one endpoint, at most max_connections open at once
+    def __init__(self, endpoint, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT):
+        parsed = urllib.parse.urlsplit(endpoint)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError(f"Object store endpoint '{endpoint}' should look like http://host:port.")
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.netloc = parsed.netloc
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self):
+        # A connection that goes back in the pool afterwards, unless something went wrong on it
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ObjectStoreBackend(StorageBackend):
+    def __init__(self, endpoint, bucket, prefix='', access_key=None, secret_key=None, region='us-east-1',
+                 part_size=DEFAULT_PART_MB * 1024 * 1024, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 timeout=DEFAULT_TIMEOUT):
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.part_size = max(int(part_size), 5 * 1024 * 1024)
+        self.max_connections = max(1, int(max_connections))
+        self.pool = ConnectionPool(endpoint, self.max_connections, timeout)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, config):
+        for key in ('endpoint', 'bucket'):
+            if not config.get(key):
+                raise KeyError(f"Missing '{key}' in the storage settings.")
+        return cls(config['endpoint'], config['bucket'], config.get('prefix', ''),
+                   config.get('access_key') or os.environ.get('AWS_ACCESS_KEY_ID'),
+                   config.get('secret_key') or os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                   config.get('region', 'us-east-1'),
+                   int(float(config.get('part_size_mb', DEFAULT_PART_MB)) * 1024 * 1024),
+                   int(config.get('max_connections', DEFAULT_MAX_CONNECTIONS)),
+                   float(config.get('timeout', DEFAULT_TIMEOUT)))
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.pool.close()
+
+    def _parts_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_connections,
+                                                    thread_name_prefix='baal-objects')
+            return self._executor
+
+    # Paths, s3://bucket/prefix/relative/path
+
+    def url(self, relative_path):
+        # Where a file relative to the store lives in the bucket
+        key = '/'.join(part for part in (self.prefix, relative_path.replace('\\', '/').strip('/')) if part)
+        return f"{OBJECT_SCHEME}{self.bucket}/{key}"
+
+    def key(self, path):
+        bucket, _, key = path[len(OBJECT_SCHEME):].partition('/')
+        if bucket != self.bucket:
+            raise StorageError(f"{path} isn't in the {self.bucket} bucket.")
+        return key
+
+    def relative_path(self, path):
+        # The path below the prefix, the inverse of url()
+        key = self.key(path)
+        if self.prefix and key.startswith(self.prefix + '/'):
+            return key[len(self.prefix) + 1:]
+        return key
+
+    # Requests
+
+    def _request(self, method, key='', query=None, body=None, headers=None, ok=(200,)):
+        # (status, headers, body) of a request with the whole response read, 404s come back as they are
+        # so the caller can decide what missing means, other errors raise StorageError
+        query = query or {}
+        path = f"/{self.bucket}/{key}" if key else f"/{self.bucket}"
+        target = _quote(path, '/-_.~') + ('?' + urllib.parse.urlencode(query, quote_via=lambda value, *args: _quote(value))
+                                          if query else '')
+        for attempt in range(REQUEST_RETRIES + 1):
+            request_headers = dict(headers or {})
+            if body is not None:
+                request_headers['Content-Length'] = str(len(body))
+            if self.access_key and self.secret_key:
+                sign_request(method, self.pool.netloc, path, query, request_headers, self.access_key, self.secret_key,
+                             self.region)
+            try:
+                with self.pool.connection() as connection:
+                    connection.request(method, target, body=body, headers=request_headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                    status, response_headers = response.status, response.headers
+            except (http.client.HTTPException, ConnectionError, socket.timeout) as e:
+                if attempt == REQUEST_RETRIES:
+                    raise StorageError(f"{method} {path} on {self.endpoint} failed ({e}).")
+                time.sleep(RETRY_DELAY * attempt)
+                continue
+            if status in RETRY_STATUSES and attempt < REQUEST_RETRIES:
+                time.sleep(RETRY_DELAY * (attempt + 1))
+                continue
+            if status not in ok and status != 404:
+                message = _text(ElementTree.fromstring(data), 'Message', '') if data.startswith(b'<') else ''
+                raise StorageError(f"{method} {path} on {self.endpoint} returned {status} {message}".strip())
+            return status, response_headers, data
+
+    def list(self, directory, wanted=None):
+        prefix = self.key(directory).rstrip('/') + '/'
+        entries = []
+        query = {'list-type': '2', 'prefix': prefix, 'delimiter': '/', 'max-keys': str(LIST_PAGE_SIZE)}
+        with span('objects.list', path=directory) as current:
+            while True:
+                status, _, data = self._request('GET', query=query)
+                if status == 404:
+                    return []
+                result = ElementTree.fromstring(data)
+                for content in _children(result, 'Contents'):
+                    key = _text(content, 'Key', '')
+                    if key == prefix:
+                        continue
+                    entries.append(StorageEntry(key[len(prefix):], f"{OBJECT_SCHEME}{self.bucket}/{key}", False,
+                                                int(_text(content, 'Size', 0)), _timestamp(_text(content, 'LastModified'))))
+                for common_prefix in _children(result, 'CommonPrefixes'):
+                    key = _text(common_prefix, 'Prefix', '').rstrip('/')
+                    entries.append(StorageEntry(key[len(prefix):], f"{OBJECT_SCHEME}{self.bucket}/{key}", True, 0, 0))
+                token = _text(result, 'NextContinuationToken')
+                if _text(result, 'IsTruncated') != 'true' or not token:
+                    break
+                query['continuation-token'] = token
+            if wanted is not None:
+                entries = [entry for entry in entries if wanted(entry.name, entry.is_dir)]
+            current.set(entries=len(entries))
+        return entries
+
+    def stat(self, path):
+        key = self.key(path)
+        with span('objects.stat', path=path):
+            status, headers, _ = self._request('HEAD', key)
+        if status == 200:
+            return StorageEntry(key.rsplit('/', 1)[-1], path, False, int(headers.get('Content-Length', 0)),
+                                _timestamp(headers.get('Last-Modified')))
+        # No object, but objects below it make it a folder
+        status, _, data = self._request('GET', query={'list-type': '2', 'prefix': key.rstrip('/') + '/', 'max-keys': '1'})
+        if status == 200 and _children(ElementTree.fromstring(data), 'Contents'):
+            return StorageEntry(key.rstrip('/').rsplit('/', 1)[-1], path, True, 0, 0)
+        return None
+
+    def read(self, path, start=0, length=None):
+        headers = {}
+        if start or length is not None:
+            headers['Range'] = f"bytes={start}-" + (str(start + length - 1) if length is not None else '')
+        with span('objects.get', path=path) as current:
+            status, _, data = self._request('GET', self.key(path), headers=headers, ok=(200, 206))
+            current.set(bytes=len(data))
+        if status == 404:
+            raise FileNotFoundError(f"{path} isn't in the object store.")
+        return data
+
+    def remove(self, path):
+        self._request('DELETE', self.key(path), ok=(200, 204))
+
+    # Transfers
+
+    def download(self, path, local_path):
+        entry = self.stat(path)
+        if entry is None or entry.is_dir:
+            raise FileNotFoundError(f"{path} isn't in the object store.")
+        directory = os.path.dirname(local_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        temp_path = temp_path_for(local_path)
+        try:
+            with span('objects.download', path=path, bytes=entry.size):
+                with open(temp_path, 'wb') as temp_file:
+                    temp_file.truncate(entry.size)
+                ranges = [(start, min(self.part_size, entry.size - start)) for start in range(0, entry.size, self.part_size)]
+                if len(ranges) > 1:
+                    list(self._parts_executor().map(lambda part: self._download_part(path, temp_path, *part), ranges))
+                elif ranges:
+                    self._download_part(path, temp_path, *ranges[0])
+            replace_file(temp_path, local_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _download_part(self, path, temp_path, start, length):
+        data = self.read(path, start, length)
+        if len(data) != length:
+            raise StorageError(f"Got {len(data)} of {length} bytes from {path} at {start}.")
+        with open(temp_path, 'r+b') as temp_file:
+            temp_file.seek(start)
+            temp_file.write(data)
+
+    def upload(self, local_path, path):
+        key = self.key(path)
+        size = os.path.getsize(local_path)
+        with span('objects.upload', path=path, bytes=size):
+            if size <= self.part_size:
+                with open(local_path, 'rb') as source:
+                    self._put(key, source.read())
+                return
+            self._multipart_upload(local_path, key, size)
+
+    def _put(self, key, data, query=None):
+        # PUT an object or a part, returns its ETag. Content-MD5 has the store refuse anything damaged on the way
+        content_md5 = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+        with span('objects.put', path=key, bytes=len(data)):
+            _, headers, _ = self._request('PUT', key, query=query, body=data, headers={'Content-MD5': content_md5})
+        return (headers.get('ETag') or '').strip('"')
+
+    def _multipart_upload(self, local_path, key, size):
+        _, _, data = self._request('POST', key, query={'uploads': ''})
+        upload_id = _text(ElementTree.fromstring(data), 'UploadId')
+        if not upload_id:
+            raise StorageError(f"The object store didn't start a multipart upload for {key}.")
+
+        def upload_part(part):
+            number, start = part
+            with open(local_path, 'rb') as source:
+                source.seek(start)
+                chunk = source.read(min(self.part_size, size - start))
+            return number, self._put(key, chunk, {'partNumber': str(number), 'uploadId': upload_id})
+
+        try:
+            parts = list(self._parts_executor().map(
+                upload_part, [(index + 1, start) for index, start in enumerate(range(0, size, self.part_size))]))
+            body = ''.join(f"<Part><PartNumber>{number}</PartNumber><ETag>\"{etag}\"</ETag></Part>"
+                           for number, etag in parts)
+            body = f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode('utf-8')
+            _, _, data = self._request('POST', key, query={'uploadId': upload_id}, body=body)
+            # S3 can report a failed complete inside a 200
+            if _local_name(ElementTree.fromstring(data).tag) == 'Error':
+                raise StorageError(f"Completing the upload of {key} failed ({data.decode('utf-8', 'replace')}).")
+        except BaseException:
+            try:
+                self._request('DELETE', key, query={'uploadId': upload_id}, ok=(200, 204))
+            except StorageError as e:
+                print(f"Warning: Could not abort the upload of {key} ({e}).")
+            raise
+
+
+# Local stand-in
+
+class _ObjectRequestHandler(BaseHTTPRequestHandler):
+    # Path style requests, /bucket/key, the objects are files under the server's root
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        bucket, _, key = urllib.parse.unquote(parsed.path).lstrip('/').partition('/')
+        query = {name: values[0] for name, values in urllib.parse.parse_qs(parsed.query, keep_blank_values=True).items()}
+        if not bucket or '..' in key.split('/') or '..' == bucket:
+            self._send(400, self._error('InvalidRequest', 'Bad bucket or key'))
+            return None
+        return bucket, key, query
+
+    def _object_path(self, bucket, key):
+        return os.path.join(self.server.root, bucket, *key.split('/'))
+
+    def _upload_directory(self, upload_id):
+        return os.path.join(self.server.root, '.uploads', os.path.basename(upload_id))
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, code, message):
+        return f"<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>".encode('utf-8')
+
+    def _object_headers(self, object_path):
+        stat = os.stat(object_path)
+        return {'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True), 'Accept-Ranges': 'bytes'}
+
+    def _write_object(self, object_path, data):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = temp_path_for(object_path)
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, object_path)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parsed = self._parse()
+        if parsed is None:
+            return
+        bucket, key, query = parsed
+        if not key:
+            return self._list(bucket, query)
+        object_path = self._object_path(bucket, key)
+        if not os.path.isfile(object_path):
+            return self._send(404, self._error('NoSuchKey', key))
+        headers = self._object_headers(object_path)
+        size = os.path.getsize(object_path)
+        start, end = 0, size - 1
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[len('bytes='):].partition('-')
+            start, end = int(first or 0), min(int(last), size - 1) if last else size - 1
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        with open(object_path, 'rb') as object_file:
+            object_file.seek(start)
+            data = object_file.read(max(0, end - start + 1)) if self.command == 'GET' else b''
+        if self.command == 'HEAD':
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            return
+        self._send(206 if 'Content-Range' in headers else 200, data, headers)
+
+    def _list(self, bucket, query):
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter', '')
+        max_keys = int(query.get('max-keys') or LIST_PAGE_SIZE)
+        after = query.get('continuation-token') or query.get('start-after') or ''
+        bucket_directory = os.path.join(self.server.root, bucket)
+        keys = []
+        for directory, _, file_names in os.walk(bucket_directory):
+            for file_name in file_names:
+                # Half written objects, see _write_object
+                if file_name.startswith('.') and '.tmp' in file_name:
+                    continue
+                key = os.path.relpath(os.path.join(directory, file_name), bucket_directory).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        # Keys and common prefixes share one sorted listing, a page holds max_keys of either
+        listing = {}
+        for key in sorted(keys):
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest.split(delimiter, 1)[0] + delimiter
+                listing.setdefault(common, None)
+            else:
+                listing[key] = key
+        names = [name for name in sorted(listing) if name > after]
+        page, truncated = names[:max_keys], len(names) > max_keys
+        contents, prefixes = [], []
+        for name in page:
+            if listing[name] is None:
+                prefixes.append(f"<CommonPrefixes><Prefix>{escape(name)}</Prefix></CommonPrefixes>")
+                continue
+            stat = os.stat(self._object_path(bucket, name))
+            modified = datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            contents.append(f"<Contents><Key>{escape(name)}</Key><LastModified>{modified}</LastModified>"
+                            f"<Size>{stat.st_size}</Size></Contents>")
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ''
+        body = (f"<ListBucketResult><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+                f"<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>"
+                f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}"
+                f"{''.join(contents)}{''.join(prefixes)}</ListBucketResult>")
+        self._send(200, body.encode('utf-8'), {'Content-Type': 'application/xml'})
+
+    def do_PUT(self):
+        parsed = self._parse()
+        if parsed is None:
+            return
+        bucket, key, query = parsed
+        data = self._body()
+        content_md5 = self.headers.get('Content-MD5')
+        if content_md5 and base64.b64decode(content_md5) != hashlib.md5(data).digest():
+            return self._send(400, self._error('BadDigest', 'Content-MD5 does not match the body'))
+        if 'uploadId' in query:
+            upload_directory = self._upload_directory(query['uploadId'])
+            if not os.path.isdir(upload_directory):
+                return self._send(404, self._error('NoSuchUpload', query['uploadId']))
+            self._write_object(os.path.join(upload_directory, f"{int(query['partNumber']):05d}"), data)
+        else:
+            self._write_object(self._object_path(bucket, key), data)
+        self._send(200, headers={'ETag': f"\"{hashlib.md5(data).hexdigest()}\""})
+
+    def do_POST(self):
+        parsed = self._parse()
+        if parsed is None:
+            return
+        bucket, key, query = parsed
+        body = self._body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(self._upload_directory(upload_id))
+            result = (f"<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                      f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+            return self._send(200, result.encode('utf-8'), {'Content-Type': 'application/xml'})
+        if 'uploadId' not in query:
+            return self._send(400, self._error('InvalidRequest', 'Expected uploads or uploadId'))
+        upload_directory = self._upload_directory(query['uploadId'])
+        if not os.path.isdir(upload_directory):
+            return self._send(404, self._error('NoSuchUpload', query['uploadId']))
+        object_path = self._object_path(bucket, key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = temp_path_for(object_path)
+        digests = []
+        with open(temp_path, 'wb') as temp_file:
+            for part in _children(ElementTree.fromstring(body), 'Part'):
+                part_path = os.path.join(upload_directory, f"{int(_text(part, 'PartNumber')):05d}")
+                if not os.path.isfile(part_path):
+                    temp_file.close()
+                    os.remove(temp_path)
+                    return self._send(400, self._error('InvalidPart', _text(part, 'PartNumber')))
+                with open(part_path, 'rb') as part_file:
+                    data = part_file.read()
+                digests.append(hashlib.md5(data).digest())
+                temp_file.write(data)
+        os.replace(temp_path, object_path)
+        shutil.rmtree(upload_directory, ignore_errors=True)
+        etag = f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+        result = (f"<CompleteMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                  f"<ETag>\"{etag}\"</ETag></CompleteMultipartUploadResult>")
+        self._send(200, result.encode('utf-8'), {'Content-Type': 'application/xml'})
+
+    def do_DELETE(self):
+        parsed = self._parse()
+        if parsed is None:
+            return
+        bucket, key, query = parsed
+        if 'uploadId' in query:
+            shutil.rmtree(self._upload_directory(query['uploadId']), ignore_errors=True)
+        else:
+            object_path = self._object_path(bucket, key)
+            if os.path.isfile(object_path):
+                os.remove(object_path)
+        self._send(204)
+
+
+class LocalObjectServer(object):
+    # A stand-in S3 endpoint on a folder, no auth and no bucket policies, buckets appear on first PUT.
+    # with LocalObjectServer(folder) as server: ObjectStoreBackend(server.endpoint, 'baal')
+    def __init__(self, root, host='127.0.0.1', port=0):
+        self.root = root
+        os.makedirs(os.path.join(root, '.uploads'), exist_ok=True)
+        self.server = ThreadingHTTPServer((host, port), _ObjectRequestHandler)
+        self.server.daemon_threads = True
+        self.server.root = root
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='baal-object-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for an S3 object store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help="serve a folder as an object store until interrupted")
+    serve_parser.add_argument('--root', required=True, help="folder the buckets and objects are kept in")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=9000)
+    arguments = parser.parse_args(arguments)
+
+    server = LocalObjectServer(arguments.root, arguments.host, arguments.port)
+    print(f"Serving {arguments.root} at {server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,505 @@
+"""
+asset_publish_queue.py
+
+Publishing without waiting on the share
+
+- with "publish_mode": "queued" a publish saves the scene to a local staging folder and returns, maya is only
+  held up for as long as a local save takes
+- an upload queue then takes a few assets at a time, the publishes of one asset go one after another in the
+  order they were staged so their version numbers follow that order. The version and the master are copied to the share,
+  checked against the staged scene's checksum and committed. The version file is renamed into place, the note
+  appended and the manifest records the version and swaps the master in under the publish lock, so the
+  version only shows up in the versions list once everything for it is on the share
+- each queued publish is a folder in the staging directory with a job.json recording how far it got, a maya
+  that crashes or closes mid upload carries on from there the next time the queue starts, partial copies
+  continue from where they stopped instead of starting over
+- the session uploading a publish holds a claim on it, so two mayas sharing a staging directory never upload
+  the same one
+
+    "publish_mode": "queued", "staging_directory": "D:/baal_staging", "upload_workers": 2
+
+    python asset_publish_queue.py status
+    python asset_publish_queue.py resume
+
+"""
+
+import argparse
+import getpass
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+
+from asset_files import atomic_copy, file_checksum, replace_file, temp_path_for
+from asset_manifest import AssetManifest, PublishLockError, version_file_name
+from asset_notes import NOTES_LOG_FILE_NAME
+from asset_storage import StorageError
+from asset_thumbnails import capture_thumbnail, thumbnail_path
+from asset_trace import span
+
+JOB_FILE_NAME = 'job.json'
+CLAIM_FILE_NAME = '.claim'
+DEFAULT_UPLOAD_WORKERS = 2
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+# A claim is refreshed on a timer for as long as its upload runs, one this old belongs to a session that's gone
+CLAIM_STALE_AFTER = 120.0
+CLAIM_HEARTBEAT = 20.0
+UPLOAD_RETRIES = 3
+RETRY_DELAY = 5.0
+
+# 'staged' waiting to upload, 'uploading', 'committed' once it's in the manifest, 'failed' after the last retry
+QueueStatus = namedtuple('QueueStatus', ['job_id', 'project', 'creature', 'base_name', 'version', 'state',
+                                         'done_bytes', 'total_bytes', 'error'])
+
+
+class UploadStopped(Exception):
+    # The queue was closed mid copy, the publish stays staged and is picked up again next time
+    pass
+
+
+def default_staging_directory(settings):
+    return settings.get("staging_directory") or os.path.join(tempfile.gettempdir(), 'baal_staging')
+
+
+def read_job(job_directory):
+    try:
+        with open(os.path.join(job_directory, JOB_FILE_NAME), 'r') as job_file:
+            return json.load(job_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_job(job_directory, job):
+    job_path = os.path.join(job_directory, JOB_FILE_NAME)
+    temp_path = temp_path_for(job_path)
+    with open(temp_path, 'w') as job_file:
+        json.dump(job, job_file, indent=1)
+    replace_file(temp_path, job_path)
+
+
+def stage_publish(cmds, staging_directory, project_name, creature_name, base_name, notes, save_as_binary,
+                  capture_thumbnails=True):
+    # Save the open scene into a new job folder under staging_directory, returns the folder.
+    # Nothing on the share is touched, the version number is handed out when it's uploaded
+    job_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    job_directory = os.path.join(staging_directory, job_id)
+    os.makedirs(job_directory)
+    file_extension = ".mb" if save_as_binary else ".ma"
+    file_type = 'mayaBinary' if save_as_binary else 'mayaAscii'
+    scene_name = f"{base_name}{file_extension}"
+    scene_path = os.path.join(job_directory, scene_name)
+
+    has_thumbnail = bool(capture_thumbnails and capture_thumbnail(cmds, thumbnail_path(scene_path)))
+    cmds.file(rename=scene_path)
+    cmds.file(save=True, type=file_type)
+    write_job(job_directory, {
+        'id': job_id,
+        'project': project_name,
+        'creature': creature_name,
+        'base_name': base_name,
+        'notes': notes,
+        'scene': scene_name,
+        'format': file_type,
+        'extension': file_extension,
+        'thumbnail': has_thumbnail,
+        'author': getpass.getuser(),
+        'staged': time.time(),
+        'state': 'staged',
+    })
+    return job_directory
+
+
+def resumable_copy(source_path, destination_path, progress=None, stop=None):
+    # Copy source_path to destination_path carrying on from whatever is already there, for a copy a crash
+    # or a closed maya cut short. progress(bytes) is called per chunk, stop() ends the copy early
+    size = os.path.getsize(source_path)
+    done = os.path.getsize(destination_path) if os.path.exists(destination_path) else 0
+    if done > size:
+        os.remove(destination_path)
+        done = 0
+    if progress and done:
+        progress(done)
+    with span('fs.copy', path=destination_path, bytes=size - done):
+        with open(source_path, 'rb') as source, open(destination_path, 'ab') as destination:
+            source.seek(done)
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                if stop and stop():
+                    raise UploadStopped(destination_path)
+                destination.write(chunk)
+                if progress:
+                    progress(len(chunk))
+
+
+def verify_copy(path, checksum):
+    if file_checksum(path) != checksum:
+        os.remove(path)
+        raise ValueError(f"{path} doesn't match the staged scene, it will be copied again.")
+
+
+def upload_path_for(destination_path, job_id):
+    # The same hidden name every time for a job, which is what lets an interrupted copy carry on
+    directory, file_name = os.path.split(destination_path)
+    return os.path.join(directory, f".{file_name}.{job_id}.upload")
+
+
+def upload_job(store, job_directory, job, progress=None, stop=None):
+    # Copy a staged publish to the share and commit it. Each step is recorded in job.json as it finishes
+    # so running this again after any failure or crash picks up from the first step that didn't
+    job_id = job['id']
+    project_name, creature_name, base_name = job['project'], job['creature'], job['base_name']
+    staged_path = os.path.join(job_directory, job['scene'])
+    if job.get('checksum') is None:
+        job['checksum'] = file_checksum(staged_path)
+        job['size'] = os.path.getsize(staged_path)
+        write_job(job_directory, job)
+    elif file_checksum(staged_path) != job['checksum']:
+        raise ValueError(f"The staged scene {staged_path} changed since it was saved.")
+    checksum, size = job['checksum'], job['size']
+
+    versions_directory = store.versions_directory(project_name, creature_name, base_name)
+    manifest = AssetManifest(versions_directory, base_name)
+    if job.get('version') is None:
+        with span('manifest.allocate', path=manifest.path):
+            job['version'] = manifest.allocate_version()
+        write_job(job_directory, job)
+    version = job['version']
+    file_name = version_file_name(base_name, version, job['extension'])
+    version_path = os.path.join(versions_directory, file_name)
+
+    # The version into whichever storage the store keeps versions in, only a copy to the share reports progress
+    # as it goes
+    if 'stored' in job:
+        if progress:
+            progress(size)
+    else:
+        extra = None
+        if store.version_storage == "objects":
+            object_path = store.object_path(version_path)
+            store.storage.upload(staged_path, object_path)
+            extra = {'object': object_path}
+        elif store.version_storage == "blobs":
+            blob_checksum, blob_path, is_new = store.blobs.ingest(staged_path, remove_source=False)
+            if blob_checksum != checksum:
+                raise ValueError(f"The blob stored for {file_name} doesn't match the staged scene.")
+            extra = {'blob': blob_checksum, 'link': store.blobs.expose(blob_checksum, version_path)}
+        else:
+            upload_path = upload_path_for(version_path, job_id)
+            resumable_copy(staged_path, upload_path, progress, stop)
+            verify_copy(upload_path, checksum)
+            replace_file(upload_path, version_path)
+        job['stored'] = extra
+        write_job(job_directory, job)
+        if store.version_storage != "files" and progress:
+            progress(size)
+
+    # The master waits under a hidden name for the commit to swap it in
+    creature_directory = store.creature_directory(project_name, creature_name)
+    master_file_path = os.path.join(creature_directory, f"{base_name}_master{job['extension']}")
+    temp_master_path = upload_path_for(master_file_path, job_id)
+    resumable_copy(staged_path, temp_master_path, progress, stop)
+    verify_copy(temp_master_path, checksum)
+
+    version_thumbnail_path = None
+    if job.get('thumbnail'):
+        version_thumbnail_path = thumbnail_path(version_path)
+        atomic_copy(thumbnail_path(staged_path), version_thumbnail_path, 'copy')
+
+    # Once only, a resumed upload mustn't add the note twice
+    notes_log = store.notes_log(project_name, creature_name, base_name)
+    if not job.get('notes_written'):
+        notes_log.append(version, job['notes'], author=job.get('author'))
+        job['notes_written'] = True
+        write_job(job_directory, job)
+
+    with span('manifest.commit', path=manifest.path):
+        is_latest = manifest.commit_version(
+            version, file_name, job['format'], checksum, size, NOTES_LOG_FILE_NAME,
+            promote=lambda: store.swap_master(temp_master_path, master_file_path, version_thumbnail_path),
+            extra=job['stored'])
+    if not is_latest:
+        os.remove(temp_master_path)
+        print(f"Warning: A newer version of {base_name} was published meanwhile, {master_file_path} left as it was.")
+
+    job['state'] = 'committed'
+    write_job(job_directory, job)
+    store.catalog.invalidate(project_name, creature_name)
+    store.catalog.invalidate(project_name, creature_name, f"{base_name}_versions")
+    store.catalog.invalidate(project_name, creature_name, f"{base_name}_notes")
+    print(f"Published {file_name} from the upload queue")
+    return version
+
+
+class PublishQueue(object):
+    # Uploads staged publishes in the background, at most workers at a time. Each asset has one chain of
+    # publishes uploaded in the order they were staged, the version number is handed out at upload so two
+    # publishes of an asset uploading side by side could otherwise be numbered the wrong way round
+    def __init__(self, store, staging_directory, workers=DEFAULT_UPLOAD_WORKERS):
+        self.store = store
+        self.staging_directory = staging_directory
+        self.owner = f"{getpass.getuser()}@{socket.gethostname()} pid {os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='baal-upload')
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._statuses = {}
+        self._finished = []
+        self._futures = []
+        # (project, creature, base name) -> job folders waiting behind the one uploading, only there while
+        # a worker is going through them
+        self._chains = {}
+
+    def submit(self, job_directory):
+        job = read_job(job_directory)
+        if job is None:
+            return None
+        key = (job['project'], job['creature'], job['base_name'])
+        with self._lock:
+            if job['id'] in self._statuses and self._statuses[job['id']].state in ('staged', 'uploading'):
+                return job['id']
+            self._statuses[job['id']] = self._status(job_directory, job, 'staged')
+            if key in self._chains:
+                self._chains[key].append(job_directory)
+            else:
+                self._chains[key] = deque([job_directory])
+                self._futures.append(self._executor.submit(self._run_chain, key))
+        return job['id']
+
+    def resume(self):
+        # Queue every publish left in the staging directory by a crash or a closed maya, returns how many
+        count = 0
+        try:
+            names = os.listdir(self.staging_directory)
+        except OSError:
+            return 0
+        jobs = []
+        for name in names:
+            job_directory = os.path.join(self.staging_directory, name)
+            job = read_job(job_directory)
+            if job is None:
+                continue
+            if job['state'] == 'committed':
+                shutil.rmtree(job_directory, ignore_errors=True)
+                continue
+            jobs.append((job.get('staged', 0), name, job_directory))
+        # Oldest first, each asset's chain has to be in the order its publishes were staged
+        for staged, name, job_directory in sorted(jobs):
+            if self.submit(job_directory):
+                count += 1
+        return count
+
+    def status(self):
+        # QueueStatus of everything this session has queued that hasn't finished
+        with self._lock:
+            return [status for status in self._statuses.values() if status.state in ('staged', 'uploading')]
+
+    def take_finished(self):
+        # QueueStatus of the publishes that committed or failed since the last call
+        with self._lock:
+            finished, self._finished = self._finished, []
+        return finished
+
+    def pending(self):
+        return len(self.status())
+
+    def wait(self, timeout=None):
+        # Block until everything queued so far is done, False if timeout ran out first
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                futures = [future for future in self._futures if not future.done()]
+                self._futures = futures
+            if not futures:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            wait_for_futures(futures, remaining)
+
+    def close(self, wait=False):
+        # Without wait uploads stop at the next chunk and are picked up again by the next resume()
+        if not wait:
+            self._stopping.set()
+        self._executor.shutdown(wait=True)
+
+    # Worker side
+
+    def _status(self, job_directory, job, state):
+        # The version and the master are each a copy of the staged scene
+        try:
+            total_bytes = os.path.getsize(os.path.join(job_directory, job['scene'])) * 2
+        except OSError:
+            total_bytes = 0
+        return QueueStatus(job['id'], job['project'], job['creature'], job['base_name'], job.get('version'), state,
+                           0, total_bytes, job.get('error'))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._statuses[job_id] = self._statuses[job_id]._replace(**fields)
+            return self._statuses[job_id]
+
+    def _run_chain(self, key):
+        while True:
+            with self._lock:
+                if not self._chains[key]:
+                    del self._chains[key]
+                    return
+                job_directory = self._chains[key].popleft()
+            if not self._run(job_directory):
+                self._hold_back(key)
+                return
+
+    def _hold_back(self, key):
+        # A publish of this asset didn't commit, the ones staged after it wait for the next resume rather than
+        # taking version numbers ahead of it
+        with self._lock:
+            waiting = self._chains.pop(key)
+            for job_directory in waiting:
+                job_id = os.path.basename(job_directory)
+                if job_id not in self._statuses:
+                    continue
+                if self._stopping.is_set():
+                    self._statuses.pop(job_id)
+                    continue
+                self._statuses[job_id] = self._statuses[job_id]._replace(
+                    state='failed', error=f"held back until the earlier publish of {key[2]} uploads, it stays staged")
+                self._finished.append(self._statuses[job_id])
+
+    def _run(self, job_directory):
+        # True once the publish is committed
+        job = read_job(job_directory)
+        if job is None:
+            return False
+        # Closed before this one started or another session has it, it's still staged for next time
+        if self._stopping.is_set() or not self._claim(job_directory):
+            with self._lock:
+                self._statuses.pop(job['id'], None)
+            return False
+        # Object and blob uploads don't report progress while they run, the claim is kept fresh on a timer
+        # for the whole job instead so a long transfer never looks abandoned to another session
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_directory, finished),
+                                     name='baal-upload-claim', daemon=True)
+        heartbeat.start()
+        try:
+            return self._upload(job_directory, job)
+        finally:
+            finished.set()
+            heartbeat.join()
+            self._release(job_directory)
+
+    def _upload(self, job_directory, job):
+        job_id = job['id']
+        for attempt in range(UPLOAD_RETRIES + 1):
+            done = [0]
+
+            def progress(count):
+                done[0] += count
+                self._update(job_id, done_bytes=done[0])
+
+            self._update(job_id, state='uploading', version=job.get('version'), done_bytes=0)
+            try:
+                version = upload_job(self.store, job_directory, job, progress, self._stopping.is_set)
+            except UploadStopped:
+                self._update(job_id, state='staged')
+                return False
+            except (OSError, ValueError, StorageError, PublishLockError) as e:
+                job = read_job(job_directory) or job
+                if attempt < UPLOAD_RETRIES and not self._stopping.is_set():
+                    print(f"Warning: Uploading {job['base_name']} failed ({e}), trying again.")
+                    self._stopping.wait(RETRY_DELAY * (attempt + 1))
+                    continue
+                job['state'] = 'failed'
+                job['error'] = str(e)
+                write_job(job_directory, job)
+                status = self._update(job_id, state='failed', error=str(e))
+                print(f"Warning: Could not publish {job['base_name']} ({e}), it stays staged in {job_directory}.")
+                with self._lock:
+                    self._finished.append(status)
+                return False
+            status = self._update(job_id, state='committed', version=version)
+            shutil.rmtree(job_directory, ignore_errors=True)
+            with self._lock:
+                self._finished.append(status)
+            return True
+
+    def _claim(self, job_directory):
+        claim_path = os.path.join(job_directory, CLAIM_FILE_NAME)
+        try:
+            if time.time() - os.path.getmtime(claim_path) > CLAIM_STALE_AFTER:
+                os.remove(claim_path)
+        except OSError:
+            pass
+        try:
+            file_descriptor = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(file_descriptor, 'w') as claim_file:
+            claim_file.write(self.owner)
+        return True
+
+    def _heartbeat(self, job_directory, finished):
+        while not finished.wait(CLAIM_HEARTBEAT):
+            self._touch_claim(job_directory)
+
+    def _touch_claim(self, job_directory):
+        try:
+            os.utime(os.path.join(job_directory, CLAIM_FILE_NAME))
+        except OSError:
+            pass
+
+    def _release(self, job_directory):
+        try:
+            os.remove(os.path.join(job_directory, CLAIM_FILE_NAME))
+        except OSError:
+            pass
+
+
+def describe_status(status):
+    version = f" v{status.version:04d}" if status.version else ''
+    percent = f" {100 * status.done_bytes // status.total_bytes}%" if status.total_bytes else ''
+    error = f" ({status.error})" if status.error else ''
+    return f"{status.project}/{status.creature}/{status.base_name}{version} {status.state}{percent}{error}"
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Look at or finish the publishes waiting in the staging directory.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help="list the staged publishes and how far each got")
+    subparsers.add_parser('resume', help="upload every staged publish and wait for them to finish")
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    parser.add_argument('--staging-directory', help="defaults to staging_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if arguments.asset_directory:
+        settings["asset_directory"] = arguments.asset_directory
+    if arguments.staging_directory:
+        settings["staging_directory"] = arguments.staging_directory
+    store = AssetStore(settings)
+    staging_directory = default_staging_directory(settings)
+    if arguments.command == 'status':
+        names = sorted(os.listdir(staging_directory)) if os.path.isdir(staging_directory) else []
+        jobs = [job for job in (read_job(os.path.join(staging_directory, name)) for name in names) if job]
+        for job in jobs:
+            version = f" v{job['version']:04d}" if job.get('version') else ''
+            error = f" ({job['error']})" if job.get('error') else ''
+            print(f"{job['id']}  {job['project']}/{job['creature']}/{job['base_name']}{version} {job['state']}{error}")
+        print(f"{len(jobs)} staged publishes in {staging_directory}")
+    else:
+        queue = store.publish_queue()
+        print(f"Resuming {queue.resume()} staged publishes from {staging_directory}")
+        queue.wait()
+        for status in queue.take_finished():
+            print(describe_status(status))
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,328 @@
+"""
+asset_references.py
+
+Reference graph across the asset store, current and archive folders
+
+- .ma files are streamed up to the first createNode for their "file -r" lines, .mb files have the FREF
+  chunks of their HEAD group read through mmap, no scene is ever opened in maya
+- the graph lives in a small SQLite database next to the catalog, each scene is only read again when
+  its size or mtime changes so keeping it up to date after a publish is a stat per file in the folder
+- answers "what does this file reference" and "what references this file", including everything further
+  up the chain, so you can see what a publish of heromodel_master will reach before you do it
+
+    python asset_references.py update [--asset-directory PATH]
+    python asset_references.py uses PATH
+    python asset_references.py used-by PATH [--all]
+
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import struct
+import threading
+from collections import namedtuple
+
+from asset_metadata import head_chunks, ma_statements, read_header, statement_tokens
+
+REFERENCES_FILE_NAME = '.baal_references.sqlite'
+SCENE_EXTENSIONS = ('.ma', '.mb', '.ma.gz', '.mb.gz')
+UPDATE_BATCH_SIZE = 200
+
+# source and target are full paths, target is where the reference resolved to even if nothing is there now
+Reference = namedtuple('Reference', ['source', 'target', 'namespace', 'exists'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    target_path TEXT NOT NULL,
+    namespace TEXT
+);
+CREATE INDEX IF NOT EXISTS refs_source ON refs (source);
+CREATE INDEX IF NOT EXISTS refs_target ON refs (target);
+"""
+
+# file command flags that take a value, so their value is never mistaken for the path
+FILE_FLAGS_WITH_VALUE = {'-rdi', '-referenceDepthInfo', '-ns', '-namespace', '-rfn', '-referenceNode', '-typ', '-type',
+                         '-op', '-options', '-dr', '-deferReference', '-rpr', '-renamingPrefix', '-shd', '-sharedNodes',
+                         '-gr', '-groupReference', '-gn', '-groupName'}
+COPY_NUMBER = re.compile(r'\{\d+\}$')
+
+
+def path_key(path):
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+
+def is_scene_file(file_name):
+    return file_name.lower().endswith(SCENE_EXTENSIONS)
+
+
+def file_reference(tokens, flagged=True):
+    # (path, namespace) of a "file" statement that references a scene into this one, None for anything else.
+    # Nested references show up again with -rdi 2 and deeper, those belong to the file they're nested in
+    if not tokens or tokens[0] != 'file':
+        return None
+    flags = {}
+    for index, token in enumerate(tokens[1:-1], 1):
+        if token.startswith('-'):
+            flags[token] = tokens[index + 1] if token in FILE_FLAGS_WITH_VALUE else True
+    depth = flags.get('-rdi', flags.get('-referenceDepthInfo'))
+    if flagged and not ('-r' in flags or '-reference' in flags or depth == '1'):
+        return None
+    if depth not in (None, '1'):
+        return None
+    path = tokens[-1]
+    if not path or path.startswith('-'):
+        return None
+    return path, flags.get('-ns', flags.get('-namespace'))
+
+
+def read_ma_references(lines):
+    found = []
+    for statement in ma_statements(lines):
+        if statement.startswith('file '):
+            reference = file_reference(statement_tokens(statement))
+            if reference:
+                found.append(reference)
+    return found
+
+
+def read_mb_references(buffer):
+    # FREF chunks hold the arguments of the file command maya would write to a .ma as plain strings
+    found = []
+    for chunk_tag, values in head_chunks(buffer):
+        if chunk_tag == b'FREF':
+            reference = file_reference(['file'] + [value for value in values if value], flagged=False)
+            if reference:
+                found.append(reference)
+    return found
+
+
+def resolve_reference(raw_path, source_path, roots=()):
+    # Where a reference points on this machine. Relative paths are tried against each root the way maya
+    # tries the workspace, then the referencing file's folder, the first that exists wins
+    path = os.path.expanduser(os.path.expandvars(COPY_NUMBER.sub('', raw_path.strip())))
+    if os.path.isabs(path) or re.match(r'^[A-Za-z]:[\\/]', path):
+        candidates = [path]
+    else:
+        candidates = [os.path.join(root, path) for root in roots if root] + [os.path.join(os.path.dirname(source_path), path)]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return os.path.normpath(candidate)
+    return os.path.normpath(candidates[0])
+
+
+def read_references(path, roots=()):
+    # (target path, namespace) for each scene path references directly, in file order without repeats
+    found = read_header(path, read_ma_references, read_mb_references)
+    references = []
+    seen = set()
+    for raw_path, namespace in found:
+        target = resolve_reference(raw_path, path, roots)
+        if path_key(target) not in seen:
+            seen.add(path_key(target))
+            references.append((target, namespace))
+    return references
+
+
+def scene_files(directory, recursive=True):
+    # (path, stat) of every maya scene under directory, hidden folders like the blob store are skipped
+    try:
+        iterator = os.scandir(directory)
+    except OSError:
+        return
+    with iterator:
+        folders = []
+        for entry in iterator:
+            try:
+                if entry.is_dir():
+                    if recursive and not entry.name.startswith('.'):
+                        folders.append(entry.path)
+                elif is_scene_file(entry.name):
+                    yield entry.path, entry.stat()
+            except OSError:
+                continue
+    for folder in folders:
+        yield from scene_files(folder, recursive)
+
+
+def describe_references(uses, used_by, affected=(), limit=8):
+    # A few lines for the details pane, file names only with the rest counted
+    def names(paths):
+        shown = ', '.join(os.path.basename(path) for path in paths[:limit])
+        return shown + (f" and {len(paths) - limit} more" if len(paths) > limit else '')
+
+    lines = []
+    if uses:
+        missing = [reference.target for reference in uses if not reference.exists]
+        lines.append(f"Uses: {names([reference.target for reference in uses])}")
+        if missing:
+            lines.append(f"Missing: {names(missing)}")
+    if used_by:
+        lines.append(f"Used by: {names([reference.source for reference in used_by])}")
+        if len(affected) > len(used_by):
+            lines.append(f"Reaches {len(affected)} scenes up the chain")
+    return '\n'.join(lines)
+
+
+class ReferenceGraph(object):
+    def __init__(self, db_path, roots=()):
+        self.db_path = db_path
+        self.roots = [root for root in roots if root]
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            try:
+                self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open reference graph {self.db_path} ({e}). Using an in-memory graph.")
+                self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def update(self, directories=None, recursive=True):
+        # Bring the graph up to date for every scene under directories (all the roots by default),
+        # yields how many scenes each batch re-read so a background load can stop between batches
+        directories = self.roots if directories is None else directories
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            seen = set()
+            batch = []
+            for path, stat in scene_files(directory, recursive):
+                key = path_key(path)
+                seen.add(key)
+                with self._lock:
+                    row = self._connect().execute('SELECT size, mtime FROM scenes WHERE key = ?', (key,)).fetchone()
+                if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                    continue
+                batch.append((key, path, stat, self._read(path)))
+                if len(batch) >= UPDATE_BATCH_SIZE:
+                    self._store(batch)
+                    yield len(batch)
+                    batch = []
+            self._store(batch)
+            removed = self._forget_missing(directory, seen, recursive)
+            if batch or removed:
+                yield len(batch) + removed
+
+    def _read(self, path):
+        try:
+            return read_references(path, self.roots)
+        except (OSError, ValueError, EOFError, struct.error) as e:
+            print(f"Warning: Could not read the references of {path} ({e}).")
+            return []
+
+    def _store(self, batch):
+        if not batch:
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for key, path, stat, references in batch:
+                    connection.execute('INSERT OR REPLACE INTO scenes (key, path, size, mtime) VALUES (?, ?, ?, ?)',
+                                       (key, path, stat.st_size, stat.st_mtime))
+                    connection.execute('DELETE FROM refs WHERE source = ?', (key,))
+                    connection.executemany('INSERT INTO refs (source, target, source_path, target_path, namespace) '
+                                           'VALUES (?, ?, ?, ?, ?)',
+                                           [(key, path_key(target), path, target, namespace)
+                                            for target, namespace in references])
+
+    def _forget_missing(self, directory, seen, recursive):
+        # Drop scenes under directory that weren't found this time round
+        prefix = os.path.join(path_key(directory), '')
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute('SELECT key FROM scenes WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)).fetchall()
+            missing = [key for key, in rows
+                       if key not in seen and (recursive or os.path.dirname(key) == prefix[:-1])]
+            with connection:
+                for key in missing:
+                    connection.execute('DELETE FROM scenes WHERE key = ?', (key,))
+                    connection.execute('DELETE FROM refs WHERE source = ?', (key,))
+        return len(missing)
+
+    def uses(self, path):
+        # References in path, as Reference tuples in file order
+        with self._lock:
+            rows = self._connect().execute('SELECT source_path, target_path, namespace FROM refs WHERE source = ? '
+                                           'ORDER BY rowid', (path_key(path),)).fetchall()
+        return [Reference(source, target, namespace, os.path.exists(target)) for source, target, namespace in rows]
+
+    def used_by(self, path):
+        # Scenes that reference path directly
+        with self._lock:
+            rows = self._connect().execute('SELECT source_path, target_path, namespace FROM refs WHERE target = ? '
+                                           'ORDER BY source_path', (path_key(path),)).fetchall()
+        return [Reference(source, target, namespace, True) for source, target, namespace in rows]
+
+    def affected_by(self, path):
+        # Every scene that ends up with path in it, nearest first, so whatever a publish of path reaches
+        found = []
+        seen = {path_key(path)}
+        pending = [path]
+        while pending:
+            next_pending = []
+            for current in pending:
+                for reference in self.used_by(current):
+                    key = path_key(reference.source)
+                    if key not in seen:
+                        seen.add(key)
+                        found.append(reference.source)
+                        next_pending.append(reference.source)
+            pending = next_pending
+        return found
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Build and query the asset store reference graph.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('update', help="read any scenes that changed since the last update")
+    uses_parser = subparsers.add_parser('uses', help="list what a scene references")
+    uses_parser.add_argument('path')
+    used_by_parser = subparsers.add_parser('used-by', help="list the scenes referencing a file")
+    used_by_parser.add_argument('path')
+    used_by_parser.add_argument('--all', action='store_true', help="include everything further up the chain")
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if arguments.asset_directory:
+        settings["asset_directory"] = arguments.asset_directory
+    store = AssetStore(settings)
+    if arguments.command == 'update':
+        print(f"Read {sum(store.update_references())} changed scenes")
+    elif arguments.command == 'uses':
+        for reference in store.references.uses(arguments.path):
+            missing = '' if reference.exists else '  (missing)'
+            print(f"{reference.namespace or '-'}: {reference.target}{missing}")
+    elif arguments.all:
+        for path in store.references.affected_by(arguments.path):
+            print(path)
+    else:
+        for reference in store.references.used_by(arguments.path):
+            print(f"{reference.source} ({reference.namespace or '-'})")
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,320 @@
+"""
+asset_retention.py
+
+Retention policy moving old versions out of the asset store into the archive folder
+
+- versions picked by the "retention" policy in settings.json move from <base>_versions in the asset store to
+  the same place under archive_directory, gzipped on the way unless the policy says not to
+- the newest keep_latest versions, anything younger than older_than_days and, with keep_notes, every version
+  that has a note written for it stay put, blob and object stored versions are never moved
+- moves run on a small pool of workers sharing one bytes per second budget, so a big clean up doesn't
+  swamp the share while artists are working on it
+- an archived copy is read back and checked against the published checksum before the manifest points at it,
+  only then does the original go. The versions list and notes stay as they were, archived versions open and
+  import straight from the archive and can be restored from the browser
+
+    "retention": {"keep_latest": 10, "older_than_days": 90, "keep_notes": true, "compress": true,
+                  "workers": 4, "max_mb_per_second": 50}
+
+    python asset_retention.py apply [--dry-run] [--asset-directory PATH]
+    python asset_retention.py restore PROJECT CREATURE FILE
+
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_compress import COMPRESSED_EXTENSION, asset_manifests, compressed_checksum, is_compressed
+from asset_files import CHECKSUM_CHUNK_SIZE, file_checksum, replace_file, temp_path_for
+from asset_manifest import PublishLockError, note_file_name
+from asset_notes import DEFAULT_NOTE_TEXT, NotesLog
+from asset_thumbnails import thumbnail_path
+from asset_trace import span
+
+DEFAULT_POLICY = {
+    'keep_latest': 10,
+    'older_than_days': 90,
+    'keep_notes': True,
+    'compress': True,
+    'level': 6,
+    'workers': 4,
+    # 0 for no limit
+    'max_mb_per_second': 0,
+}
+
+# versions_directory and file are where the version was, size is what left the asset store,
+# archived_size is None for a dry run
+RetentionResult = namedtuple('RetentionResult', ['versions_directory', 'file', 'size', 'archived_path', 'archived_size'])
+
+
+def retention_policy(settings):
+    # The retention policy from settings, None when retention is off or there's nowhere to archive to
+    policy = settings.get("retention")
+    if not policy or not settings.get("archive_directory"):
+        return None
+    merged = dict(DEFAULT_POLICY)
+    merged.update(policy if isinstance(policy, dict) else {})
+    return merged
+
+
+def archive_path(asset_directory, archive_directory, path):
+    # Where a file in the asset store goes in the archive, same folders under the archive directory
+    return os.path.join(archive_directory, os.path.relpath(path, asset_directory))
+
+
+def archived_path(archive_directory, record):
+    # Full path of an archived version, the manifest keeps it relative with forward slashes
+    return os.path.join(archive_directory, *record['archived'].split('/'))
+
+
+class Throttle(object):
+    # One bytes per second budget shared by every worker, each chunk waits for its slot
+    def __init__(self, bytes_per_second=0):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, size):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + size / self.bytes_per_second
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def transfer(source_path, destination_path, throttle=None, level=None):
+    # Stream source_path to destination_path in chunks, gzipped when level is given.
+    # Returns the sha256 of what was read, the destination only appears once it is complete
+    digest = hashlib.sha256()
+    if not os.path.exists(os.path.dirname(destination_path)):
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    temp_path = temp_path_for(destination_path)
+    try:
+        with open(source_path, 'rb') as source:
+            destination = gzip.open(temp_path, 'wb', compresslevel=level) if level else open(temp_path, 'wb')
+            with destination:
+                for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_SIZE), b''):
+                    if throttle:
+                        throttle.consume(len(chunk))
+                    digest.update(chunk)
+                    destination.write(chunk)
+        replace_file(temp_path, destination_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return f"sha256:{digest.hexdigest()}"
+
+
+def verified(destination_path, copied, expected, compressed=False):
+    # Read a copy back, it has to match what was read from the source and, when the manifest has one,
+    # the published checksum. compressed is True when the copy was gzipped on the way
+    if compressed:
+        read_back = logical = compressed_checksum(destination_path)
+    else:
+        read_back = file_checksum(destination_path)
+        logical = compressed_checksum(destination_path) if expected and is_compressed(destination_path) else read_back
+    return read_back == copied and (not expected or logical == expected)
+
+
+def has_note(manifest, record, notes_index=None):
+    # True if somebody wrote a note for this version, the browser's placeholder doesn't count
+    notes_log = NotesLog(manifest.notes_directory, manifest.base_name)
+    if notes_log.exists():
+        note = notes_log.read(record['version'], notes_index)
+        text = note.text if note else ''
+    else:
+        note_path = os.path.join(manifest.notes_directory, record.get('notes') or note_file_name(manifest.base_name, record['version']))
+        try:
+            with open(note_path, 'r', encoding='utf-8', errors='replace') as note_file:
+                text = note_file.read()
+        except OSError:
+            text = ''
+    return text.strip() not in ('', DEFAULT_NOTE_TEXT)
+
+
+def select_versions(manifest, records, policy, now=None):
+    # Records the policy wants archived, oldest first. A restored version counts as new from when it was
+    # restored, so it isn't straight back in the archive the next time the policy runs
+    now = now or time.time()
+    keep_latest = max(0, int(policy['keep_latest']))
+    cutoff = now - float(policy['older_than_days']) * 86400
+    candidates = records[:-keep_latest] if keep_latest else records
+    candidates = [record for record in candidates
+                  if not record.get('archived') and not record.get('blob') and not record.get('object')
+                  and max(record['timestamp'], record.get('restored') or 0) <= cutoff]
+    if candidates and policy['keep_notes']:
+        notes_log = NotesLog(manifest.notes_directory, manifest.base_name)
+        notes_index = notes_log.index() if notes_log.exists() else None
+        candidates = [record for record in candidates if not has_note(manifest, record, notes_index)]
+    return candidates
+
+
+def _update_record(manifest, file_name, changes, removed=()):
+    # Apply changes to one version's record (and the latest record if it's the same version) under the lock
+    with manifest.lock():
+        current = manifest.load()
+        for record in [current['latest']] + current['versions']:
+            if record and record['file'] == file_name:
+                record.update(changes)
+                for key in removed:
+                    record.pop(key, None)
+        manifest.write(current)
+
+
+def _move_thumbnail(source_path, destination_path):
+    # Thumbnails go along with their version, they're small enough not to bother the throttle
+    source_thumbnail = thumbnail_path(source_path)
+    if os.path.exists(source_thumbnail):
+        transfer(source_thumbnail, thumbnail_path(destination_path))
+        return source_thumbnail
+    return None
+
+
+def archive_version(manifest, record, asset_directory, archive_directory, policy, throttle=None, dry_run=False):
+    # Move one version to the archive, returns a RetentionResult or None if it was left where it was
+    stored_name = record.get('stored') or record['file']
+    source_path = os.path.join(manifest.versions_directory, stored_name)
+    if not os.path.exists(source_path):
+        return None
+    size = os.path.getsize(source_path)
+    compress = bool(policy['compress']) and not is_compressed(stored_name)
+    archived_name = stored_name + COMPRESSED_EXTENSION if compress else stored_name
+    destination_path = archive_path(asset_directory, archive_directory,
+                                    os.path.join(manifest.versions_directory, archived_name))
+    if dry_run:
+        return RetentionResult(manifest.versions_directory, record['file'], size, destination_path, None)
+
+    with span('retention.archive', path=source_path, bytes=size):
+        copied = transfer(source_path, destination_path, throttle, int(policy['level']) if compress else None)
+        if not verified(destination_path, copied, record.get('checksum'), compress):
+            os.remove(destination_path)
+            print(f"Warning: The archived copy of {source_path} doesn't match its published checksum, left where it was.")
+            return None
+        source_thumbnail = _move_thumbnail(source_path, destination_path)
+
+        # The manifest points at the archive before the original goes, so readers always find a copy
+        archived_size = os.path.getsize(destination_path)
+        changes = {'archived': os.path.relpath(destination_path, archive_directory).replace('\\', '/'),
+                   'stored': archived_name, 'stored_size': archived_size}
+        if compress:
+            changes['compressed'] = 'gzip'
+        _update_record(manifest, record['file'], changes)
+        os.remove(source_path)
+        if source_thumbnail:
+            os.remove(source_thumbnail)
+    return RetentionResult(manifest.versions_directory, record['file'], size, destination_path, archived_size)
+
+
+def restore_version(manifest, file_name, archive_directory, throttle=None):
+    # Bring an archived version back into its versions folder as it was stored, returns its path there
+    with manifest.lock():
+        records = manifest.load()['versions']
+    record = next((record for record in records if record['file'] == file_name and record.get('archived')), None)
+    if record is None:
+        raise ValueError(f"{file_name} isn't archived.")
+    source_path = archived_path(archive_directory, record)
+    destination_path = os.path.join(manifest.versions_directory, record['stored'])
+
+    with span('retention.restore', path=source_path, bytes=record.get('stored_size')):
+        copied = transfer(source_path, destination_path, throttle)
+        if not verified(destination_path, copied, record.get('checksum')):
+            os.remove(destination_path)
+            raise ValueError(f"The archived copy of {file_name} doesn't match its published checksum.")
+        source_thumbnail = _move_thumbnail(source_path, destination_path)
+        _update_record(manifest, record['file'], {'restored': time.time()}, removed=('archived',))
+        os.remove(source_path)
+        if source_thumbnail:
+            os.remove(source_thumbnail)
+    return destination_path
+
+
+def apply_retention(manifests, asset_directory, archive_directory, policy, dry_run=False):
+    # Apply the policy to every asset in manifests, returns a RetentionResult per version moved (or that would be)
+    tasks = []
+    for manifest in manifests:
+        data = manifest.read() or manifest.bootstrap()
+        tasks.extend((manifest, record) for record in select_versions(manifest, data['versions'], policy))
+    if dry_run:
+        results = [archive_version(manifest, record, asset_directory, archive_directory, policy, dry_run=True)
+                   for manifest, record in tasks]
+        return [result for result in results if result]
+
+    throttle = Throttle(float(policy['max_mb_per_second']) * 1024 ** 2)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, int(policy['workers']))) as pool:
+        futures = [(record, pool.submit(archive_version, manifest, record, asset_directory, archive_directory,
+                                        policy, throttle))
+                   for manifest, record in tasks]
+        for record, future in futures:
+            try:
+                result = future.result()
+            except (OSError, ValueError, PublishLockError) as e:
+                print(f"Warning: Could not archive {record['file']} ({e}).")
+                continue
+            if result:
+                results.append(result)
+    return results
+
+
+def describe_results(results, dry_run=False):
+    # Report for the command line, a line per asset and a total
+    by_directory = {}
+    for result in results:
+        by_directory.setdefault(result.versions_directory, []).append(result)
+    lines = []
+    for versions_directory in sorted(by_directory):
+        moved = by_directory[versions_directory]
+        size = sum(result.size for result in moved)
+        lines.append(f"{versions_directory}: {len(moved)} versions, {size / 1024 ** 2:.1f} MB")
+    total = sum(result.size for result in results)
+    if dry_run:
+        lines.append(f"Would archive {len(results)} versions, reclaiming {total / 1024 ** 2:.1f} MB from the asset store")
+    else:
+        archived = sum(result.archived_size for result in results)
+        lines.append(f"Archived {len(results)} versions, reclaimed {total / 1024 ** 2:.1f} MB from the asset store "
+                     f"({archived / 1024 ** 2:.1f} MB in the archive)")
+    return '\n'.join(lines)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Move old asset store versions to the archive using the settings.json policy.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    apply_parser = subparsers.add_parser('apply', help="archive every version the policy picks")
+    apply_parser.add_argument('--dry-run', action='store_true', help="only report what would be archived")
+    restore_parser = subparsers.add_parser('restore', help="bring an archived version back into the asset store")
+    restore_parser.add_argument('project')
+    restore_parser.add_argument('creature')
+    restore_parser.add_argument('file', help="version file name, e.g. heromodel_v0003.ma")
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if arguments.asset_directory:
+        settings["asset_directory"] = arguments.asset_directory
+    store = AssetStore(settings)
+    if arguments.command == 'restore':
+        base_name = os.path.splitext(arguments.file)[0].rsplit('_v', 1)[0]
+        print(f"Restored {store.restore_version(arguments.project, arguments.creature, base_name, arguments.file)}")
+    elif not store.retention_policy:
+        print("No retention policy or archive_directory in settings.json, nothing to do.")
+    else:
+        results = apply_retention(asset_manifests(store.asset_directory), store.asset_directory, store.archive_directory,
+                                  store.retention_policy, arguments.dry_run)
+        print(describe_results(results, arguments.dry_run))
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,254 @@
+"""
+asset_search.py
+
+Type-ahead search over every project, creature, asset and version name
+
+- an in-memory trigram index, each name is broken into overlapping three letter chunks and a query only
+  has to look at the names sharing its rarest chunks, so a keystroke stays quick even with 100k+ names
+- matches are fuzzy, a name missing a few of the query's chunks still comes back just ranked lower,
+  names containing the query outright rank first
+- the index is filled in the background from the catalog and kept up to date a folder at a time as the
+  watcher sees changes, so it is never rebuilt from scratch while the browser is open
+
+"""
+
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, namedtuple
+
+# Share of the query's trigrams a name needs to be a match at all
+MIN_MATCH_RATIO = 0.6
+DEFAULT_LIMIT = 20
+# Past this many exact matches versions are left out of the ranking, a query that broad is after an
+# asset and typing on (or adding "v0003") brings the versions back
+BROAD_MATCH_COUNT = 2000
+BUILD_BATCH_SIZE = 500
+
+# kind is 'project', 'creature', 'asset' or 'version', base_name is set for assets and versions
+SearchEntry = namedtuple('SearchEntry', ['kind', 'project', 'creature', 'base_name', 'name', 'path'])
+
+
+def trigrams(text, pad_end=True):
+    # Trigrams of each word, "_" and punctuation split words so "heromodel_v0003.mb" matches "v0003".
+    # Queries leave the end of each word open since the artist is probably still typing it
+    grams = set()
+    for word in re.split(r'[\W_]+', text.lower()):
+        padded = f" {word} " if pad_end else f" {word}"
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+def parent_key(entry):
+    # The folder an entry was listed from, as the tuple of names leading to it
+    if entry.kind == 'project':
+        return ()
+    if entry.kind == 'creature':
+        return (entry.project,)
+    if entry.kind == 'asset':
+        return (entry.project, entry.creature)
+    return (entry.project, entry.creature, entry.base_name)
+
+
+def child_key(entry):
+    # Key of the listing inside an entry, None for versions which have nothing under them
+    if entry.kind == 'version':
+        return None
+    return parent_key(entry) + (entry.base_name if entry.kind == 'asset' else entry.name,)
+
+
+def directory_key(asset_directory, directory):
+    # Key for the listing a directory on disk holds, None for folders the index doesn't cover
+    relative_path = os.path.relpath(os.path.normpath(directory), os.path.normpath(asset_directory))
+    if relative_path == '.':
+        return ()
+    if relative_path.startswith('..'):
+        return None
+    parts = relative_path.replace('\\', '/').split('/')
+    if len(parts) <= 2:
+        return tuple(parts)
+    if len(parts) == 3 and parts[2].endswith('_versions'):
+        return (parts[0], parts[1], parts[2][:-len('_versions')])
+    return None
+
+
+def display_name(entry):
+    return ' / '.join(part for part in (entry.project, entry.creature, entry.name if entry.kind != 'project' else None)
+                      if part)
+
+
+class NameIndex(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._texts = []
+        self._names = []
+        self._free = []
+        self._postings = {}
+        self._children = {}
+        self._version_ids = set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries) - len(self._free)
+
+    def _search_text(self, entry):
+        return ' '.join(part for part in (entry.project, entry.creature, entry.name if entry.kind != 'project' else None)
+                        if part).lower()
+
+    def _add(self, entry):
+        # Caller holds the lock
+        text = self._search_text(entry)
+        if self._free:
+            entry_id = self._free.pop()
+            self._entries[entry_id] = entry
+            self._texts[entry_id] = text
+            self._names[entry_id] = entry.name.lower()
+        else:
+            entry_id = len(self._entries)
+            self._entries.append(entry)
+            self._texts.append(text)
+            self._names.append(entry.name.lower())
+        for trigram in trigrams(text):
+            self._postings.setdefault(trigram, set()).add(entry_id)
+        self._children.setdefault(parent_key(entry), {})[entry.name] = entry_id
+        if entry.kind == 'version':
+            self._version_ids.add(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries[entry_id]
+        for trigram in trigrams(self._texts[entry_id]):
+            posting = self._postings.get(trigram)
+            if posting is not None:
+                posting.discard(entry_id)
+                if not posting:
+                    del self._postings[trigram]
+        self._entries[entry_id] = None
+        self._texts[entry_id] = None
+        self._names[entry_id] = None
+        self._version_ids.discard(entry_id)
+        self._free.append(entry_id)
+        return entry
+
+    def add(self, entries):
+        with self._lock:
+            for entry in entries:
+                key = parent_key(entry)
+                existing = self._children.get(key, {}).get(entry.name)
+                if existing is not None:
+                    self._remove(existing)
+                self._add(entry)
+
+    def add_from(self, entries, batch_size=BUILD_BATCH_SIZE):
+        # Index entries from a generator in batches, yields after each batch so a background load
+        # can stop between them and searches aren't kept waiting on the lock
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                self.add(batch)
+                yield len(batch)
+                batch = []
+        if batch:
+            self.add(batch)
+            yield len(batch)
+
+    def replace_children(self, key, entries):
+        # Make the listing under key exactly entries, folders that disappeared take their contents with them.
+        # Returns the entries that weren't there before
+        added = []
+        with self._lock:
+            wanted = {entry.name: entry for entry in entries}
+            current = self._children.get(key, {})
+            for name in list(current):
+                if name not in wanted:
+                    removed = self._remove(current.pop(name))
+                    self._remove_tree(child_key(removed))
+            for name, entry in wanted.items():
+                if name in current:
+                    if self._entries[current[name]] == entry:
+                        continue
+                    self._remove(current.pop(name))
+                else:
+                    added.append(entry)
+                self._add(entry)
+        return added
+
+    def _remove_tree(self, key):
+        if key is None:
+            return
+        children = self._children.pop(key, {})
+        for entry_id in children.values():
+            self._remove_tree(child_key(self._remove(entry_id)))
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._texts = []
+            self._names = []
+            self._free = []
+            self._postings = {}
+            self._children = {}
+            self._version_ids = set()
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        # Best matches for query as SearchEntry, best first
+        query = ' '.join(query.lower().split())
+        if not query:
+            return []
+        with self._lock:
+            scored = self._trigram_matches(query, limit)
+            best = heapq.nlargest(limit, scored)
+            return [self._entries[entry_id] for score, length, entry_id in best]
+
+    def _scan(self, query):
+        # A single letter doesn't make a trigram, look through everything but the versions for it
+        for entry_id, name in enumerate(self._names):
+            if name is not None and entry_id not in self._version_ids and name.startswith(query):
+                yield self._score(query, entry_id, 1.0)
+
+    def _trigram_matches(self, query, limit=DEFAULT_LIMIT):
+        query_trigrams = trigrams(query, pad_end=False)
+        postings = sorted((self._postings.get(trigram, ()) for trigram in query_trigrams), key=len)
+        if not postings:
+            return self._scan(query)
+
+        # Names with every trigram of the query are the usual case while typing, set intersection
+        # smallest first does that in C. Only when that finds too little are near misses counted
+        exact = set(postings[0]).intersection(*postings[1:]) if postings[0] else set()
+        if len(exact) > BROAD_MATCH_COUNT:
+            assets = exact - self._version_ids
+            if len(assets) >= limit:
+                exact = assets
+        if len(exact) >= limit:
+            return [self._score(query, entry_id, 1.0) for entry_id in exact]
+        needed = max(1, math.ceil(len(postings) * MIN_MATCH_RATIO))
+        counts = Counter()
+        for posting in postings:
+            counts.update(posting)
+        return [self._score(query, entry_id, matched / len(postings))
+                for entry_id, matched in counts.items() if matched >= needed]
+
+    def _score(self, query, entry_id, ratio):
+        name = self._names[entry_id]
+        text = self._texts[entry_id]
+        score = ratio
+        if query in name:
+            score += 1.5 if name.startswith(query) else 1.0
+        elif query in text:
+            score += 0.5
+        if self._entries[entry_id].kind == 'version':
+            # There are far more versions than anything else, let the assets they belong to come first
+            score -= 0.25
+        # Shorter names win ties, then ids keep the order stable
+        return score, -len(text), entry_id
+
+
+def refresh_listing(index, store, key):
+    # Bring one folder's listing in the index up to date, anything new gets its contents indexed too
+    for entry in index.replace_children(key, store.search_listing(key)):
+        if child_key(entry) is not None:
+            index.add(store.search_entries(child_key(entry)))
+    return []
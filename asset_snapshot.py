@@ -0,0 +1,227 @@
+"""
+asset_snapshot.py
+
+Snapshots pinning the versions a farm job imports
+
+- a snapshot is one small json file pinning every master of a project (or of some creatures or assets) to the
+  version it was built from when the snapshot was taken, with that version's path, checksum and size
+- stone_importer resolves through the snapshot instead of listing the share, so every task of a job gets the
+  same files however many publishes land while it runs. Point it at one with the snapshot argument, the
+  BAAL_SNAPSHOT environment variable or "snapshot" in settings.json
+- pinned files are published versions and never change, prefetch copies all of them into the node's local
+  cache in parallel before the job starts and the importer then only reads local disk
+- paths are stored relative to the asset store (or the archive) with forward slashes, the same snapshot works
+  from windows and linux mounts of the share
+
+    python asset_snapshot.py export PROJECT1 --creature sphereman --output E:/jobs/shot010.snapshot.json
+    python asset_snapshot.py prefetch E:/jobs/shot010.snapshot.json --cache-directory D:/baal_cache
+
+"""
+
+import argparse
+import getpass
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_catalog import version_number
+from asset_compress import logical_name
+from asset_files import replace_file, temp_path_for
+from asset_storage import is_object_path
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_ENVIRONMENT_VARIABLE = 'BAAL_SNAPSHOT'
+DEFAULT_PREFETCH_WORKERS = 8
+
+# path is absolute for this machine, key is "<project>/<creature>/<file name>" as stone_importer is given it
+Pin = namedtuple('Pin', ['key', 'version', 'file', 'path', 'checksum', 'size'])
+PrefetchResult = namedtuple('PrefetchResult', ['pin', 'local_path', 'error'])
+
+
+def snapshot_key(project_name, creature_name, file_name):
+    return f"{project_name}/{creature_name}/{file_name}"
+
+
+def _master_base_name(file_name):
+    stem, extension = os.path.splitext(file_name)
+    return stem[:-len('_master')] if stem.endswith('_master') else None
+
+
+def _latest_with_extension(version_entries, extension):
+    # Newest version saved as extension, a master only ever comes from a version of its own file type
+    numbered = [(version_number(logical_name(entry.name)), entry) for entry in version_entries
+                if os.path.splitext(logical_name(entry.name))[1] == extension]
+    numbered = [(number, entry) for number, entry in numbered if number is not None]
+    return max(numbered, key=lambda pair: pair[0]) if numbered else (None, None)
+
+
+def _pin_path(store, path):
+    # (root, path) as stored in the snapshot, relative to whichever root the file lives under
+    if is_object_path(path):
+        return 'object', path
+    if store.is_archived(path):
+        return 'archive', os.path.relpath(path, store.archive_directory).replace(os.sep, '/')
+    return 'asset', os.path.relpath(path, store.asset_directory).replace(os.sep, '/')
+
+
+def export_snapshot(store, project_name, creature_names=None, base_names=None):
+    # Pin the masters of a project, or just of some creatures or assets, to their current versions.
+    # Each pin is under the master's name and its version's name, returns the snapshot as a dict
+    if creature_names is None:
+        creature_names = [entry.name for entry in store.creatures(project_name)]
+    pins = {}
+    for creature_name in creature_names:
+        for asset_entry in store.assets(project_name, creature_name):
+            base_name = _master_base_name(asset_entry.name)
+            if base_name is None or (base_names and base_name not in base_names):
+                continue
+            version, version_entry = _latest_with_extension(store.versions(project_name, creature_name, base_name),
+                                                            os.path.splitext(asset_entry.name)[1])
+            if version_entry is None:
+                print(f"Warning: {asset_entry.name} in {project_name}/{creature_name} has no published versions, not pinned.")
+                continue
+            root, path = _pin_path(store, version_entry.path)
+            pin = {'version': version, 'file': logical_name(version_entry.name), 'root': root, 'path': path,
+                   'checksum': store.published_checksum(version_entry.path), 'size': version_entry.size}
+            pins[snapshot_key(project_name, creature_name, asset_entry.name)] = pin
+            pins[snapshot_key(project_name, creature_name, pin['file'])] = pin
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'created': time.time(),
+        'author': getpass.getuser(),
+        'project': project_name,
+        'pins': pins,
+    }
+
+
+def write_snapshot(snapshot, path):
+    temp_path = temp_path_for(path)
+    with open(temp_path, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file, indent=1, sort_keys=True)
+    replace_file(temp_path, path)
+
+
+class Snapshot(object):
+    def __init__(self, data, asset_directory, archive_directory=None, path=None):
+        if data.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Snapshot {path or ''} is format {data.get('format')}, expected {SNAPSHOT_FORMAT}.")
+        self.data = data
+        self.path = path
+        self.roots = {'asset': asset_directory, 'archive': archive_directory}
+
+    @classmethod
+    def load(cls, path, asset_directory, archive_directory=None):
+        with open(path, 'r') as snapshot_file:
+            return cls(json.load(snapshot_file), asset_directory, archive_directory, path)
+
+    def _pin(self, key, record):
+        if record['root'] == 'object':
+            path = record['path']
+        else:
+            root = self.roots.get(record['root'])
+            if not root:
+                raise ValueError(f"{key} is pinned to the {record['root']} folder, which isn't in settings.")
+            path = os.path.join(root, *record['path'].split('/'))
+        return Pin(key, record['version'], record['file'], path, record.get('checksum'), record.get('size'))
+
+    def resolve(self, project_name, creature_name, file_name):
+        # The Pin for a file as stone_importer names it, None if the snapshot doesn't pin it
+        key = snapshot_key(project_name, creature_name, file_name)
+        record = self.data['pins'].get(key)
+        return self._pin(key, record) if record else None
+
+    def pins(self):
+        # Every pinned file once, masters and their versions share a pin
+        unique = {}
+        for key, record in sorted(self.data['pins'].items()):
+            unique.setdefault((record['root'], record['path']), self._pin(key, record))
+        return list(unique.values())
+
+
+# Farm tasks import many assets through the same snapshot, it's only read again if the file changes
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def active_snapshot(store, snapshot=None):
+    # The Snapshot stone_importer should resolve through: snapshot itself (a Snapshot or a path), else the
+    # BAAL_SNAPSHOT environment variable, else "snapshot" in settings. None when there isn't one
+    if isinstance(snapshot, Snapshot):
+        return snapshot
+    path = snapshot or os.environ.get(SNAPSHOT_ENVIRONMENT_VARIABLE) or store.settings.get("snapshot")
+    if not path:
+        return None
+    key = (os.path.abspath(path), os.path.getmtime(path), store.asset_directory, store.archive_directory)
+    with _loaded_lock:
+        if key not in _loaded:
+            _loaded.clear()
+            _loaded[key] = Snapshot.load(path, store.asset_directory, store.archive_directory)
+        return _loaded[key]
+
+
+def prefetch(store, snapshot, workers=DEFAULT_PREFETCH_WORKERS):
+    # Copy every pinned file into the store's local cache ahead of a job, returns a PrefetchResult per file.
+    # Without a cache_directory only object stored and compressed versions have anything to fetch
+    def fetch(pin):
+        try:
+            return PrefetchResult(pin, store.local_path(pin.path, pin.checksum), None)
+        except Exception as e:
+            return PrefetchResult(pin, None, str(e))
+
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='baal-prefetch') as executor:
+        return list(executor.map(fetch, snapshot.pins()))
+
+
+def describe_prefetch(results, seconds):
+    failed = [result for result in results if result.error]
+    total_bytes = sum(result.pin.size or 0 for result in results if not result.error)
+    lines = [f"Fetch failed for {result.pin.key}: {result.error}" for result in failed]
+    lines.append(f"Prefetched {len(results) - len(failed)} of {len(results)} pinned files "
+                 f"({total_bytes / 1024 ** 2:.1f} MB) in {seconds:.1f}s")
+    return '\n'.join(lines)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Pin asset versions for a farm job and prefetch them to a node.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="pin the current versions of a project's masters")
+    export_parser.add_argument('project')
+    export_parser.add_argument('--creature', action='append', help="only this creature, can be given more than once")
+    export_parser.add_argument('--asset', action='append', help="only this base name, e.g. heromodel")
+    export_parser.add_argument('--output', required=True, help="snapshot file to write")
+    prefetch_parser = subparsers.add_parser('prefetch', help="copy every pinned file into the local cache")
+    prefetch_parser.add_argument('snapshot')
+    prefetch_parser.add_argument('--cache-directory', help="defaults to cache_directory in settings.json")
+    prefetch_parser.add_argument('--workers', type=int, default=DEFAULT_PREFETCH_WORKERS)
+    parser.add_argument('--asset-directory', help="defaults to asset_directory in settings.json")
+    arguments = parser.parse_args(arguments)
+
+    from asset_store import AssetStore, load_settings
+    settings = load_settings()
+    if arguments.asset_directory:
+        settings["asset_directory"] = arguments.asset_directory
+    if arguments.command == 'prefetch' and arguments.cache_directory:
+        settings["cache_directory"] = arguments.cache_directory
+    store = AssetStore(settings)
+    failed = 0
+    if arguments.command == 'export':
+        snapshot = export_snapshot(store, arguments.project, arguments.creature, arguments.asset)
+        write_snapshot(snapshot, arguments.output)
+        print(f"Pinned {len(snapshot['pins'])} names to {arguments.output}")
+    else:
+        if not store.cache:
+            print("Warning: No cache_directory, only object stored and compressed versions are fetched.")
+        started = time.perf_counter()
+        results = prefetch(store, Snapshot.load(arguments.snapshot, store.asset_directory, store.archive_directory),
+                           arguments.workers)
+        print(describe_prefetch(results, time.perf_counter() - started))
+        failed = sum(1 for result in results if result.error)
+    store.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+"""
+asset_state.py
+
+Browser state between sessions and startup timing
+
+- the project list, the last selected project, creature, asset and version and the tab on show are kept
+  in a small json file in the artist's home folder, the browser opens straight onto them and only checks
+  the share for changes once the window is up
+- state is kept per asset directory so switching settings.json between stores doesn't mix them up
+- opening the window is timed step by step, the report is printed whenever it goes over the budget
+
+    "startup_budget_ms": 500, "startup_report": true
+
+"""
+
+import json
+import os
+import time
+
+from asset_files import replace_file, temp_path_for
+
+STATE_FILE_NAME = '.baal_browser_state.json'
+DEFAULT_STARTUP_BUDGET_MS = 500
+
+
+def state_file_path(settings):
+    return settings.get("state_file") or os.path.join(os.path.expanduser('~'), STATE_FILE_NAME)
+
+
+def load_state(path, asset_directory):
+    # State saved for asset_directory, empty when there's none or the file can't be read
+    try:
+        with open(path, 'r') as state_file:
+            states = json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+    state = states.get(os.path.normpath(asset_directory)) if isinstance(states, dict) else None
+    return state if isinstance(state, dict) else {}
+
+
+def save_state(path, asset_directory, state):
+    try:
+        with open(path, 'r') as state_file:
+            states = json.load(state_file)
+        if not isinstance(states, dict):
+            states = {}
+    except (OSError, ValueError):
+        states = {}
+    states[os.path.normpath(asset_directory)] = state
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, 'w') as state_file:
+            json.dump(states, state_file, indent=2)
+        replace_file(temp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not save the browser state to {path} ({e}).")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class StartupTimer(object):
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.marks = []
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def elapsed_ms(self):
+        end = self.marks[-1][1] if self.marks else time.perf_counter()
+        return (end - self.started) * 1000
+
+    def report(self):
+        # "Startup 412 ms: store 12 ms, widgets 40 ms, ..." with the time each step took
+        steps = []
+        previous = self.started
+        for name, at in self.marks:
+            steps.append(f"{name} {(at - previous) * 1000:.0f} ms")
+            previous = at
+        return f"Startup {self.elapsed_ms():.0f} ms: " + ', '.join(steps)
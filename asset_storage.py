@@ -0,0 +1,190 @@
+"""
+asset_storage.py
+
+Storage backends for the asset store
+
+- everything the store and browser do with files goes through a backend: a listing is one call per directory
+  that brings back every entry with its type, size and mtime, then stat, read, download, upload and remove
+- FileSystemBackend is the share, listings come from os.scandir whose entries carry their stat on windows
+  and their type everywhere. Elsewhere size and mtime still cost a stat per entry, so callers pass wanted to
+  drop the entries they'd throw away (hidden files, other extensions) before those are stat'ed
+- ObjectStoreBackend (asset_object_store.py) keeps published versions in an S3 style bucket, paths there are
+  s3://bucket/key and Storage sends every call to the right backend by its path
+- manifests, notes, masters and locks stay on the share either way, they rely on renames, appends and
+  exclusive creates that object stores don't have
+
+    "storage": {"type": "s3", "endpoint": "http://objects:9000", "bucket": "baal", "prefix": "versions"}
+    "version_storage": "objects"
+
+"""
+
+import os
+import stat
+from collections import namedtuple
+
+from asset_files import atomic_copy
+from asset_trace import span
+
+OBJECT_SCHEME = 's3://'
+
+# Same fields as the catalog's CatalogEntry so either converts straight into the other
+StorageEntry = namedtuple('StorageEntry', ['name', 'path', 'is_dir', 'size', 'mtime'])
+
+
+class StorageError(OSError):
+    pass
+
+
+class StorageBackend(object):
+    # One call per directory for listings, the rest are per file. Paths are whatever the backend understands,
+    # local paths for the file system and s3://bucket/key for object stores
+
+    def list(self, directory, wanted=None):
+        # StorageEntry for everything in directory including hidden entries, [] if it doesn't exist.
+        # wanted(name, is_dir) narrows that down, only what it returns True for is listed
+        raise NotImplementedError
+
+    def stat(self, path):
+        # StorageEntry for path, None if nothing is there
+        raise NotImplementedError
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def read(self, path, start=0, length=None):
+        raise NotImplementedError
+
+    def download(self, path, local_path):
+        # Copy path to a local file, local_path only appears once it is complete
+        raise NotImplementedError
+
+    def upload(self, local_path, path):
+        raise NotImplementedError
+
+    def remove(self, path):
+        raise NotImplementedError
+
+    def makedirs(self, path):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSystemBackend(StorageBackend):
+    def list(self, directory, wanted=None):
+        entries = []
+        with span('fs.scandir', path=directory) as current:
+            try:
+                with os.scandir(directory) as iterator:
+                    for dir_entry in iterator:
+                        try:
+                            # is_dir comes from the listing itself, only the entries kept pay for a stat
+                            is_dir = dir_entry.is_dir()
+                            if wanted is not None and not wanted(dir_entry.name, is_dir):
+                                continue
+                            entry_stat = dir_entry.stat()
+                        except OSError:
+                            continue
+                        entries.append(StorageEntry(dir_entry.name, dir_entry.path, is_dir,
+                                                    0 if is_dir else entry_stat.st_size, entry_stat.st_mtime))
+            except OSError:
+                return []
+            current.set(entries=len(entries))
+        return entries
+
+    def stat(self, path):
+        with span('fs.stat', path=path):
+            try:
+                path_stat = os.stat(path)
+            except OSError:
+                return None
+        is_dir = stat.S_ISDIR(path_stat.st_mode)
+        return StorageEntry(os.path.basename(path), path, is_dir, 0 if is_dir else path_stat.st_size,
+                            path_stat.st_mtime)
+
+    def exists(self, path):
+        with span('fs.exists', path=path):
+            return os.path.exists(path)
+
+    def read(self, path, start=0, length=None):
+        with span('fs.read', path=path) as current, open(path, 'rb') as source:
+            source.seek(start)
+            data = source.read() if length is None else source.read(length)
+            current.set(bytes=len(data))
+        return data
+
+    def download(self, path, local_path):
+        atomic_copy(path, local_path)
+
+    def upload(self, local_path, path):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_copy(local_path, path)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def makedirs(self, path):
+        with span('fs.makedirs', path=path):
+            os.makedirs(path, exist_ok=True)
+
+
+def is_object_path(path):
+    return isinstance(path, str) and path.startswith(OBJECT_SCHEME)
+
+
+class Storage(StorageBackend):
+    # Sends each call to the object store for s3:// paths and to the file system for everything else
+    def __init__(self, object_store=None):
+        self.files = FileSystemBackend()
+        self.objects = object_store
+
+    def backend(self, path):
+        if is_object_path(path):
+            if self.objects is None:
+                raise StorageError(f"No object store in settings to read {path} from.")
+            return self.objects
+        return self.files
+
+    def is_local(self, path):
+        return not is_object_path(path)
+
+    def list(self, directory, wanted=None):
+        return self.backend(directory).list(directory, wanted)
+
+    def stat(self, path):
+        return self.backend(path).stat(path)
+
+    def exists(self, path):
+        return self.backend(path).exists(path)
+
+    def read(self, path, start=0, length=None):
+        return self.backend(path).read(path, start, length)
+
+    def download(self, path, local_path):
+        self.backend(path).download(path, local_path)
+
+    def upload(self, local_path, path):
+        self.backend(path).upload(local_path, path)
+
+    def remove(self, path):
+        self.backend(path).remove(path)
+
+    def makedirs(self, path):
+        self.backend(path).makedirs(path)
+
+    def close(self):
+        if self.objects is not None:
+            self.objects.close()
+
+
+def storage_from_settings(settings):
+    # The Storage for a settings dict, with an object store only when "storage" describes one
+    config = settings.get("storage")
+    if not config or config.get("type", "filesystem") == "filesystem":
+        return Storage()
+    if config.get("type") != "s3":
+        raise ValueError(f"Unknown storage type '{config.get('type')}' in settings, expected 'filesystem' or 's3'.")
+    from asset_object_store import ObjectStoreBackend
+    return Storage(ObjectStoreBackend.from_settings(config))
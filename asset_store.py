@@ -1,8 +1,28 @@
 import os
-import maya.cmds as cmds
-from PySide2 import QtWidgets, QtGui, QtCore
 import json
-from datetime import datetime
+import sqlite3
+import struct
+import hashlib
+import tempfile
+import time
+from collections import namedtuple
+from asset_blobs import BlobStore, blob_root
+from asset_cache import CacheError, LocalCache, DEFAULT_MAX_GB
+from asset_compress import asset_manifests, compress_versions, compression_policy, decompress_file, is_compressed, logical_name
+from asset_catalog import AssetCatalog, CatalogEntry, version_number
+from asset_diff import DIFF_FILE_NAME, DiffCache, diff_summaries
+from asset_files import COPY_METHODS, atomic_copy, fast_copy, file_checksum, replace_file, temp_path_for
+from asset_manifest import AssetManifest, version_file_name
+from asset_metadata import METADATA_FILE_NAME, MetadataCache, frame_rate, scene_info as read_scene_info
+from asset_notes import NOTES_LOG_FILE_NAME, Note, NotesLog, NotesSearch
+from asset_publish_queue import DEFAULT_UPLOAD_WORKERS, PublishQueue, default_staging_directory, stage_publish
+from asset_references import REFERENCES_FILE_NAME, ReferenceGraph
+from asset_retention import apply_retention, restore_version, retention_policy
+from asset_search import SearchEntry
+from asset_snapshot import active_snapshot, export_snapshot
+from asset_storage import Storage, StorageError, storage_from_settings
+from asset_thumbnails import capture_thumbnail, thumbnail_path
+from asset_trace import enable as enable_tracing, span, traced_cmds, tracing_requested
 
 """
 asset_store.py
@@ -16,6 +36,29 @@ This an asset store for saving and versioning up asset files
 - can import files into current scene
 - generates out a single line importer that can be used in automatically picking up the asset for baking/pipeline work
 - Can navigate and browse other defined folders on the machine it is on
+- keeps a catalog index of the asset store (asset_catalog.py) so browsing doesn't re-list the share on every click
+- scans and note reads run in the background (asset_loader.py) so the share never freezes maya
+- watches the folders on screen (asset_watcher.py) and applies new publishes to the lists in place
+- publishes save the scene once and swap the master in atomically with a fast copy (asset_files.py)
+- version numbers are handed out from a per-asset manifest under a publish lock (asset_manifest.py)
+- the store itself is the headless AssetStore below, maya and Qt are only imported when they are needed
+  so farm and batch scripts can use it outside maya, the UI is FolderBrowserUI in asset_browser.py
+- opens and imports can go through a local size bounded cache (asset_cache.py) instead of the share
+- versions can be stored content addressed (asset_blobs.py) so republishing an unchanged scene is free
+- old .ma versions can be compressed (asset_compress.py) and are decompressed on demand when opened
+- notes go into an append-only log per asset and can be searched across a whole project (asset_notes.py)
+- type-ahead fuzzy search over every project, creature, asset and version name (asset_search.py)
+- reads maya version, units, frame rate and plugins from scene headers without opening them (asset_metadata.py)
+- keeps a graph of which scenes reference which across all three folders for uses / used by queries (asset_references.py)
+- compares the nodes and connections of two .ma versions without opening them, block hashes of each version
+  are cached so walking back through a history only reads every version once (asset_diff.py)
+- captures a viewport thumbnail with every publish (asset_thumbnails.py)
+- old versions can be moved to the archive folder by a retention policy and restored (asset_retention.py)
+- opt-in tracing of every share access and maya.cmds call with a Chrome trace export (asset_trace.py)
+- farm jobs can pin the versions they import with a snapshot and prefetch them to the node (asset_snapshot.py)
+- publishes can save to local staging and upload to the share in the background (asset_publish_queue.py)
+- every listing, stat and transfer goes through a storage backend (asset_storage.py), published versions
+  can live in an S3 style object store (asset_object_store.py)
 
 By Chay
 
@@ -23,575 +66,663 @@ By Chay
 
 """
 
-class FolderBrowserUI(QtWidgets.QDialog):
-    def __init__(self, parent=None):
-        super(FolderBrowserUI, self).__init__(parent)
+SETTINGS_KEYS = ("asset_directory", "current_directory", "archive_directory", "window_icon")
 
-        # Get the directory of the current script
-        script_directory = os.path.dirname(os.path.abspath(__file__))
+# "single_save" saves the version once and copies it to the master, "double_save" saves the scene twice,
+# "queued" saves to local staging and leaves the upload queue to copy and commit it (publish() itself is single_save)
+PUBLISH_MODES = ("single_save", "double_save", "queued")
 
-        # Construct the full path to the settings.json file
-        settings_file = os.path.join(script_directory, 'settings.json')
+# "files" keeps a full copy of every version, "blobs" stores each distinct version once by its hash,
+# "objects" uploads versions to the object store in the "storage" setting
+VERSION_STORAGES = ("files", "blobs", "objects")
 
-        # Load settings from the JSON file
+DEFAULT_NAMESPACES = ('UI', 'shared')
+
+VALID_FRAME_RATES = ("game", "film", "pal", "ntsc", "show", "palf", "ntscf", "23.976fps", "29.97fps", "59.94fps",
+                     "48fps", "30fps", "25fps", "24fps")
+
+PublishResult = namedtuple('PublishResult', ['version', 'version_path', 'master_path', 'notes_path', 'is_latest',
+                                             'thumbnail_path'])
+
+
+def load_settings():
+    # Get the directory of the current script
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+
+    # Construct the full path to the settings.json file
+    settings_file = os.path.join(script_directory, 'settings.json')
+
+    # Load settings from the JSON file
+    try:
+        with open(settings_file, 'r') as file:
+            settings = json.load(file)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"{settings_file} not found. Please provide the settings file.")
+    except json.JSONDecodeError:
+        raise ValueError(f"Error decoding JSON from {settings_file}. Please check the file format.")
+
+    # Check settings
+    for key in SETTINGS_KEYS:
+        if key not in settings:
+            raise KeyError(f"Missing key in {settings_file}: '{key}'. Please ensure all required settings are provided.")
+    return settings
+
+
+def maya_cmds():
+    # maya.cmds is only imported the first time something actually talks to maya,
+    # with tracing on every call through it is timed
+    import maya.cmds as cmds
+    return traced_cmds(cmds)
+
+
+def list_files(folder_path, extensions, storage=None):
+    # Yield the matching files in a folder, only those get stat'ed for their size and mtime
+    storage = storage or Storage()
+    wanted = lambda name, is_dir: not is_dir and not name.startswith('.') and name.endswith(extensions)
+    for entry in storage.list(folder_path, wanted):
+        yield CatalogEntry._make(entry)
+
+
+def master_base_name(file_name):
+    return file_name.replace('_master.ma', '').replace('_master.mb', '')
+
+
+class AssetStore(object):
+    def __init__(self, settings=None):
+        settings = settings if settings is not None else load_settings()
+        self.settings = settings
+        if tracing_requested(settings):
+            enable_tracing()
+        self.asset_directory = settings["asset_directory"]
+        self.current_directory = settings.get("current_directory")
+        self.archive_directory = settings.get("archive_directory")
+        self.publish_mode = settings.get("publish_mode", "single_save")
+        self.master_copy_method = settings.get("master_copy", "auto")
+        if self.publish_mode not in PUBLISH_MODES:
+            raise ValueError(f"Unknown publish_mode '{self.publish_mode}' in settings, expected one of {PUBLISH_MODES}.")
+        if self.master_copy_method not in COPY_METHODS:
+            raise ValueError(f"Unknown master_copy '{self.master_copy_method}' in settings, expected one of {COPY_METHODS}.")
+        self.version_storage = settings.get("version_storage", "files")
+        self.capture_thumbnails = settings.get("thumbnails", True)
+        self.staging_directory = default_staging_directory(settings)
+        self._publish_queue = None
+        if self.version_storage not in VERSION_STORAGES:
+            raise ValueError(f"Unknown version_storage '{self.version_storage}' in settings, expected one of {VERSION_STORAGES}.")
+        self.blobs = BlobStore(blob_root(self.asset_directory))
+        # Listings, stats and transfers, s3:// paths go to the object store when one is set up
+        self.storage = storage_from_settings(settings)
+        if self.version_storage == "objects" and self.storage.objects is None:
+            raise ValueError("version_storage 'objects' needs an s3 \"storage\" entry in settings.")
+        self.compression_policy = compression_policy(settings)
+        self.retention_policy = retention_policy(settings)
+
+        # Catalog index of the asset store, saves re-listing the share on every query
+        self.catalog = AssetCatalog(self.asset_directory, archive_directory=self.archive_directory, storage=self.storage)
+        self.notes_search = NotesSearch(self.asset_directory)
+        self.metadata = MetadataCache(os.path.join(self.asset_directory, METADATA_FILE_NAME))
+        self.diffs = DiffCache(os.path.join(self.asset_directory, DIFF_FILE_NAME))
+        self.references = ReferenceGraph(os.path.join(self.asset_directory, REFERENCES_FILE_NAME),
+                                         roots=(self.asset_directory, self.current_directory, self.archive_directory))
+
+        # Optional local cache for opens and imports, off unless a cache_directory is set
+        self.cache = None
+        if settings.get("cache_directory"):
+            max_bytes = int(float(settings.get("cache_max_gb", DEFAULT_MAX_GB)) * 1024 ** 3)
+            self.cache = LocalCache(settings["cache_directory"], max_bytes,
+                                    roots=(self.asset_directory, self.current_directory, self.archive_directory))
+
+    def close(self):
+        # Uploads still going stop where they are, the next publish queue picks them up again
+        if self._publish_queue:
+            self._publish_queue.close()
+        self.catalog.close()
+        self.notes_search.close()
+        self.metadata.close()
+        self.diffs.close()
+        self.references.close()
+        if self.cache:
+            self.cache.close()
+        self.storage.close()
+
+    # Paths
+
+    def project_directory(self, project_name):
+        return os.path.join(self.asset_directory, project_name)
+
+    def creature_directory(self, project_name, creature_name):
+        return os.path.join(self.asset_directory, project_name, creature_name)
+
+    def versions_directory(self, project_name, creature_name, base_name):
+        return os.path.join(self.creature_directory(project_name, creature_name), f"{base_name}_versions")
+
+    def notes_directory(self, project_name, creature_name, base_name):
+        return os.path.join(self.creature_directory(project_name, creature_name), f"{base_name}_notes")
+
+    # Listing
+
+    def projects(self):
+        return self.catalog.projects()
+
+    def creatures(self, project_name):
+        return self.catalog.creatures(project_name)
+
+    def assets(self, project_name, creature_name):
+        return self.catalog.assets(project_name, creature_name)
+
+    def versions(self, project_name, creature_name, base_name):
+        return self.catalog.versions(project_name, creature_name, base_name)
+
+    def latest_version(self, project_name, creature_name, base_name):
+        # Newest published version of an asset as a CatalogEntry, None if it has never been published
+        numbered = [(version_number(entry.name), entry) for entry in self.versions(project_name, creature_name, base_name)]
+        numbered = [(number, entry) for number, entry in numbered if number is not None]
+        if not numbered:
+            return None
+        return max(numbered, key=lambda pair: pair[0])[1]
+
+    def resolve(self, project_name, creature_name, file_name):
+        return self.catalog.resolve(project_name, creature_name, file_name)
+
+    # Batch queries, each directory is only looked at once however many lookups land in it
+
+    def resolve_many(self, requests):
+        # Resolve (project, creature, file name) tuples, returns a CatalogEntry or None for each
+        results = []
+        listings = {}
+        for project_name, creature_name, file_name in requests:
+            key = (project_name, creature_name)
+            if key not in listings:
+                listings[key] = {entry.name: entry for entry in self.assets(project_name, creature_name)}
+            entry = listings[key].get(file_name)
+            if entry is None:
+                entry = self.resolve(project_name, creature_name, file_name)
+            results.append(entry)
+        return results
+
+    def latest_versions(self, project_name, creature_names=None):
+        # Latest version of every asset in a project (or just the given creatures),
+        # as a dict of (creature name, base name) -> CatalogEntry
+        if creature_names is None:
+            creature_names = [entry.name for entry in self.creatures(project_name)]
+        latest = {}
+        for creature_name in creature_names:
+            for asset_entry in self.assets(project_name, creature_name):
+                base_name = master_base_name(asset_entry.name)
+                if base_name == asset_entry.name:
+                    continue
+                version_entry = self.latest_version(project_name, creature_name, base_name)
+                if version_entry:
+                    latest[(creature_name, base_name)] = version_entry
+        return latest
+
+    # Search index listings
+
+    def search_listing(self, key):
+        # SearchEntry for each thing in one folder of the store, key is () for the projects, (project,) for
+        # its creatures, (project, creature) for the assets and (project, creature, base name) for versions
+        if len(key) == 0:
+            return [SearchEntry('project', name, None, None, name, self.project_directory(name)) for name in self.projects()]
+        if len(key) == 1:
+            return [SearchEntry('creature', key[0], entry.name, None, entry.name, entry.path)
+                    for entry in self.creatures(key[0])]
+        if len(key) == 2:
+            return [SearchEntry('asset', key[0], key[1], master_base_name(entry.name), entry.name, entry.path)
+                    for entry in self.assets(*key)]
+        return [SearchEntry('version', key[0], key[1], key[2], entry.name, entry.path) for entry in self.versions(*key)]
+
+    def search_entries(self, key=()):
+        # Everything under key, a folder at a time so it can feed the index while it is still walking
+        for entry in self.search_listing(key):
+            yield entry
+            if entry.kind == 'project':
+                yield from self.search_entries((entry.project,))
+            elif entry.kind == 'creature':
+                yield from self.search_entries((entry.project, entry.creature))
+            elif entry.kind == 'asset' and entry.base_name != entry.name:
+                yield from self.search_entries((entry.project, entry.creature, entry.base_name))
+
+    # Notes
+
+    def notes_log(self, project_name, creature_name, base_name):
+        return NotesLog(self.notes_directory(project_name, creature_name, base_name), base_name)
+
+    def latest_note(self, project_name, creature_name, base_name):
+        # Newest note of an asset as a Note, None if it has none
+        notes_log = self.notes_log(project_name, creature_name, base_name)
+        if notes_log.exists():
+            return notes_log.latest()
+        return self._text_note(self.catalog.latest_note(project_name, creature_name, base_name))
+
+    def note_for_version(self, project_name, creature_name, base_name, version_file_name):
+        notes_log = self.notes_log(project_name, creature_name, base_name)
+        if notes_log.exists():
+            version = version_number(logical_name(version_file_name))
+            return notes_log.read(version) if version is not None else None
+        return self._text_note(self.catalog.note_for_version(project_name, creature_name, base_name, version_file_name))
+
+    def _text_note(self, note_entry):
+        # Assets that haven't been published to since the notes log came in still have a .txt per version
+        if note_entry is None:
+            return None
+        try:
+            with span('notes.read', path=note_entry.path, bytes=note_entry.size), open(note_entry.path, 'r') as note_file:
+                return Note(version_number(note_entry.name), note_entry.mtime, None, note_file.read())
+        except OSError:
+            return None
+
+    def notes_logs(self, project_name):
+        # (creature name, base name, NotesLog) for every asset in a project with notes
+        for creature_entry in self.creatures(project_name):
+            creature_path = self.catalog.relative_path(project_name, creature_entry.name)
+            for entry in self.catalog.list_directory(creature_path):
+                if entry.is_dir and entry.name.endswith('_notes'):
+                    base_name = entry.name[:-len('_notes')]
+                    yield creature_entry.name, base_name, self.notes_log(project_name, creature_entry.name, base_name)
+
+    def search_notes(self, project_name, query, limit=50):
+        # Full text search over every note in a project, the index only reads what was appended since last time
+        self.notes_search.refresh(project_name, self.notes_logs(project_name))
+        return self.notes_search.search(project_name, query, limit)
+
+    def migrate_notes(self, remove_text_files=False):
+        # Move every asset's old .txt notes into its notes log, returns how many notes were moved
+        count = 0
+        for project_name in self.projects():
+            for creature_name, base_name, notes_log in self.notes_logs(project_name):
+                count += notes_log.migrate(remove_text_files)
+        return count
+
+    # Creating
+
+    def create_project(self, project_name):
+        # Returns False if the project already exists
+        project_directory = self.project_directory(project_name)
+        if self.storage.exists(project_directory):
+            return False
+        self.storage.makedirs(project_directory)
+        return True
+
+    def create_creature(self, project_name, creature_name):
+        # Returns False if the creature already exists
+        creature_directory = self.creature_directory(project_name, creature_name)
+        if self.storage.exists(creature_directory):
+            return False
+        self.storage.makedirs(creature_directory)
+        return True
+
+    # Local cache
+
+    def published_checksum(self, file_path):
+        # Checksum the manifest recorded for a published version, None for anything else.
+        # Archived and object stored versions are looked up in the manifest of the versions folder they came from
+        if not self.storage.is_local(file_path):
+            file_path = self.object_source_path(file_path)
+        elif self.is_archived(file_path):
+            file_path = os.path.join(self.asset_directory, os.path.relpath(file_path, self.archive_directory))
+        versions_directory, file_name = os.path.split(file_path)
+        folder_name = os.path.basename(versions_directory)
+        if not folder_name.endswith('_versions'):
+            return None
+        records = AssetManifest(versions_directory, folder_name[:-len('_versions')]).versions() or []
+        for record in records:
+            if file_name in (record['file'], record.get('stored')):
+                return record.get('checksum')
+        return None
+
+    def object_path(self, file_path):
+        # Where a file in the asset directory goes in the object store
+        return self.storage.objects.url(os.path.relpath(file_path, self.asset_directory))
+
+    def object_source_path(self, object_path):
+        # The asset directory path an object stored version was published as, the inverse of object_path
+        return os.path.join(self.asset_directory, *self.storage.objects.relative_path(object_path).split('/'))
+
+    def local_path(self, file_path, checksum=None):
+        # Path maya should read file_path from, the cached copy if the cache is on. Passing the checksum
+        # (a snapshot has it) saves reading it from the manifest on the share
+        if not self.storage.is_local(file_path):
+            return self.downloaded_path(file_path, checksum=checksum)
+        if not self.cache:
+            return self.decompressed_path(file_path, checksum) if is_compressed(file_path) else file_path
         try:
-            with open(settings_file, 'r') as file:
-                settings = json.load(file)
-        except FileNotFoundError:
-            raise FileNotFoundError(f"{settings_file} not found. Please provide the settings file.")
-        except json.JSONDecodeError:
-            raise ValueError(f"Error decoding JSON from {settings_file}. Please check the file format.")
-
-        # Retrieve settings
+            with span('cache.fetch', path=file_path):
+                return self.cache.fetch(file_path, checksum or self.published_checksum(file_path))
+        except (OSError, CacheError) as e:
+            if is_compressed(file_path):
+                return self.decompressed_path(file_path, checksum)
+            print(f"Warning: Could not cache {file_path} ({e}), reading it from the share.")
+            return file_path
+
+    def decompressed_path(self, file_path, checksum=None):
+        # Without a cache compressed versions are decompressed to the temp folder, once per version
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:12]
+        local_path = os.path.join(tempfile.gettempdir(), 'baal_decompressed', key, logical_name(os.path.basename(file_path)))
+        if not os.path.exists(local_path):
+            if not os.path.exists(os.path.dirname(local_path)):
+                os.makedirs(os.path.dirname(local_path))
+            checksum = checksum or self.published_checksum(file_path)
+            with span('fs.decompress', path=file_path):
+                decompressed_checksum = decompress_file(file_path, local_path)
+            if decompressed_checksum != checksum and checksum:
+                os.remove(local_path)
+                raise ValueError(f"Decompressed {file_path} doesn't match its published checksum.")
+        return local_path
+
+    def downloaded_path(self, object_path, fetch=True, checksum=None):
+        # Object stored versions are downloaded once into the cache folder (the temp folder without one)
+        # and checked against the manifest. With fetch off, None if it hasn't been downloaded yet
+        key = hashlib.sha1(object_path.encode('utf-8')).hexdigest()[:12]
+        if self.cache:
+            root = os.path.join(self.cache.cache_directory, 'objects')
+        else:
+            root = os.path.join(tempfile.gettempdir(), 'baal_objects')
+        local_path = os.path.join(root, key, object_path.rsplit('/', 1)[-1])
+        if os.path.exists(local_path):
+            return local_path
+        if not fetch:
+            return None
+        self.storage.download(object_path, local_path)
+        checksum = checksum or self.published_checksum(object_path)
+        if checksum and file_checksum(local_path) != checksum:
+            os.remove(local_path)
+            raise StorageError(f"Downloaded {object_path} doesn't match its published checksum.")
+        return local_path
+
+    # Scene metadata
+
+    def scene_info(self, file_path):
+        # Header metadata of a scene as a SceneInfo, None if the file can't be read. Object stored versions
+        # are only read once they have been downloaded
+        if not self.storage.is_local(file_path):
+            file_path = self.downloaded_path(file_path, fetch=False)
+            if file_path is None:
+                return None
         try:
-            self.asset_directory = settings["asset_directory"]
-            self.current_directory = settings["current_directory"]
-            self.archive_directory = settings["archive_directory"]
-            window_icon_path = settings["window_icon"]
-        except KeyError as e:
-            raise KeyError(f"Missing key in {settings_file}: {e}. Please ensure all required settings are provided.")
-
-        self.setWindowFlags(self.windowFlags() | QtCore.Qt.WindowMinimizeButtonHint)
-        self.setWindowIcon(QtGui.QIcon(window_icon_path))
-        self.setWindowTitle("Baal Browser")
-        self.setMinimumWidth(800)
-        self.setMinimumHeight(400)
-
-        # Main layout
-        main_layout = QtWidgets.QVBoxLayout(self)
-        self.setLayout(main_layout)
-
-        # Add tabs
-        self.tabs = QtWidgets.QTabWidget(self)
-        main_layout.addWidget(self.tabs)
-
-        # Create tabs
-        self.create_assets_tab()
-        self.create_simple_browser_tab("Current", self.current_directory)
-        self.create_simple_browser_tab("Archives", self.archive_directory)
-
-        # Importer line edit
-        self.importer_line_edit = QtWidgets.QLineEdit(self)
-        main_layout.addWidget(self.importer_line_edit)
-
-        # Load initial project
-        self.populate_projects()
-        if self.project_selector.count() > 0:
-            self.update_directory()
-
-    def create_assets_tab(self):
-        tab_widget = QtWidgets.QWidget(self)
-        tab_layout = QtWidgets.QVBoxLayout(tab_widget)
-
-        # Project selector and buttons layout
-        project_layout = QtWidgets.QHBoxLayout()
-        tab_layout.addLayout(project_layout)
-
-        # Project selector
-        self.project_selector = QtWidgets.QComboBox(self)
-        self.project_selector.setStyleSheet("background-color: rgb(42, 46, 50);")
-        self.project_selector.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Preferred)
-        project_layout.addWidget(self.project_selector)
-
-        # Add a "+" button with a menu
-        self.plus_button = QtWidgets.QPushButton("+", self)
-        self.plus_button.setMaximumWidth(50)
-        project_layout.addWidget(self.plus_button)
-
-        self.plus_menu = QtWidgets.QMenu(self)
-        self.add_project_action = self.plus_menu.addAction("Add New Project")
-        self.add_creature_action = self.plus_menu.addAction("Add New Creature")
-        self.plus_button.setMenu(self.plus_menu)
-
-        # Splitter for the main sections
-        main_splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
-        tab_layout.addWidget(main_splitter)
-
-        # Splitter for the file and folder sections
-        top_splitter = QtWidgets.QSplitter(QtCore.Qt.Horizontal)
-        main_splitter.addWidget(top_splitter)
-
-        # Folder list
-        folder_list_widget = QtWidgets.QWidget(self)
-        folder_list_layout = QtWidgets.QVBoxLayout(folder_list_widget)
-        folder_label = QtWidgets.QLabel('Creature Name', self)
-        folder_list_layout.addWidget(folder_label)
-        self.folder_list = QtWidgets.QListWidget(self)
-        self.folder_list.setStyleSheet("background-color: rgb(37, 37, 37);")
-        folder_list_layout.addWidget(self.folder_list)
-        top_splitter.addWidget(folder_list_widget)
-
-        # File list
-        file_list_widget = QtWidgets.QWidget(self)
-        file_list_layout = QtWidgets.QVBoxLayout(file_list_widget)
-        file_label = QtWidgets.QLabel('Creature Asset', self)
-        file_list_layout.addWidget(file_label)
-        self.file_list = QtWidgets.QListWidget(self)
-        self.file_list.setStyleSheet("background-color: rgb(37, 37, 37);")
-        file_list_layout.addWidget(self.file_list)
-        top_splitter.addWidget(file_list_widget)
-
-        # Versions list
-        versions_list_widget = QtWidgets.QWidget(self)
-        versions_list_layout = QtWidgets.QVBoxLayout(versions_list_widget)
-        versions_label = QtWidgets.QLabel('Versions', self)
-        versions_list_layout.addWidget(versions_label)
-        self.versions_list = QtWidgets.QListWidget(self)
-        self.versions_list.setStyleSheet("background-color: rgb(37, 37, 37);")
-        versions_list_layout.addWidget(self.versions_list)
-        top_splitter.addWidget(versions_list_widget)
-
-        # Notes editor
-        notes_widget = QtWidgets.QWidget(self)
-        notes_layout = QtWidgets.QVBoxLayout(notes_widget)
-        notes_label = QtWidgets.QLabel('Notes', self)
-        notes_layout.addWidget(notes_label)
-        self.notes_editor = QtWidgets.QTextEdit(self)
-        self.notes_editor.setStyleSheet("background-color: rgb(37, 37, 37);")
-        self.notes_editor.setReadOnly(True)
-        notes_layout.addWidget(self.notes_editor)
-        main_splitter.addWidget(notes_widget)
-
-        # New elements section
-        new_elements_widget = QtWidgets.QWidget(self)
-        self.new_elements_layout = QtWidgets.QVBoxLayout(new_elements_widget)
-        self.setup_new_elements(self.new_elements_layout)
-        main_splitter.addWidget(new_elements_widget)
-
-        self.tabs.addTab(tab_widget, "Assets")
-
-        # Set connections
-        self.project_selector.currentIndexChanged.connect(self.update_directory)
-        self.add_project_action.triggered.connect(self.add_new_project)
-        self.add_creature_action.triggered.connect(self.add_new_creature)
-        self.folder_list.itemClicked.connect(self.on_folder_selected)
-        self.file_list.itemClicked.connect(self.on_file_selected)
-        self.versions_list.itemClicked.connect(self.on_version_selected)
-        self.publish_button.clicked.connect(self.on_publish_clicked)
-        self.open_button.clicked.connect(self.on_open_clicked)
-        self.import_button.clicked.connect(self.on_import_clicked)
-        self.file_list.itemDoubleClicked.connect(self.on_file_double_clicked)
-        self.versions_list.itemDoubleClicked.connect(self.on_version_double_clicked)
-
-    def create_simple_browser_tab(self, tab_name, directory):
-        tab_widget = QtWidgets.QWidget(self)
-        tab_layout = QtWidgets.QVBoxLayout(tab_widget)
-
-        # Directory browser
-        dir_model = QtWidgets.QFileSystemModel()
-        dir_model.setRootPath(directory)
-        dir_model.setFilter(QtCore.QDir.AllDirs | QtCore.QDir.NoDotAndDotDot)
-
-        dir_view = QtWidgets.QTreeView()
-        dir_view.setModel(dir_model)
-        dir_view.setRootIndex(dir_model.index(directory))
-        dir_view.setColumnWidth(0, 250)
-        dir_view.clicked.connect(lambda index, d=directory: self.on_directory_clicked(index, d, file_list))
-        tab_layout.addWidget(dir_view)
-
-        # File list
-        file_list = QtWidgets.QListWidget(self)
-        file_list.setStyleSheet("background-color: rgb(37, 37, 37);")
-        file_list.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
-        file_list.customContextMenuRequested.connect(self.on_file_context_menu)
-        file_list.itemDoubleClicked.connect(self.on_file_double_clicked)
-        tab_layout.addWidget(file_list)
-
-        # Open and Import buttons
-        button_layout = QtWidgets.QHBoxLayout()
-        open_button = QtWidgets.QPushButton("Open")
-        open_button.clicked.connect(lambda: self.open_file(file_list.currentItem()))
-        import_button = QtWidgets.QPushButton("Import")
-        import_button.clicked.connect(lambda: self.import_file(file_list.currentItem()))
-        button_layout.addWidget(open_button)
-        button_layout.addWidget(import_button)
-        tab_layout.addLayout(button_layout)
-
-        self.tabs.addTab(tab_widget, tab_name)
-
-    def on_directory_clicked(self, index, base_path, file_list):
-        dir_model = index.model()
-        folder_path = dir_model.filePath(index)
-
-        file_list.clear()
-        if os.path.exists(folder_path):
-            files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-            for file in files:
-                if file.endswith(('.ma', '.mb', '.obj')):
-                    item = QtWidgets.QListWidgetItem(file)
-                    file_path = os.path.join(folder_path, file)
-                    item.setData(QtCore.Qt.UserRole, file_path)
-                    file_list.addItem(item)
-
-    def on_file_context_menu(self, position):
-        file_list = self.sender()
-        menu = QtWidgets.QMenu()
-
-        open_action = menu.addAction("Open")
-        import_action = menu.addAction("Import")
-
-        open_action.triggered.connect(lambda: self.open_file(file_list.currentItem()))
-        import_action.triggered.connect(lambda: self.import_file(file_list.currentItem()))
-
-        menu.exec_(file_list.mapToGlobal(position))
-
-    def on_file_double_clicked(self, item):
-        self.open_file(item)
-
-    def open_file(self, item):
-        if item:
-            file_path = item.data(QtCore.Qt.UserRole)
-            if file_path.endswith(('.ma', '.mb')):
-                cmds.file(file_path, o=True, f=True)
-                QtWidgets.QMessageBox.information(self, 'Open', f'{file_path} opened successfully.')
-
-    def import_file(self, item):
-        if item:
-            file_path = item.data(QtCore.Qt.UserRole)
-            if file_path.endswith(('.ma', '.mb', '.obj')):
-                cmds.file(file_path, i=True)
-                QtWidgets.QMessageBox.information(self, 'Import', f'{file_path} imported successfully.')
-
-    def populate_projects(self):
-        self.project_selector.clear()
-        if os.path.exists(self.asset_directory):
-            projects = [f for f in os.listdir(self.asset_directory) if os.path.isdir(os.path.join(self.asset_directory, f))]
-            self.project_selector.addItems(projects)
-
-    def setup_new_elements(self, layout):
-        self.text_box = QtWidgets.QLineEdit(self)
-        layout.addWidget(self.text_box)
-        self.file_type_checkbox = QtWidgets.QCheckBox('.mb', self)
-        self.file_type_checkbox.setChecked(True)
-        layout.addWidget(self.file_type_checkbox)
-
-        buttons_layout = QtWidgets.QHBoxLayout()
-
-        self.publish_button = QtWidgets.QPushButton('Publish', self)
-        self.publish_button.setStyleSheet("background-color: rgb(33, 157, 208);")
-        buttons_layout.addWidget(self.publish_button)
-
-        self.open_button = QtWidgets.QPushButton('Open', self)
-        buttons_layout.addWidget(self.open_button)
-
-        self.import_button = QtWidgets.QPushButton('Import', self)
-        buttons_layout.addWidget(self.import_button)
-
-        layout.addLayout(buttons_layout)
-
-        self.new_notes_label = QtWidgets.QLabel('New Notes', self)
-        layout.addWidget(self.new_notes_label)
-        self.new_notes_editor = QtWidgets.QTextEdit(self)
-        self.new_notes_editor.setText('No new notes set by user, how lazy...')
-        layout.addWidget(self.new_notes_editor)
-
-    def save_version(self, creature_name, base_name, notes, save_as_binary=False):
-        creature_directory = os.path.join(self.directory, creature_name)
-        version_directory = os.path.join(creature_directory, f"{base_name}_versions")
-        notes_directory = os.path.join(creature_directory, f"{base_name}_notes")
-
-        if not os.path.exists(version_directory):
-            os.makedirs(version_directory)
-        if not os.path.exists(notes_directory):
-            os.makedirs(notes_directory)
+            try:
+                return self.metadata.get(file_path)
+            except sqlite3.Error as e:
+                # The cache is on the share and can be locked or read only, the header itself is still there
+                print(f"Warning: Metadata cache unavailable ({e}), reading {file_path} directly.")
+                return read_scene_info(file_path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Warning: Could not read the header of {file_path} ({e}).")
+            return None
+
+    # Version diffs
+
+    def version_summary(self, file_path):
+        # Block hashes of a published .ma version, cached by its checksum. Object stored versions are only
+        # downloaded when they haven't been summarized before
+        checksum = self.published_checksum(file_path)
+        summary = self.diffs.lookup(checksum) if checksum else None
+        if summary is None:
+            if not self.storage.is_local(file_path):
+                file_path = self.downloaded_path(file_path, checksum=checksum)
+            summary = self.diffs.summary(file_path, checksum)
+        return summary
+
+    def diff_versions(self, old_path, new_path):
+        # Nodes and connections added, removed or modified between two .ma versions as a DiffResult
+        return diff_summaries(self.version_summary(old_path), self.version_summary(new_path), old_path, new_path)
+
+    # References
+
+    def update_references(self, directories=None):
+        # Re-read any scene that changed, everywhere or just in the given folders (not below them).
+        # Yields a count per batch, run it from a background load
+        if directories is None:
+            return self.references.update()
+        return self.references.update(directories, recursive=False)
+
+    def uses(self, file_path):
+        return self.references.uses(file_path)
+
+    def used_by(self, file_path):
+        return self.references.used_by(file_path)
+
+    def affected_by(self, file_path):
+        return self.references.affected_by(file_path)
+
+    # Compression
+
+    def compress_versions(self, project_name, creature_name, base_name, dry_run=False):
+        # Compress an asset's old versions according to the settings policy, nothing happens without one
+        if not self.compression_policy:
+            return []
+        manifest = AssetManifest(self.versions_directory(project_name, creature_name, base_name), base_name)
+        return compress_versions(manifest, self.compression_policy, dry_run)
+
+    # Retention
+
+    def is_archived(self, file_path):
+        # True for anything under the archive directory, archived versions are listed with their path there
+        if not self.archive_directory or not self.storage.is_local(file_path):
+            return False
+        archive_directory = os.path.join(os.path.normcase(os.path.abspath(self.archive_directory)), '')
+        return os.path.normcase(os.path.abspath(file_path)).startswith(archive_directory)
+
+    def apply_retention(self, project_name=None, creature_name=None, base_name=None, dry_run=False):
+        # Move the versions the settings policy picks to the archive, for one asset or the whole store.
+        # Returns a RetentionResult per version moved (or that would be), nothing happens without a policy
+        if not self.retention_policy:
+            return []
+        if base_name:
+            manifests = [AssetManifest(self.versions_directory(project_name, creature_name, base_name), base_name)]
+        else:
+            manifests = asset_manifests(self.project_directory(project_name) if project_name else self.asset_directory)
+        results = apply_retention(manifests, self.asset_directory, self.archive_directory, self.retention_policy, dry_run)
+        if not dry_run:
+            for result in results:
+                self.catalog.invalidate(os.path.relpath(result.versions_directory, self.asset_directory))
+        return results
+
+    def restore_version(self, project_name, creature_name, base_name, version_file_name):
+        # Bring an archived version back into its versions folder, returns its path there
+        versions_directory = self.versions_directory(project_name, creature_name, base_name)
+        restored_path = restore_version(AssetManifest(versions_directory, base_name), version_file_name,
+                                        self.archive_directory)
+        self.catalog.invalidate(project_name, creature_name, f"{base_name}_versions")
+        return restored_path
+
+    # Snapshots
+
+    def export_snapshot(self, project_name, creature_names=None, base_names=None):
+        # Pin the current version of every master in a project (or the given creatures or base names),
+        # write it out with asset_snapshot.write_snapshot and hand it to stone_importer
+        return export_snapshot(self, project_name, creature_names, base_names)
+
+    # Maya
+
+    def custom_namespaces(self):
+        namespaces = maya_cmds().namespaceInfo(listOnlyNamespaces=True) or []
+        return [namespace for namespace in namespaces if namespace not in DEFAULT_NAMESPACES]
+
+    def open_file(self, file_path):
+        cmds = maya_cmds()
+        local_path = self.local_path(file_path)
+        cmds.file(local_path, o=True, f=True)
+        # A save goes back to the share like it did before the cache, never into the cached or decompressed
+        # copy the scene was opened from, later opens would be served the local edit
+        scene_path = file_path if self.storage.is_local(file_path) else self.object_source_path(file_path)
+        scene_path = os.path.join(os.path.dirname(scene_path), logical_name(os.path.basename(scene_path)))
+        if local_path != scene_path:
+            cmds.file(rename=scene_path)
+
+    def import_file(self, file_path):
+        maya_cmds().file(self.local_path(file_path), i=True)
+
+    def swap_master(self, temp_master_path, master_file_path, version_thumbnail_path=None):
+        # Put a new master in place, its thumbnail goes first so nobody sees the new master with the old one.
+        # Called under the publish lock when the version being committed is the latest
+        master_thumbnail_path = thumbnail_path(master_file_path)
+        if version_thumbnail_path:
+            atomic_copy(version_thumbnail_path, master_thumbnail_path, 'copy')
+        elif os.path.exists(master_thumbnail_path):
+            os.remove(master_thumbnail_path)
+        replace_file(temp_master_path, master_file_path)
+
+    def publish_queue(self):
+        # The background uploads of "queued" publishes, started the first time something is queued
+        if self._publish_queue is None:
+            self._publish_queue = PublishQueue(self, self.staging_directory,
+                                               self.settings.get("upload_workers", DEFAULT_UPLOAD_WORKERS))
+        return self._publish_queue
+
+    def queue_publish(self, project_name, creature_name, base_name, notes, save_as_binary=False):
+        # Save the open scene to local staging and queue it for upload, returns the job id straight away
+        cmds = maya_cmds()
+        with span('store.stage_publish', path=self.staging_directory):
+            job_directory = stage_publish(cmds, self.staging_directory, project_name, creature_name, base_name, notes,
+                                          save_as_binary, self.capture_thumbnails)
+        # Leave the scene pointing at the master like a normal publish
+        file_extension = ".mb" if save_as_binary else ".ma"
+        cmds.file(rename=os.path.join(self.creature_directory(project_name, creature_name),
+                                      f"{base_name}_master{file_extension}"))
+        return self.publish_queue().submit(job_directory)
+
+    def publish(self, project_name, creature_name, base_name, notes, save_as_binary=False):
+        # Save the open scene as the next version of an asset, update its master and write its notes
+        with span('store.publish', path=self.versions_directory(project_name, creature_name, base_name)):
+            return self._publish(project_name, creature_name, base_name, notes, save_as_binary)
+
+    def _publish(self, project_name, creature_name, base_name, notes, save_as_binary):
+        cmds = maya_cmds()
+        creature_directory = self.creature_directory(project_name, creature_name)
+        version_directory = self.versions_directory(project_name, creature_name, base_name)
+
+        if not self.storage.exists(version_directory):
+            self.storage.makedirs(version_directory)
 
         file_extension = ".mb" if save_as_binary else ".ma"
-        latest_version = 0
-        for file_name in os.listdir(version_directory):
-            if file_name.startswith(base_name) and file_name.endswith(file_extension):
-                try:
-                    version = int(file_name.split('_v')[-1].split(file_extension)[0])
-                    if version > latest_version:
-                        latest_version = version
-                except ValueError:
-                    pass
-
-        new_version = latest_version + 1
-        new_file_name = f"{base_name}_v{new_version:04d}{file_extension}"
+
+        # Version numbers come from the asset's manifest under a lock, so two artists publishing
+        # at once can't both grab the same one
+        manifest = AssetManifest(version_directory, base_name)
+        with span('manifest.allocate', path=manifest.path):
+            new_version = manifest.allocate_version()
+        new_file_name = version_file_name(base_name, new_version, file_extension)
         new_file_path = os.path.join(version_directory, new_file_name)
 
-        cmds.file(rename=new_file_path)
-        cmds.file(save=True, type='mayaBinary' if save_as_binary else 'mayaAscii')
+        # Thumbnail first, it's of the scene as the artist sees it right now
+        version_thumbnail_path = thumbnail_path(new_file_path)
+        if not self.capture_thumbnails or not capture_thumbnail(cmds, version_thumbnail_path):
+            version_thumbnail_path = None
+
+        file_type = 'mayaBinary' if save_as_binary else 'mayaAscii'
+        extra = None
+        # The saved scene on the share, what the master is copied from
+        saved_path = new_file_path
+        # Temp save of an object stored version, removed once the master has been built from it
+        upload_path = None
+        if self.version_storage == "blobs":
+            # Save next to the blobs, hash it into the store and link the version to the blob,
+            # an unchanged republish finds its blob already there and stores nothing new
+            staging_path = self.blobs.staging_path(file_extension)
+            cmds.file(rename=staging_path)
+            cmds.file(save=True, type=file_type)
+            checksum, blob_path, is_new = self.blobs.ingest(staging_path)
+            link = self.blobs.expose(checksum, new_file_path)
+            extra = {'blob': checksum, 'link': link}
+            if link == 'manifest':
+                new_file_path = saved_path = blob_path
+            if not is_new:
+                print(f"{new_file_name} is identical to an earlier publish, no new data stored")
+        elif self.version_storage == "objects":
+            # Saved under a temp name in the versions folder, uploaded, then kept only until the master is built
+            upload_path = saved_path = temp_path_for(new_file_path)
+            cmds.file(rename=upload_path)
+            cmds.file(save=True, type=file_type)
+            checksum = file_checksum(upload_path)
+            new_file_path = self.object_path(new_file_path)
+            self.storage.upload(upload_path, new_file_path)
+            extra = {'object': new_file_path}
+        else:
+            cmds.file(rename=new_file_path)
+            cmds.file(save=True, type=file_type)
+            checksum = file_checksum(new_file_path)
+
+        # Notes are appended to the asset's notes log, older .txt notes get moved in the first time
+        notes_log = self.notes_log(project_name, creature_name, base_name)
+        notes_log.append(new_version, notes)
 
         master_file_name = f"{base_name}_master{file_extension}"
         master_file_path = os.path.join(creature_directory, master_file_name)
 
-        # Overwrite the master file if it exists
-        if os.path.exists(master_file_path):
-            os.remove(master_file_path)
-
+        # The master is built under a temp name and swapped in with a rename so there's never a moment
+        # where it's missing, and only if nobody published a newer version while we were saving
+        temp_master_path = temp_path_for(master_file_path)
+        if self.publish_mode != "double_save":
+            # fast_copy records the method it used on its fs.copy span
+            fast_copy(saved_path, temp_master_path, self.master_copy_method)
+        else:
+            cmds.file(rename=temp_master_path)
+            cmds.file(save=True, type=file_type)
+
+        def promote():
+            self.swap_master(temp_master_path, master_file_path, version_thumbnail_path)
+
+        with span('manifest.commit', path=manifest.path):
+            is_latest = manifest.commit_version(new_version, new_file_name, file_type, checksum,
+                                                os.path.getsize(saved_path), NOTES_LOG_FILE_NAME,
+                                                promote=promote, extra=extra)
+        if upload_path:
+            os.remove(upload_path)
+        if not is_latest:
+            os.remove(temp_master_path)
+            print(f"Warning: A newer version of {base_name} was published meanwhile, {master_file_path} left as it was.")
+
+        # Leave the scene pointing at the master like it always has
         cmds.file(rename=master_file_path)
-        cmds.file(save=True, type='mayaBinary' if save_as_binary else 'mayaAscii')
-
-        notes_file_name = f"{base_name}_v{new_version:04d}.txt"
-        notes_file_path = os.path.join(notes_directory, notes_file_name)
-        with open(notes_file_path, 'w') as notes_file:
-            notes_file.write(notes)
-
-        print(f"Saved: {new_file_path}, {master_file_path}, {notes_file_path}")
-
-        # Update UI after saving
-        self.update_directory()
-
-    def update_directory(self):
-        selected_project = self.project_selector.currentText()
-        self.directory = os.path.join(self.asset_directory, selected_project)
-        self.folder_path = os.path.join(self.asset_directory, selected_project)
-
-        self.project_name = os.path.basename(self.directory)
-        self.file_list.clear()
-        self.versions_list.clear()
-        self.notes_editor.clear()
-        self.text_box.clear()
-        self.importer_line_edit.clear()
-        self.populate_folders()
-
-    def add_new_project(self):
-        project_name, ok = QtWidgets.QInputDialog.getText(self, 'Add New Project', 'Enter new project name:')
-        if ok and project_name:
-            new_project_path = os.path.join(self.asset_directory, project_name)
-            if not os.path.exists(new_project_path):
-                os.makedirs(new_project_path)
-                self.populate_projects()
-                self.project_selector.setCurrentText(project_name)
-                QtWidgets.QMessageBox.information(self, 'Success', f'New project "{project_name}" added successfully.')
-            else:
-                QtWidgets.QMessageBox.warning(self, 'Warning', f'Project "{project_name}" already exists.')
-
-    def add_new_creature(self):
-        creature_name, ok = QtWidgets.QInputDialog.getText(self, 'Add New Creature', 'Enter new creature name:')
-        if ok and creature_name:
-            new_folder_path = os.path.join(self.directory, creature_name)
-            if not os.path.exists(new_folder_path):
-                os.makedirs(new_folder_path)
-                self.populate_folders()
-                QtWidgets.QMessageBox.information(self, 'Success', f'New creature "{creature_name}" added successfully.')
-            else:
-                QtWidgets.QMessageBox.warning(self, 'Warning', f'Creature "{creature_name}" already exists.')
-
-    def on_version_double_clicked(self, item):
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        base_name = self.text_box.text()
-        selected_folder = os.path.join(self.folder_path, selected_folder_item.text(), f"{base_name}_versions")
-        file_path = os.path.join(selected_folder, item.text())
-        if not os.path.exists(file_path):
-            return
-        reply = QtWidgets.QMessageBox.question(self, 'Open', f'Are you sure you wish to open {item.text()}?',
-                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                               QtWidgets.QMessageBox.No)
-        if reply == QtWidgets.QMessageBox.Yes:
-            cmds.file(file_path, o=True, f=True)
-
-    def on_file_double_clicked(self, item):
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        selected_folder = os.path.join(self.folder_path, selected_folder_item.text())
-        file_path = os.path.join(selected_folder, item.text())
-        if not os.path.exists(file_path):
-            return
-        reply = QtWidgets.QMessageBox.question(self, 'Open', f'Are you sure you wish to open {item.text()}?',
-                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                               QtWidgets.QMessageBox.No)
-        if reply == QtWidgets.QMessageBox.Yes:
-            cmds.file(file_path, o=True, f=True)
-
-    def populate_folders(self):
-        self.folder_list.clear()
-        if os.path.exists(self.folder_path):
-            folders = [f for f in os.listdir(self.folder_path) if os.path.isdir(os.path.join(self.folder_path, f))]
-            self.folder_list.addItems(folders)
-
-    def populate_files(self):
-        self.file_list.clear()
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        selected_folder = os.path.join(self.folder_path, selected_folder_item.text())
-        files = [f for f in os.listdir(selected_folder) if os.path.isfile(os.path.join(selected_folder, f)) and f.endswith(('.ma', '.mb'))]
-        for file in files:
-            item = QtWidgets.QListWidgetItem(file)
-            file_path = os.path.join(selected_folder, file)
-            item.setData(QtCore.Qt.UserRole, file_path)
-            self.file_list.addItem(item)
-
-    def populate_versions(self, base_name):
-        self.versions_list.clear()
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        selected_folder = os.path.join(self.folder_path, selected_folder_item.text(), f"{base_name}_versions")
-        if not os.path.exists(selected_folder):
-            return
-        versions = [f for f in os.listdir(selected_folder) if os.path.isfile(os.path.join(selected_folder, f)) and f.endswith(('.ma', '.mb'))]
-        for version in versions:
-            item = QtWidgets.QListWidgetItem(version)
-            file_path = os.path.join(selected_folder, version)
-            item.setData(QtCore.Qt.UserRole, file_path)
-            self.versions_list.addItem(item)
-
-    def populate_notes(self, base_name):
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        selected_folder = os.path.join(self.folder_path, selected_folder_item.text(), f"{base_name}_notes")
-        if not os.path.exists(selected_folder):
-            return
-        notes_files = [f for f in os.listdir(selected_folder) if f.endswith('.txt')]
-        if not notes_files:
-            return
-        latest_note_file = max(notes_files, key=lambda f: int(f.split('_v')[-1].split('.txt')[0]))
-        note_file_path = os.path.join(selected_folder, latest_note_file)
-        if not os.path.exists(note_file_path):
-            return
-        with open(note_file_path, 'r') as note_file:
-            notes_content = note_file.read()
-            creation_time = os.path.getctime(note_file_path)
-            creation_date = datetime.fromtimestamp(creation_time).strftime("%d-%m-%Y %H:%M:%S")
-            self.notes_editor.setText(f"Created on: {creation_date}\n\n{notes_content}")
-
-    def on_folder_selected(self, item):
-        self.file_list.clear()
-        self.versions_list.clear()
-        self.notes_editor.clear()
-        self.text_box.clear()
-        self.populate_files()
-        self.update_importer_line()
-
-    def on_file_selected(self, item):
-        self.versions_list.clear()
-        self.notes_editor.clear()
-        base_name = item.text().replace('_master.ma', '').replace('_master.mb', '')
-        self.text_box.setText(base_name)
-        self.populate_versions(base_name)
-        self.populate_notes(base_name)
-        self.update_importer_line()
-
-    def on_version_selected(self, item):
-        self.notes_editor.clear()
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        base_name = self.text_box.text()
-        selected_folder = os.path.join(self.folder_path, selected_folder_item.text(), f"{base_name}_notes")
-        if not os.path.exists(selected_folder):
-            return
-        note_file_name = item.text().replace('.ma', '.txt').replace('.mb', '.txt')
-        note_file_path = os.path.join(selected_folder, note_file_name)
-        if not os.path.exists(note_file_path):
-            return
 
-        with open(note_file_path, 'r') as note_file:
-            notes_content = note_file.read()
-            creation_time = os.path.getctime(note_file_path)
-            creation_date = QtCore.QDateTime.fromSecsSinceEpoch(creation_time).toString("dd MMM yyyy hh:mm:ss")
-            self.notes_editor.setText(f"Created on: {creation_date}\n\n{notes_content}")
-        self.update_importer_line()
-
-    def update_importer_line(self):
-        selected_folder_item = self.folder_list.currentItem()
-        selected_file_item = self.file_list.currentItem() or self.versions_list.currentItem()
-        if not selected_folder_item or not selected_file_item:
-            self.importer_line_edit.clear()
-            return
-        project_name = self.project_name
-        creature_name = selected_folder_item.text()
-        file_name = selected_file_item.text()
-        frame_rate = '24'
-        importer_line = f"stone_importer('{project_name}', '{creature_name}', '{file_name}', '{frame_rate}')"
-        self.importer_line_edit.setText(importer_line)
-
-    def on_publish_clicked(self):
-        creature_name_item = self.folder_list.currentItem()
-        if not creature_name_item:
-            QtWidgets.QMessageBox.warning(self, 'Warning', 'Please select a creature.')
-            return
-        namespaces = cmds.namespaceInfo(listOnlyNamespaces=True)
-        default_namespaces = ['UI', 'shared']
-        custom_namespaces = [namespace for namespace in namespaces if namespace not in default_namespaces]
-        if custom_namespaces:
-            reply = QtWidgets.QMessageBox.warning(self, 'Warning',
-                                                  'There are namespaces in the scene, messy!\nContinue?',
-                                                  QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                                  QtWidgets.QMessageBox.No)
-            if reply == QtWidgets.QMessageBox.No:
-                return
-        creature_name = creature_name_item.text()
-        base_name = self.text_box.text().strip()
-        if not base_name or base_name == "_master":
-            QtWidgets.QMessageBox.warning(self, 'Warning', 'Please add a file name.')
-            return
-        notes = self.new_notes_editor.toPlainText()
-        save_as_binary = self.file_type_checkbox.isChecked()
-        reply = QtWidgets.QMessageBox.question(self, 'Publish', 'Are you sure you wish to save?',
-                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                               QtWidgets.QMessageBox.No)
-        if reply == QtWidgets.QMessageBox.Yes:
-            self.save_version(creature_name, base_name, notes, save_as_binary)
-
-    def on_open_clicked(self):
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        base_name = self.text_box.text()
-        selected_version_item = self.versions_list.currentItem()
-        if selected_version_item:
-            directory = os.path.join(self.folder_path, selected_folder_item.text(), f"{base_name}_versions")
-            file_path = os.path.join(directory, selected_version_item.text())
-        else:
-            selected_file_item = self.file_list.currentItem()
-            if not selected_file_item:
-                return
-            directory = os.path.join(self.folder_path, selected_folder_item.text())
-            file_path = os.path.join(directory, selected_file_item.text())
-        if not os.path.exists(file_path):
-            return
-        reply = QtWidgets.QMessageBox.question(self, 'Open', f'Are you sure you wish to open {os.path.basename(file_path)}?',
-                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                               QtWidgets.QMessageBox.No)
-        if reply == QtWidgets.QMessageBox.Yes:
-            cmds.file(file_path, o=True, f=True)
-
-    def on_import_clicked(self):
-        selected_folder_item = self.folder_list.currentItem()
-        if not selected_folder_item:
-            return
-        base_name = self.text_box.text()
-        selected_version_item = self.versions_list.currentItem()
-        if selected_version_item:
-            directory = os.path.join(self.folder_path, selected_folder_item.text(), f"{base_name}_versions")
-            file_path = os.path.join(directory, selected_version_item.text())
-        else:
-            selected_file_item = self.file_list.currentItem()
-            if not selected_file_item:
-                return
-            directory = os.path.join(self.folder_path, selected_folder_item.text())
-            file_path = os.path.join(directory, selected_file_item.text())
-        if not os.path.exists(file_path):
+        print(f"Saved: {new_file_path}, {master_file_path}, {notes_log.log_path}")
+
+        # Make sure the catalog picks the new files up straight away
+        self.catalog.invalidate(project_name, creature_name)
+        self.catalog.invalidate(project_name, creature_name, f"{base_name}_versions")
+        self.catalog.invalidate(project_name, creature_name, f"{base_name}_notes")
+
+        return PublishResult(new_version, new_file_path, master_file_path, notes_log.log_path, is_latest,
+                             version_thumbnail_path)
+
+
+def stone_importer(project_name, folder_name, maya_file, force_frame_rate, new_scene=True, store=None, snapshot=None):
+    # snapshot (a path or Snapshot, else BAAL_SNAPSHOT or "snapshot" in settings) pins what maya_file resolves to
+    store = store or AssetStore()
+    with span('stone_importer', path=maya_file):
+        _stone_import(store, project_name, folder_name, maya_file, force_frame_rate, new_scene, snapshot)
+
+
+def _stone_import(store, project_name, folder_name, maya_file, force_frame_rate, new_scene, snapshot=None):
+    # A pinned file needs nothing from the share but the file itself, anything else is looked up as usual
+    snapshot = active_snapshot(store, snapshot)
+    pin = snapshot.resolve(project_name, folder_name, maya_file) if snapshot else None
+    if pin:
+        file_path, checksum = pin.path, pin.checksum
+    else:
+        if snapshot:
+            print(f"Warning: {maya_file} isn't pinned in {snapshot.path}, importing the current one from the store.")
+        entry = store.resolve(project_name, folder_name, maya_file)
+        if not entry:
+            print(f"File not found: {os.path.join(store.asset_directory, project_name, folder_name, maya_file)}")
             return
-        reply = QtWidgets.QMessageBox.question(self, 'Import', f'Are you sure you wish to Import {os.path.basename(file_path)}?',
-                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                               QtWidgets.QMessageBox.No)
-        if reply == QtWidgets.QMessageBox.Yes:
-            cmds.file(file_path, i=True)
-
-
-def stone_importer(project_name, folder_name, maya_file, force_frame_rate, new_scene=True):
-    base_dir = self.asset_directory
-    full_path = os.path.join(base_dir, project_name, folder_name, maya_file)
-    if not os.path.exists(full_path):
-        print(f"File not found: {full_path}")
-        return
+        file_path, checksum = entry.path, None
+    # Through the store's storage, object stored versions are downloaded here
+    local_path = store.local_path(file_path, checksum)
+    if force_frame_rate:
+        # The header says what the file was animated at, worth a warning before keys land on the wrong frames.
+        # The rate asked for is a number or one of maya's time units, anything else isn't compared
+        requested_rate = frame_rate(str(force_frame_rate)) or frame_rate(f"{force_frame_rate}fps")
+        info = store.scene_info(local_path) if requested_rate else None
+        if info and info.frame_rate and abs(info.frame_rate - requested_rate) > 0.001:
+            print(f"Warning: {maya_file} was saved at {info.frame_rate:g} fps ({info.time_unit}), "
+                  f"importing it at {requested_rate:g} fps.")
+    cmds = maya_cmds()
     if new_scene:
         cmds.file(new=True, force=True)
-    cmds.file(full_path, i=True)
+    cmds.file(local_path, i=True)
     if force_frame_rate:
         frame_rate_str = str(force_frame_rate) + "fps"
-        valid_frame_rates = ["game", "film", "pal", "ntsc", "show", "palf", "ntscf", "23.976fps", "29.97fps", "59.94fps",
-                             "48fps", "30fps", "25fps", "24fps"]
-        if frame_rate_str in valid_frame_rates:
+        if frame_rate_str in VALID_FRAME_RATES:
             cmds.currentUnit(time=frame_rate_str)
         else:
             print(f"Warning: Invalid frame rate {force_frame_rate}. Skipping frame rate setting.")
@@ -599,9 +730,13 @@ def stone_importer(project_name, folder_name, maya_file, force_frame_rate, new_s
 
 def show_ui():
     global folder_browser_ui
+    # Timed from here so the startup report includes importing Qt and the browser
+    started = time.perf_counter()
+    from PySide2 import QtWidgets
+    from asset_browser import FolderBrowserUI
     try:
         folder_browser_ui.close()
     except NameError:
         pass
-    folder_browser_ui = FolderBrowserUI(parent=QtWidgets.QApplication.activeWindow())
+    folder_browser_ui = FolderBrowserUI(parent=QtWidgets.QApplication.activeWindow(), started=started)
     folder_browser_ui.show()
@@ -0,0 +1,56 @@
+"""
+asset_thumbnails.py
+
+Publish thumbnails for the asset store
+
+- each publish playblasts the current frame of the viewport to a small jpg saved next to the version
+  (<base>_v0003.jpg) and, when it became the latest, next to the master (<base>_master.jpg)
+- batch and mayapy publishes have no viewport, they simply go without
+- the browser keeps downscaled copies of the thumbnails it has shown in a local disk cache so the share
+  is only read once per thumbnail, named by the source's path, size and mtime so a republish is picked up
+
+"""
+
+import hashlib
+import os
+import tempfile
+
+from asset_compress import logical_name
+from asset_files import replace_file, temp_path_for
+
+THUMBNAIL_EXTENSION = '.jpg'
+CAPTURE_SIZE = 256
+THUMBNAIL_QUALITY = 85
+
+
+def thumbnail_path(scene_path):
+    # Where the thumbnail for a scene lives, compressed versions share the one of their uncompressed name
+    return os.path.splitext(logical_name(scene_path))[0] + THUMBNAIL_EXTENSION
+
+
+def default_cache_directory(settings):
+    return settings.get("thumbnail_cache_directory") or os.path.join(tempfile.gettempdir(), 'baal_thumbnails')
+
+
+def cache_file_name(source_path, stat, size):
+    key = f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime}|{size}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + THUMBNAIL_EXTENSION
+
+
+def capture_thumbnail(cmds, destination_path, size=CAPTURE_SIZE):
+    # Playblast the current frame to destination_path, returns False when there's no viewport to grab it from
+    if cmds.about(batch=True):
+        return False
+    temp_path = temp_path_for(destination_path)
+    try:
+        frame = cmds.currentTime(query=True)
+        written = cmds.playblast(frame=[frame], format='image', compression='jpg', quality=THUMBNAIL_QUALITY,
+                                 completeFilename=temp_path, widthHeight=(size, size), percent=100,
+                                 viewer=False, showOrnaments=False, offScreen=True, forceOverwrite=True)
+        replace_file(written or temp_path, destination_path)
+    except Exception as e:
+        print(f"Warning: Could not capture a thumbnail for {destination_path} ({e}).")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
@@ -0,0 +1,221 @@
+"""
+asset_trace.py
+
+Opt-in tracing of where the store and browser spend their time
+
+- spans around the share reads and writes (directory scans, note reads, checksums, copies) and every
+  maya.cmds call the store makes, each with the path and bytes involved
+- off unless "tracing" is set in settings.json or BAAL_TRACE is set in the environment, span() then hands
+  back one shared object that does nothing, so a traced call costs a function call more than before
+- the session's spans can be written out as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev)
+  and per operation p50/p95 latencies feed the browser's performance panel
+
+    "tracing": true
+
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+# Enough for a long session, the oldest spans go first once it's full
+MAX_EVENTS = 200000
+# Latencies kept per operation for the percentiles
+MAX_SAMPLES = 2000
+
+OperationStats = namedtuple('OperationStats', ['name', 'count', 'p50_ms', 'p95_ms', 'max_ms', 'total_bytes'])
+
+
+class _NullSpan(object):
+    # What span() returns with tracing off
+    __slots__ = ()
+    recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'args', 'start')
+    recording = True
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+    def set(self, **args):
+        # For what is only known once the call is done, bytes read and so on. Anything that costs
+        # a trip to the share to work out should only be asked for when the span is recording
+        self.args.update(args)
+
+
+def percentile(sorted_values, fraction):
+    # Nearest rank percentile of an already sorted list
+    if not sorted_values:
+        return 0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class Tracer(object):
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = False
+        self.origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._samples = {}
+        self._counts = {}
+        self._bytes = {}
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def record(self, name, start, duration, args):
+        with self._lock:
+            self._events.append((name, start, duration, threading.get_ident(), args))
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=MAX_SAMPLES)
+            samples.append(duration)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._bytes[name] = self._bytes.get(name, 0) + (args.get('bytes') or 0)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._samples.clear()
+            self._counts.clear()
+            self._bytes.clear()
+
+    def stats(self):
+        # OperationStats per operation name, slowest p95 first
+        with self._lock:
+            samples = {name: sorted(durations) for name, durations in self._samples.items()}
+            counts = dict(self._counts)
+            total_bytes = dict(self._bytes)
+        stats = [OperationStats(name, counts[name], percentile(durations, 0.5) / 1e6, percentile(durations, 0.95) / 1e6,
+                                durations[-1] / 1e6, total_bytes[name])
+                 for name, durations in samples.items()]
+        return sorted(stats, key=lambda operation: operation.p95_ms, reverse=True)
+
+    def chrome_trace(self):
+        # Trace event format, complete ("X") events in microseconds from when tracing started
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        trace_events = [{'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': thread,
+                         'ts': (start - self.origin) / 1000.0, 'dur': duration / 1000.0, 'args': args}
+                        for name, start, duration, thread, args in events]
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        # Write the session's spans to path as a Chrome trace, returns how many were written
+        trace = self.chrome_trace()
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file, default=str)
+        return len(trace['traceEvents'])
+
+
+# The one tracer everything records to
+tracer = Tracer()
+
+
+def span(name, **args):
+    # with span('fs.scandir', path=directory) as current: ... current.set(entries=len(entries))
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(tracer, name, args)
+
+
+def enable(enabled=True):
+    if enabled and not tracer.enabled:
+        tracer.origin = time.perf_counter_ns()
+    tracer.enabled = bool(enabled)
+
+
+def is_enabled():
+    return tracer.enabled
+
+
+def tracing_requested(settings):
+    return bool(settings.get("tracing") or os.environ.get('BAAL_TRACE'))
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+class TracedCmds(object):
+    # Stands in for maya.cmds while tracing, every call becomes a "cmds.<command>" span.
+    # file calls are named by what they do (cmds.file open, cmds.file save) and carry the file and its size
+    def __init__(self, cmds):
+        self._cmds = cmds
+        self._scene_path = None
+
+    def __getattr__(self, name):
+        function = getattr(self._cmds, name)
+        if not callable(function):
+            return function
+
+        def call(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            if name == 'file':
+                return self._file(function, args, kwargs)
+            with tracer.span(f"cmds.{name}"):
+                return function(*args, **kwargs)
+        return call
+
+    def _file(self, function, args, kwargs):
+        mode = next((flag for flag in ('open', 'o', 'i', 'import', 'save', 'rename', 'new', 'query', 'q')
+                     if kwargs.get(flag)), None)
+        mode = {'o': 'open', 'i': 'import', 'q': 'query'}.get(mode, mode)
+        path = args[0] if args else kwargs.get('rename')
+        with tracer.span(f"cmds.file {mode}" if mode else 'cmds.file', path=path) as current:
+            result = function(*args, **kwargs)
+            if mode == 'rename':
+                self._scene_path = path
+            elif mode in ('open', 'import') and isinstance(path, str):
+                current.set(bytes=file_size(path))
+            elif mode == 'save':
+                saved_path = result if isinstance(result, str) else self._scene_path
+                current.set(path=saved_path, bytes=file_size(saved_path))
+            return result
+
+
+def traced_cmds(cmds):
+    # cmds itself when tracing is off so nothing is in the way
+    return TracedCmds(cmds) if tracer.enabled else cmds
+
+
+# Turned on from the environment for a session without touching the shared settings.json
+if os.environ.get('BAAL_TRACE'):
+    enable()
@@ -0,0 +1,99 @@
+"""
+asset_watcher.py
+
+Directory watcher for the asset store browser
+
+- watches only the directories currently on screen (project, creature, versions and notes folders)
+- QFileSystemWatcher gives instant events for changes made from this machine, a polling fallback
+  compares directory mtimes so publishes made by other artists on a network share still show up
+- bursts of events (a publish writes several files) are coalesced into a single changed signal
+
+"""
+
+import os
+
+from PySide2 import QtCore
+
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_COALESCE_MSECS = 300
+
+
+def _directory_mtimes(directories):
+    mtimes = []
+    for directory in directories:
+        try:
+            mtimes.append((directory, os.stat(directory).st_mtime))
+        except OSError:
+            mtimes.append((directory, None))
+    return mtimes
+
+
+class DirectoryWatcher(QtCore.QObject):
+    # Emitted with the set of watched directories that changed since the last signal
+    changed = QtCore.Signal(object)
+
+    def __init__(self, loader, parent=None, poll_interval=DEFAULT_POLL_INTERVAL, coalesce_msecs=DEFAULT_COALESCE_MSECS):
+        super(DirectoryWatcher, self).__init__(parent)
+        self.loader = loader
+        self._directories = []
+        self._mtimes = {}
+        self._pending = set()
+
+        self._native = QtCore.QFileSystemWatcher(self)
+        self._native.directoryChanged.connect(self._on_event)
+
+        self._coalesce_timer = QtCore.QTimer(self)
+        self._coalesce_timer.setSingleShot(True)
+        self._coalesce_timer.setInterval(coalesce_msecs)
+        self._coalesce_timer.timeout.connect(self._flush)
+
+        # Polling is for shares where nothing tells us about other machines' changes, 0 turns it off
+        self._poll_timer = QtCore.QTimer(self)
+        self._poll_timer.timeout.connect(self._poll)
+        if poll_interval:
+            self._poll_timer.start(int(poll_interval * 1000))
+
+    def watch(self, directories):
+        # Swap the watched set for a new one, directories are handed to the native watcher once the
+        # first poll has stat'ed them off the UI thread, ones that don't exist yet are just polled
+        directories = [os.path.normpath(directory) for directory in directories if directory]
+        if directories == self._directories:
+            return
+        watched = self._native.directories()
+        if watched:
+            self._native.removePaths(watched)
+        self._directories = directories
+        self._mtimes = {directory: mtime for directory, mtime in self._mtimes.items() if directory in directories}
+        self._pending &= set(directories)
+        self._poll(force=True)
+
+    def clear(self):
+        self.watch([])
+
+    def _on_event(self, directory):
+        self._pending.add(os.path.normpath(directory))
+        self._coalesce_timer.start()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        changed = self._pending
+        self._pending = set()
+        self.changed.emit(changed)
+
+    def _poll(self, force=False):
+        if not self._directories or (self.loader.is_loading('watch_poll') and not force):
+            return
+        directories = list(self._directories)
+        self.loader.load('watch_poll', lambda: _directory_mtimes(directories), self._on_polled)
+
+    def _on_polled(self, mtimes):
+        natively_watched = set(os.path.normpath(directory) for directory in self._native.directories())
+        for directory, mtime in mtimes:
+            if directory not in self._directories:
+                continue
+            if directory in self._mtimes and self._mtimes[directory] != mtime:
+                self._on_event(directory)
+            self._mtimes[directory] = mtime
+            if mtime is not None and directory not in natively_watched:
+                self._native.addPath(directory)